@@ -1,6 +1,7 @@
 import os
 from flask import Flask, request, jsonify, make_response, redirect, url_for, flash, render_template, session, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect as sa_inspect, text
 from flask_wtf.csrf import CSRFProtect, validate_csrf, ValidationError, ValidationError as CSRFValidationError, generate_csrf 
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS  # Import Flask-CORS
@@ -10,12 +11,25 @@ from dateutil.relativedelta import relativedelta
 import pdfkit 
 #from weasyprint import HTML
 import pandas as pd
-import joblib
 import numpy as np
 import logging
 import re
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from functools import wraps
+import click
 import bcrypt
+from risk_engine import (patient_levels, lookup_risk_score, risk_modifiers, render_scenario,
+                         table_index, levels_from_index, patch_levels, table_indices, column_levels,
+                         counterfactual_scores, rescore_columns, WHAT_IF_FACTORS, RULES_VERSION,
+                         encode_modifiers, decode_modifiers, load_risk_table, preprocess_answers,
+                         risk_category, assessment_cache_key, RiskResultCache)
+from assessment_schema import ANSWER_COLUMNS, FORM_FIELDS, compile_schema, error_message
+from ml_service import ModelLoader, PredictionBatcher, ShadowScorer, model_features
+from model_registry import RegistryError, current_version, list_versions, promote, promotion_history, rollback
+from recommendations import (general_template_id, personalized_codes, expand_template, expand_codes,
+                             encode_codes, template_id_for_text, codes_for_text)
 
 
 app = Flask(__name__, instance_relative_config=True)
@@ -97,17 +111,27 @@ CORS(app, resources={
 logging.basicConfig(level=logging.INFO, filename='app.log')
 logger = logging.getLogger(__name__)
 
-# Load machine learning models
+# Machine learning models load in the background on first use (see
+# ml_service.ModelLoader), so scripts that only import the app never pay for them
 MODEL_DIR = os.path.join(BASE_DIR, "models")
-try:
-    clf = joblib.load(os.path.join(MODEL_DIR, "rf_classifier_pipeline.pkl"))
-    reg = joblib.load(os.path.join(MODEL_DIR, "rf_regressor_pipeline.pkl"))
-    le = joblib.load(os.path.join(MODEL_DIR, "label_encoder.pkl"))
-    MODELS_AVAILABLE = True
-    logger.info("Machine learning models loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading models: {e}")
-    MODELS_AVAILABLE = False
+# Versioned bundles published by train_model.py; workers serve the promoted
+# one and pick up promotions and rollbacks without a restart
+MODEL_REGISTRY_DIR = os.getenv('ML_REGISTRY_DIR', os.path.join(MODEL_DIR, "registry"))
+model_loader = ModelLoader(MODEL_DIR, registry_dir=MODEL_REGISTRY_DIR,
+                           poll_seconds=float(os.getenv('ML_REGISTRY_POLL_SECONDS', 10)))
+
+# With ML_INLINE_PREDICTIONS the symptom checker also waits for the forest
+# prediction and returns it as ml_prediction; otherwise the models only run in
+# shadow (shadow_scorer below). Inline predictions from concurrent requests
+# run as one batch (see ml_service).
+ML_INLINE_PREDICTIONS = os.getenv('ML_INLINE_PREDICTIONS', 'false').lower() == 'true'
+ml_batcher = PredictionBatcher(model_loader.predict_batch,
+                               max_batch_size=int(os.getenv('ML_MAX_BATCH_SIZE', 32)),
+                               max_wait_ms=float(os.getenv('ML_MAX_WAIT_MS', 5)))
+# How long a request waits for models that are still loading before it
+# answers with the rule score alone
+ML_LOAD_TIMEOUT = float(os.getenv('ML_LOAD_TIMEOUT', 0.5))
+ML_TIMEOUT = float(os.getenv('ML_TIMEOUT', 1.0))
 
 # Database models
 class User(db.Model):
@@ -182,6 +206,10 @@ class Resource(db.Model):
         
         
 class SymptomHistory(db.Model):
+    # Symptom checker form field -> column holding the submitted answer (see
+    # assessment_schema, which also declares how each answer is parsed)
+    ANSWER_COLUMNS = ANSWER_COLUMNS
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     full_name = db.Column(db.String(255), nullable=False)
@@ -215,12 +243,58 @@ class SymptomHistory(db.Model):
     marital_status = db.Column(db.String(20), nullable=False)
     risk_score = db.Column(db.Float, nullable=False)
     risk_category = db.Column(db.String(20), nullable=False)
-    scenario = db.Column(db.Text)
-    predefined_recommendations = db.Column(db.Text)
-    personalized_recommendations = db.Column(db.Text)
+    # Older rows stored the rendered scenario text; new rows store the scenario
+    # id and encoded modifier codes and render the text on demand
+    scenario_text = db.Column('scenario', db.Text)
+    scenario_id = db.Column(db.SmallInteger)
+    risk_modifiers = db.Column(db.String(255))
+    # Older rows stored the recommendation text itself; new rows store a
+    # template id and personalized item codes (see recommendations.py)
+    predefined_recommendations_text = db.Column('predefined_recommendations', db.Text)
+    personalized_recommendations_text = db.Column('personalized_recommendations', db.Text)
+    recommendation_template_id = db.Column(db.SmallInteger)
+    personalized_codes = db.Column(db.String(64))
+    # Flat risk table index (see risk_engine.table_index): every level the
+    # rules read, so an edited answer can be re-scored without the others
+    risk_levels = db.Column(db.Integer)
+    # Set on assessments re-scored from an earlier one; answer_patch holds
+    # the fields that changed, as JSON
+    parent_id = db.Column(db.Integer, db.ForeignKey('symptom_history.id'))
+    answer_patch = db.Column(db.Text)
+    # risk_engine.RULES_VERSION the score was computed under
+    rules_version = db.Column(db.Integer)
     feedback_text = db.Column(db.Text, nullable=True)
     feedback_submitted = db.Column(db.Boolean, default=False)
     logged_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def scenario(self):
+        if self.scenario_text or self.scenario_id is None:
+            return self.scenario_text
+        return render_scenario(self.scenario_id, decode_modifiers(self.risk_modifiers))
+
+    def to_patient_data(self):
+        """The answers as the symptom checker form submitted them"""
+        data = {field: getattr(self, column) for field, column in self.ANSWER_COLUMNS.items()
+                if getattr(self, column) is not None}
+        data['dob'] = self.dob.isoformat()
+        return data
+
+    @property
+    def predefined_recommendations(self):
+        if self.recommendation_template_id is None:
+            return self.predefined_recommendations_text
+        return expand_template(self.recommendation_template_id)
+
+    @property
+    def personalized_recommendation_list(self):
+        if self.personalized_codes is None:
+            return self.personalized_recommendations_text.split('\n') if self.personalized_recommendations_text else []
+        return list(expand_codes(self.personalized_codes))
+
+    @property
+    def personalized_recommendations(self):
+        return '\n'.join(self.personalized_recommendation_list)
     
     def to_dict(self):
         return {
@@ -259,12 +333,49 @@ class SymptomHistory(db.Model):
             'risk_category': self.risk_category,
             'scenario': self.scenario,
             'predefined_recommendations': self.predefined_recommendations,
-            'personalized_recommendations': (self.personalized_recommendations or '').split('\n') if self.personalized_recommendations else [],
+            'personalized_recommendations': self.personalized_recommendation_list,
             'feedback_text': self.feedback_text,
             'feedback_submitted': self.feedback_submitted,
+            'parent_id': self.parent_id,
             'logged_at': self.logged_at.isoformat()
         }
 
+
+# Compiled once against the table, so NOT NULL and length limits are checked
+# before the insert instead of failing it
+validate_assessment = compile_schema(SymptomHistory.__table__)
+
+
+class RescoreCheckpoint(db.Model):
+    """Last assessment id committed by the history backfill for a rules version"""
+    rules_version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class MLShadowDisagreement(db.Model):
+    """An assessment where the shadow forest prediction disagreed with the rule score"""
+    id = db.Column(db.Integer, primary_key=True)
+    history_id = db.Column(db.Integer, db.ForeignKey('symptom_history.id'), nullable=True, index=True)
+    model_version = db.Column(db.String(64), nullable=True)
+    rule_category = db.Column(db.String(20), nullable=False)
+    rule_score = db.Column(db.Float, nullable=False)
+    ml_category = db.Column(db.String(20), nullable=False)
+    ml_score = db.Column(db.Float, nullable=False)
+    probabilities = db.Column(db.Text, nullable=True)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class MLShadowWindow(db.Model):
+    """Shadow agreement counts for one model version over one flush window"""
+    id = db.Column(db.Integer, primary_key=True)
+    model_version = db.Column(db.String(64), nullable=True)
+    window_start = db.Column(db.DateTime, nullable=False, index=True)
+    window_end = db.Column(db.DateTime, nullable=False)
+    compared = db.Column(db.Integer, nullable=False)
+    category_agreements = db.Column(db.Integer, nullable=False)
+    score_within_tolerance = db.Column(db.Integer, nullable=False)
+    abs_score_error_sum = db.Column(db.Float, nullable=False)
+    confusion = db.Column(db.Text, nullable=False)  # JSON: rule category -> ML category -> count
+
 # Role-based access control decorator
 def role_required(allowed_roles):
     def decorator(f):
@@ -297,48 +408,82 @@ def role_required(allowed_roles):
         return decorated_function
     return decorator
 
-# Risk calculation functions (unchanged)
+# Most submissions share a small number of answer combinations, so full
+# results are cached by their canonical answers
+risk_cache = RiskResultCache(maxsize=int(os.getenv('RISK_CACHE_SIZE', 4096)))
+
+# Risk calculation functions
 def calculate_risk_and_recommendations(patient_data):
-    processed_data = preprocess_patient_data(patient_data)
-    risk_score, scenario = calculate_risk_score(processed_data)
-    risk_category = "Low risk" if risk_score < 40 else "Medium risk" if risk_score < 65 else "High risk"
-    recommendations = generate_recommendations(risk_category, processed_data)
+    return assess_answers(preprocess_patient_data(patient_data))
+
+def assess_answers(processed_data):
+    """Full assessment for already preprocessed answers, served from the cache when possible"""
+    cache_key = assessment_cache_key(processed_data)
+    result = risk_cache.get(cache_key)
+    if result is None:
+        result = assess_levels(patient_levels(processed_data), processed_data)
+        risk_cache.put(cache_key, result)
+    # Callers get their own lists so they cannot change the cached entry
+    return dict(result, personalized_recommendations=list(result["personalized_recommendations"]),
+                risk_modifiers=list(result["risk_modifiers"]))
+
+def assess_levels(levels, patient_data):
+    """Score, explanation and recommendations for one patient's rule levels"""
+    risk_score = lookup_risk_score(levels)
+    scenario_id, modifiers = risk_modifiers(levels)
+    category = risk_category(risk_score)
+    recommendations = generate_recommendations(category, patient_data)
     return {
         "risk_score": risk_score,
-        "risk_category": risk_category,
+        "risk_category": category,
         "predefined_recommendations": recommendations["general"],
         "personalized_recommendations": recommendations["personalized"],
-        "scenario": scenario
+        "recommendation_template_id": recommendations["template_id"],
+        "personalized_codes": recommendations["personalized_codes"],
+        "scenario_id": scenario_id,
+        "risk_modifiers": modifiers,
+        "risk_levels": table_index(levels)
     }
 
-def preprocess_patient_data(patient_data):
-    processed = {}
-    boolean_fields = ["abnormal_vaginal_bleeding", "abnormal_vaginal_discharge", 
-                      "lower_abdominal_pain", "change_in_periods", "dyspareunia",
-                      "weight_loss", "unusual_fatigue", "is_post_coital_or_post_menopausal",
-                      "hiv_positive", "abnormal_pap_smear", "high_parity"]
-    for field in boolean_fields:
-        if field in patient_data:
-            processed[field] = str(patient_data[field]).lower() in ["yes", "true", "1", "y"]
-    
-    if "age" in patient_data:
-        processed["age"] = int(patient_data["age"])
-    elif "dob" in patient_data:
-        processed["age"] = calculate_age(patient_data["dob"])
-    
-    if "parity" in patient_data:
+def ml_prediction_result(future):
+    """Forest prediction for a queued request, or None if it is not ready in time"""
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=ML_TIMEOUT)
+    except Exception as e:
+        future.cancel()
+        logger.error(f"ML prediction unavailable: {str(e) or type(e).__name__}")
+        return None
+
+def store_shadow_results(disagreements, windows):
+    """Write one flush of shadow results in a single transaction (runs on the shadow thread)"""
+    with app.app_context():
         try:
-            processed["parity"] = int(patient_data["parity"])
-        except ValueError:
-            processed["parity"] = 5 if ">=5" in str(patient_data["parity"]) else 0
-    
-    text_fields = ["bleeding_type", "sexual_partners", "smoking", 
-                   "marital_status", "oral_contraceptive_use", "age_first_intercourse"]
-    for field in text_fields:
-        if field in patient_data:
-            processed[field] = patient_data[field]
-    
-    return processed
+            db.session.bulk_insert_mappings(MLShadowDisagreement, [
+                dict(row, probabilities=json.dumps(row['probabilities'])) for row in disagreements])
+            db.session.bulk_insert_mappings(MLShadowWindow, [
+                dict(window, window_start=datetime.utcfromtimestamp(window['window_start']),
+                     window_end=datetime.utcfromtimestamp(window['window_end']),
+                     confusion=json.dumps(window['confusion'])) for window in windows])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+# Forest predictions run in shadow: compared with the rule score off the
+# request thread, never shown to users or waited for (see ml_service)
+shadow_scorer = ShadowScorer(model_loader.predict_batch, store_shadow_results,
+                             ready=lambda: model_loader.available,
+                             model_version=lambda: model_loader.version,
+                             max_queue=int(os.getenv('ML_SHADOW_QUEUE_SIZE', 1000)),
+                             flush_seconds=float(os.getenv('ML_SHADOW_FLUSH_SECONDS', 30)),
+                             flush_size=int(os.getenv('ML_SHADOW_FLUSH_SIZE', 200)),
+                             score_tolerance=float(os.getenv('ML_SHADOW_SCORE_TOLERANCE', 10)))
+def preprocess_patient_data(patient_data):
+    # Booleans, age and parity are parsed and categorical answers become small
+    # integer codes, the same way for every caller of the rules (see risk_engine)
+    return preprocess_answers(patient_data)
 
 def calculate_age(dob):
     """Calculate age from a date string (YYYY-MM-DD) or a datetime.date object."""
@@ -360,6 +505,19 @@ def calculate_age(birth_date):
     today = datetime.now().date()
     return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
 
+@app.before_request
+def start_model_loading():
+    # Whatever server runs the app, the first request starts the loader
+    model_loader.start()
+
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """503 while the models are still loading; 200 once loading has finished,
+    with models.ready false if it failed and only rule scores are served"""
+    status = model_loader.status()
+    finished = status['state'] in ('ready', 'failed')
+    return jsonify({'success': finished, 'models': status}), 200 if finished else 503
+
 @app.route('/api/session-debug', methods=['GET'])
 def session_debug():
     """Debug route to check session status"""
@@ -391,238 +549,17 @@ def session_debug():
             'error': str(e)
         }), 500
 
-def calculate_risk_score(data):
-    has_bleeding = data.get("abnormal_vaginal_bleeding", False)
-    has_discharge = data.get("abnormal_vaginal_discharge", False)
-    has_pain = data.get("lower_abdominal_pain", False)
-    bleeding_type = data.get("bleeding_type", "")
-    is_post_coital_or_post_menopausal = data.get("is_post_coital_or_post_menopausal", False)
-    if not is_post_coital_or_post_menopausal and bleeding_type:
-        is_post_coital_or_post_menopausal = any(type_str in str(bleeding_type).lower() 
-                                               for type_str in ["post-coital", "post-menopausal", "postcoital", "postmenopausal"])
-    
-    scenario = ""
-    if has_bleeding and has_discharge and has_pain:
-        risk = 95.0
-        scenario = "Scenario 1: All three primary symptoms present"
-    elif has_bleeding and has_discharge and not has_pain:
-        risk = 76.0 if is_post_coital_or_post_menopausal else 50.0
-        scenario = "Scenario 2: Bleeding and discharge without pain"
-    elif has_bleeding and not has_discharge and not has_pain:
-        risk = 76.0 if is_post_coital_or_post_menopausal else 50.0
-        scenario = "Scenario 3: Bleeding only"
-    elif not has_bleeding and has_discharge and not has_pain:
-        risk = 40.0
-        scenario = "Scenario 4: Discharge only"
-    elif not has_bleeding and has_discharge and has_pain:
-        risk = 45.0
-        scenario = "Scenario 5: Discharge and pain without bleeding"
-    elif has_bleeding and not has_discharge and has_pain:
-        risk = 70.0 if is_post_coital_or_post_menopausal else 50.0
-        scenario = "Scenario 6: Bleeding and pain without discharge"
-    elif not has_bleeding and not has_discharge and has_pain:
-        risk = 30.0
-        scenario = "Scenario 7: Pain only"
-    else:
-        risk = 0.0
-        scenario = "Scenario 8: No primary symptoms"
-    
-    age = data.get("age", 35)
-    if age < 20:
-        scenario_1 = has_bleeding and has_discharge and has_pain
-        post_coital_bleeding = has_bleeding and is_post_coital_or_post_menopausal
-        if not (scenario_1 or post_coital_bleeding):
-            risk = 10.0
-            scenario += " (modified for young age)"
-    
-    risk_modifiers = []
-    if data.get("change_in_periods", False):
-        risk += 2.0
-        risk_modifiers.append("Change in periods (+2%)")
-    if data.get("dyspareunia", False):
-        risk += 5.0
-        risk_modifiers.append("Painful intercourse (+5%)")
-    if data.get("weight_loss", False) and data.get("unusual_fatigue", False):
-        risk += 20.0
-        risk_modifiers.append("Weight loss and fatigue (+20%)")
-    else:
-        if data.get("weight_loss", False):
-            risk += 5.0
-            risk_modifiers.append("Weight loss (+5%)")
-        if data.get("unusual_fatigue", False):
-            risk += 5.0
-            risk_modifiers.append("Unusual fatigue (+5%)")
-    
-    sexual_partners = data.get("sexual_partners", "")
-    if "1-3" in str(sexual_partners):
-        risk += 2.0
-        risk_modifiers.append("1-3 sexual partners (+2%)")
-    elif "4-7" in str(sexual_partners):
-        risk += 5.0
-        risk_modifiers.append("4-7 sexual partners (+5%)")
-    elif ">8" in str(sexual_partners) or "8+" in str(sexual_partners):
-        risk += 10.0
-        risk_modifiers.append(">8 sexual partners (+10%)")
-    
-    smoking = data.get("smoking", "")
-    if "1-9/day" in str(smoking):
-        risk += 5.0
-        risk_modifiers.append("Smoking 1-9/day (+5%)")
-    elif "10-19/day" in str(smoking):
-        risk += 10.0
-        risk_modifiers.append("Smoking 10-19/day (+10%)")
-    elif ">20/day" in str(smoking) or "20+" in str(smoking):
-        risk += 15.0
-        risk_modifiers.append("Smoking 20+/day (+15%)")
-    
-    marital_status = str(data.get("marital_status", "")).lower()
-    if "single" in marital_status or "divorced" in marital_status:
-        risk += 2.0
-        risk_modifiers.append(f"Marital status: {marital_status} (+2%)")
-    
-    contraceptive_use = str(data.get("oral_contraceptive_use", ""))
-    if "5-9 years" in contraceptive_use:
-        risk += 5.0
-        risk_modifiers.append("Oral contraceptive use 5-9 years (+5%)")
-    elif ">10 years" in contraceptive_use or "10+" in contraceptive_use:
-        risk += 10.0
-        risk_modifiers.append("Oral contraceptive use 10+ years (+10%)")
-    
-    first_intercourse_age = str(data.get("age_first_intercourse", ""))
-    if "<16 years" in first_intercourse_age:
-        risk += 10.0
-        risk_modifiers.append("First intercourse <16 years (+10%)")
-    elif "17-20 years" in first_intercourse_age:
-        risk += 5.0
-        risk_modifiers.append("First intercourse 17-20 years (+5%)")
-    elif ">21 years" in first_intercourse_age:
-        risk += 2.0
-        risk_modifiers.append("First intercourse >21 years (+2%)")
-    
-    if data.get("abnormal_pap_smear", False):
-        risk += 50.0
-        risk_modifiers.append("Abnormal pap smear history (+50%)")
-    
-    if data.get("high_parity", False) or data.get("parity", 0) >= 5:
-        risk += 5.0
-        risk_modifiers.append("High parity (5+ births) (+5%)")
-    
-    if data.get("hiv_positive", False):
-        hiv_modifier = min(risk * 0.5, 99.0 - risk)
-        risk += hiv_modifier
-        risk_modifiers.append(f"HIV positive (+{hiv_modifier:.1f}%)")
-    
-    risk = min(risk, 99.0)
-    if age < 20:
-        scenario_1 = has_bleeding and has_discharge and has_pain
-        post_coital_bleeding = has_bleeding and is_post_coital_or_post_menopausal
-        if not (scenario_1 or post_coital_bleeding):
-            if risk > 30.0:
-                risk = 30.0
-                risk_modifiers.append("Risk capped at 30% for young patients")
-    
-    if risk_modifiers:
-        scenario += " | Modifiers: " + ", ".join(risk_modifiers)
-    
-    return round(risk, 1), scenario
-
 def generate_recommendations(risk_category, patient_data):
-    recommendations = {
-        "general": "",
-        "personalized": []
+    # Template ids and item codes are what gets stored; the text comes from
+    # the registry in recommendations.py
+    template_id = general_template_id(risk_category)
+    codes = encode_codes(personalized_codes(patient_data))
+    return {
+        "template_id": template_id,
+        "personalized_codes": codes,
+        "general": expand_template(template_id),
+        "personalized": list(expand_codes(codes))
     }
-    age = patient_data.get("age", 35)
-    
-    if risk_category == "Low risk":
-        recommendations["general"] = """
-        Based on your responses, your risk of cervical cancer is low.
-        
-        Over 99% of cervical cancer cases are caused by the human papillomavirus (HPV). The good news is that HPV is preventable.
-        
-        To protect yourself:
-        • Get the HPV vaccine if you haven't already and you are under 45
-        • Use condoms every time you have sex to lower your risk of infection
-        • Keep healthy habits—exercise, don't smoke, eat well, treat STIs early
-        • If you notice unusual vaginal bleeding, discharge, or pain, see your doctor right away
-        
-        If you're aged 21 to 65 and haven't been screened for cervical cancer, it's time to take that step. Screening options include:
-        • HPV DNA test
-        • Pap test
-        • VIA (Visual Inspection with Acetic Acid)
-        
-        If it's been over 3 years since your last Pap test or over 5 years since your last VIA or HPV DNA test, you're due for another one.
-        
-        Next step: Please book a check-up with your doctor to review your symptoms and get screened if needed. It's quick, and it will make a big difference in your health.
-        
-        Small prevention dey save big wahala.
-        """
-        
-    elif risk_category == "Medium risk":
-        recommendations["general"] = """
-        Based on your responses, your risk of cervical cancer is medium.
-        
-        We recommend that you schedule an appointment with your healthcare provider within the next 2-4 weeks. Discuss your symptoms and risk factors with your doctor.
-        • You may need further testing such as a pelvic exam, HPV test, or colposcopy
-        
-        Over 99% of cervical cancer cases are caused by the human papillomavirus (HPV). The good news is that HPV is preventable.
-        
-        To protect yourself:
-        • Get the HPV vaccine if you haven't already and you are under 45
-        • Use condoms every time you have sex to lower your risk of infection
-        • Keep healthy habits—exercise, don't smoke, eat well, treat STIs early
-        • If you notice unusual vaginal bleeding, discharge, or pain, see your doctor right away
-        
-        If you're aged 21 to 65 and haven't been screened for cervical cancer, it's time to take that step. Screening options include:
-        • HPV DNA test
-        • Pap test
-        • VIA (Visual Inspection with Acetic Acid)
-        
-        If it's been over 3 years since your last Pap test or over 5 years since your last VIA or HPV DNA test, you're due for another one.
-        
-        Next step: Please book a check-up with your doctor to review your symptoms and get screened if needed. It's quick, and it will make a big difference in your health.
-        
-        Small prevention dey save big wahala.
-        """
-        
-    else:  # High risk
-        recommendations["general"] = """
-        Based on your responses, your risk for cervical cancer is high.
-        
-        While other causes of your symptoms are possible, we strongly recommend that you contact your healthcare provider immediately (within the next week) for a full evaluation. A referral to a gynecologist may be necessary, and diagnostic testing such as a VIA, pap, colposcopy or biopsy is recommended. 
-        
-        Taking action now helps you get answers faster—and gives you the best chance at staying healthy. Early diagnosis can significantly improve outcomes.
-        """
-    
-    # Generate personalized recommendations based on patient data
-    personalized = []
-    
-    # Existing personalized logic maintained
-    if patient_data.get("abnormal_pap_smear", False):
-        personalized.append("Follow up on your abnormal Pap test results with your healthcare provider")
-    
-    if patient_data.get("hiv_positive", False):
-        personalized.append("As an HIV-positive individual, you should receive more frequent cervical screening. Consult your HIV care provider")
-    
-    smoking = patient_data.get("smoking", "")
-    # Only add smoking cessation advice if user actually smokes
-    if smoking and str(smoking).lower() not in ["", "no", "non-smoker", "never", "none"]:
-        if any(keyword in str(smoking).lower() for keyword in ["yes", "smoke", "smoker", "cigarette", "tobacco"]):
-            personalized.append("Consider smoking cessation as smoking increases cervical cancer risk")
-    
-    # Updated HPV vaccine recommendation to align with new guidelines (under 45)
-    if age < 45:
-        personalized.append("If you haven't received the HPV vaccine, discuss this option with your healthcare provider")
-    
-    if patient_data.get("abnormal_vaginal_bleeding", False) and patient_data.get("is_post_coital_or_post_menopausal", False):
-        personalized.append("Post-coital or post-menopausal bleeding requires prompt medical evaluation")
-    
-    if patient_data.get("weight_loss", False) and patient_data.get("unusual_fatigue", False):
-        personalized.append("Your weight loss and fatigue should be evaluated by a healthcare provider")
-    
-
-    
-    recommendations["personalized"] = personalized
-    return recommendations
     
     
 # CSRF token endpoint
@@ -1197,7 +1134,7 @@ def screening_recommendations():
                 'risk_category': latest_assessment.risk_category,
                 'scenario': latest_assessment.scenario,
                 'predefined_recommendations': latest_assessment.predefined_recommendations,
-                'personalized_recommendations': latest_assessment.personalized_recommendations.split('\n') if latest_assessment.personalized_recommendations else [],
+                'personalized_recommendations': latest_assessment.personalized_recommendation_list,
                 'assessment_date': latest_assessment.logged_at.strftime('%B %d, %Y')
             }
             recommendations.append(rec_obj)
@@ -1328,56 +1265,31 @@ def symptom_checker():
             logger.warning("Missing X-Requested-With header")
             return jsonify({'success': False, 'message': 'Invalid request'}), 400
 
-        required_fields = ['full_name', 'dob', 'ethnicity']
-        missing_fields = [field for field in required_fields if field not in data or not data[field]]
-        if missing_fields:
-            logger.warning(f"Missing fields: {missing_fields}")
-            return jsonify({'success': False, 'message': f'Missing fields: {", ".join(missing_fields)}'}), 400
-
-        try:
-            dob = datetime.strptime(data.get('dob'), "%Y-%m-%d").date()
-            age = calculate_age(data.get('dob'))
-        except ValueError:
-            logger.warning("Invalid DOB format")
-            return jsonify({'success': False, 'message': 'Invalid DOB format (YYYY-MM-DD)'}), 400
-
-        result = calculate_risk_and_recommendations(data)
+        # One pass over the payload: every field error at once, then the
+        # column values to store and the answers to score
+        record, errors = validate_assessment(data)
+        if errors:
+            logger.warning(f"Invalid assessment: {errors}")
+            return jsonify({'success': False, 'message': error_message(errors), 'errors': errors}), 400
+
+        features = model_features(data, record['answers'])
+        # Inline predictions are queued first so they run while the rules score
+        ml_future = ml_batcher.submit(features) \
+            if ML_INLINE_PREDICTIONS and model_loader.wait(ML_LOAD_TIMEOUT) else None
+        result = assess_answers(record['answers'])
         symptom_history = SymptomHistory(
             user_id=user_id,
-            full_name=data.get('full_name'),
-            dob=dob,
-            age=age,
+            age=record['age'],
             gender='Female',
-            ethnicity=data.get('ethnicity'),
-            ethnicity_other_input=data.get('ethnicity_other_input'),
-            abnormal_bleeding=data.get('abnormal_vaginal_bleeding'),
-            bleeding_type=data.get('bleeding_type'),
-            post_coital_or_post_menopausal=data.get('is_post_coital_or_post_menopausal'),
-            abnormal_discharge=data.get('abnormal_vaginal_discharge'),
-            pelvic_pain=data.get('lower_abdominal_pain'),
-            painful_intercourse=data.get('dyspareunia'),
-            menstrual_changes=data.get('change_in_periods'),
-            weight_loss=data.get('weight_loss'),
-            fatigue=data.get('unusual_fatigue'),
-            pregnant=data.get('is_pregnant'),
-            num_sexual_partners=data.get('sexual_partners'),
-            age_first_intercourse=data.get('age_first_intercourse'),
-            contraceptive_use=data.get('oral_contraceptive_use'),
-            contraceptive_duration=data.get('contraceptive_years'),
-            smoking_status=data.get('smoking'),
-            cigarettes_per_day=data.get('cigarettes_per_day'),
-            pap_smear_history=data.get('had_pap_smear'),
-            abnormal_pap_result=data.get('abnormal_pap_smear'),
-            hiv_status=data.get('hiv_status'),
-            hiv_positive=data.get('hiv_positive'),
-            parity=data.get('parity'),
-            high_parity=data.get('high_parity'),
-            marital_status=data.get('marital_status'),
+            **record['columns'],
             risk_score=result['risk_score'],
             risk_category=result['risk_category'],
-            scenario=result['scenario'],
-            predefined_recommendations=result['predefined_recommendations'],
-            personalized_recommendations='\n'.join(result['personalized_recommendations']),
+            scenario_id=result['scenario_id'],
+            risk_modifiers=encode_modifiers(result['risk_modifiers']),
+            recommendation_template_id=result['recommendation_template_id'],
+            personalized_codes=result['personalized_codes'],
+            risk_levels=result['risk_levels'],
+            rules_version=RULES_VERSION,
             feedback_submitted=False,
             logged_at=datetime.utcnow()
         )
@@ -1391,21 +1303,125 @@ def symptom_checker():
             logger.error(f"Error saving assessment: {str(e)}")
             return jsonify({'success': False, 'message': f'Error saving assessment: {str(e)}'}), 500
 
+        response_data = {
+            'id': symptom_history.id, # Add the ID of the newly created entry
+            'risk_score': result['risk_score'],
+            'risk_category': result['risk_category'],
+            'scenario': render_scenario(result['scenario_id'], result['risk_modifiers']),
+            'predefined_recommendations': result['predefined_recommendations'],
+            'personalized_recommendations': result['personalized_recommendations'],
+        }
+        ml_prediction = None
+        if ML_INLINE_PREDICTIONS:
+            ml_prediction = response_data['ml_prediction'] = ml_prediction_result(ml_future)
+        # Never blocks: dropped if the shadow queue is full
+        shadow_scorer.submit(symptom_history.id, features, result['risk_category'], result['risk_score'],
+                             prediction=ml_prediction)
+
         return jsonify({
             'success': True,
             'message': 'Symptom analysis completed and saved',
+            'data': response_data
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error in symptom-checker: {str(e)}")
+        return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
+
+@app.route('/api/symptom-checker/<int:assessment_id>/rescore', methods=['POST'])
+def rescore_assessment(assessment_id):
+    """Re-score an earlier assessment with a few answers changed. Only the
+    levels fed by the changed answers are derived again, and the result is
+    saved as a new assessment linked to the earlier one."""
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'success': False, 'message': 'Please log in'}), 401
+        if not request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({'success': False, 'message': 'Invalid request'}), 400
+
+        data = request.get_json(silent=True) or {}
+        changes = data.get('changes')
+        if not isinstance(changes, dict) or not changes:
+            return jsonify({'success': False, 'message': 'No changes provided'}), 400
+        unknown_fields = [field for field in changes if field not in FORM_FIELDS]
+        if unknown_fields:
+            return jsonify({'success': False, 'message': f'Unknown fields: {", ".join(unknown_fields)}'}), 400
+
+        parent = SymptomHistory.query.filter_by(id=assessment_id, user_id=user_id).first()
+        if not parent:
+            return jsonify({'success': False, 'message': 'Assessment not found'}), 404
+
+        answers = parent.to_patient_data()
+        answers.update(changes)
+        # The merged answers are checked and parsed like a new submission, so
+        # a change cannot store a missing, non-scalar or over-long value, and
+        # the stored columns and scored answers come from the same record
+        record, errors = validate_assessment(answers)
+        if errors:
+            logger.warning(f"Invalid changes to assessment {parent.id}: {errors}")
+            return jsonify({'success': False, 'message': error_message(errors), 'errors': errors}), 400
+        age = record['age']
+
+        if parent.risk_levels is None or parent.rules_version != RULES_VERSION:
+            # Assessed before levels were stored, or stored in the table
+            # layout of older rules
+            levels = patient_levels(record['answers'])
+        else:
+            changed_fields = set(changes)
+            if age != parent.age:
+                changed_fields.add('dob')
+            levels, _ = patch_levels(levels_from_index(parent.risk_levels), answers, changed_fields)
+
+        # Recommendations read the rule levels plus the age and the submitted post-coital flag
+        recommendation_data = dict(levels, age=age, is_post_coital_or_post_menopausal=record['answers'].get(
+            'is_post_coital_or_post_menopausal', False))
+        result = assess_levels(levels, recommendation_data)
+
+        symptom_history = SymptomHistory(
+            user_id=user_id,
+            age=age,
+            gender=parent.gender,
+            **record['columns'],
+            risk_score=result['risk_score'],
+            risk_category=result['risk_category'],
+            scenario_id=result['scenario_id'],
+            risk_modifiers=encode_modifiers(result['risk_modifiers']),
+            recommendation_template_id=result['recommendation_template_id'],
+            personalized_codes=result['personalized_codes'],
+            risk_levels=result['risk_levels'],
+            rules_version=RULES_VERSION,
+            parent_id=parent.id,
+            answer_patch=json.dumps(changes),
+            feedback_submitted=False,
+            logged_at=datetime.utcnow()
+        )
+
+        try:
+            db.session.add(symptom_history)
+            db.session.commit()
+            logger.info(f"Re-scored assessment {parent.id} as {symptom_history.id} for user_id: {user_id}")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving re-scored assessment: {str(e)}")
+            return jsonify({'success': False, 'message': 'Error saving assessment'}), 500
+
+        return jsonify({
+            'success': True,
+            'message': 'Assessment re-scored and saved',
             'data': {
-                'id': symptom_history.id, # Add the ID of the newly created entry
+                'id': symptom_history.id,
+                'parent_id': parent.id,
                 'risk_score': result['risk_score'],
                 'risk_category': result['risk_category'],
-                'scenario': result['scenario'],
+                'scenario': render_scenario(result['scenario_id'], result['risk_modifiers']),
                 'predefined_recommendations': result['predefined_recommendations'],
                 'personalized_recommendations': result['personalized_recommendations']
             }
         }), 200
 
     except Exception as e:
-        logger.error(f"Error in symptom-checker: {str(e)}")
+        logger.error(f"Error re-scoring assessment {assessment_id}: {str(e)}")
         return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
 
 @app.route('/api/submit-feedback', methods=['POST'])
@@ -1675,6 +1691,64 @@ def provider_patients():
         logger.error(f"Error rendering provider dashboard: {str(e)}")
         return redirect(url_for('login'))
 
+@app.route('/api/provider/what-if', methods=['POST'])
+@role_required(['admin', 'provider'])
+def what_if_analysis():
+    """How much each modifiable factor adds to the score of many assessments,
+    plus the score at every level of each factor. Without assessment_ids the
+    latest assessment of every patient is used."""
+    try:
+        data = request.get_json(silent=True) or {}
+        assessment_ids = data.get('assessment_ids')
+        query = db.session.query(SymptomHistory.id, SymptomHistory.user_id, SymptomHistory.risk_levels,
+                                 SymptomHistory.rules_version)
+        if assessment_ids is not None:
+            if not isinstance(assessment_ids, list) or not all(isinstance(i, int) for i in assessment_ids):
+                return jsonify({'success': False, 'message': 'assessment_ids must be a list of integers'}), 400
+            query = query.filter(SymptomHistory.id.in_(assessment_ids))
+        else:
+            latest_ids = db.session.query(db.func.max(SymptomHistory.id)).group_by(SymptomHistory.user_id)
+            query = query.filter(SymptomHistory.id.in_(latest_ids))
+        rows = query.order_by(SymptomHistory.id).all()
+
+        assessments = []
+        if rows:
+            # Indices stored under older rules are in another table layout
+            indices = np.array([row.risk_levels if row.risk_levels is not None and row.rules_version == RULES_VERSION
+                                else -1 for row in rows], dtype=np.int64)
+            missing = indices < 0
+            if missing.any():
+                # Assessed before levels were stored or under older rules;
+                # derive them from the answers
+                legacy = SymptomHistory.query.filter(
+                    SymptomHistory.id.in_([row.id for row, is_missing in zip(rows, missing) if is_missing])
+                ).order_by(SymptomHistory.id).all()
+                indices[missing] = table_indices(column_levels(pd.DataFrame([h.to_patient_data() for h in legacy])))
+
+            risk_score, what_if = counterfactual_scores(indices)
+            contributions = {name: (risk_score - scores[:, 0]).tolist() for name, scores in what_if.items()}
+            what_if = {name: scores.tolist() for name, scores in what_if.items()}
+            risk_score = risk_score.tolist()
+            for i, row in enumerate(rows):
+                assessments.append({
+                    'id': row.id,
+                    'user_id': row.user_id,
+                    'risk_score': risk_score[i],
+                    'contributions': {name: contributions[name][i] for name in contributions},
+                    'what_if': {name: what_if[name][i] for name in what_if}
+                })
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'factor_levels': WHAT_IF_FACTORS,
+                'assessments': assessments
+            }
+        }), 200
+    except Exception as e:
+        logger.error(f"What-if analysis error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to run what-if analysis'}), 500
+
 
 
 
@@ -1831,6 +1905,117 @@ def usage_stats():
         logger.error(f"Error getting usage stats: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to retrieve usage stats.'}), 500
 
+@app.route('/api/admin/risk-cache-stats', methods=['GET'])
+@role_required(['admin'])
+def risk_cache_stats():
+    try:
+        return jsonify({'success': True, 'stats': risk_cache.stats()}), 200
+    except Exception as e:
+        logger.error(f"Error getting risk cache stats: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to retrieve risk cache stats.'}), 500
+
+@app.route('/api/admin/ml-batch-stats', methods=['GET'])
+@role_required(['admin'])
+def ml_batch_stats():
+    try:
+        return jsonify({'success': True, 'models': model_loader.status(), 'stats': ml_batcher.stats()}), 200
+    except Exception as e:
+        logger.error(f"Error getting ML batch stats: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to retrieve ML batch stats.'}), 500
+
+@app.route('/api/admin/ml-shadow', methods=['GET'])
+@role_required(['admin'])
+def ml_shadow_stats():
+    """Shadow agreement since this worker started, stored totals per model
+    version across all workers, and the latest disagreements"""
+    try:
+        limit = min(request.args.get('limit', 20, type=int), 200)
+        versions = db.session.query(
+            MLShadowWindow.model_version,
+            db.func.sum(MLShadowWindow.compared),
+            db.func.sum(MLShadowWindow.category_agreements),
+            db.func.sum(MLShadowWindow.score_within_tolerance),
+            db.func.sum(MLShadowWindow.abs_score_error_sum),
+            db.func.min(MLShadowWindow.window_start),
+            db.func.max(MLShadowWindow.window_end),
+        ).group_by(MLShadowWindow.model_version).all()
+        stored = [{
+            'model_version': version,
+            'compared': compared,
+            'category_agreement': round(agreements / compared, 4) if compared else None,
+            'score_agreement': round(within / compared, 4) if compared else None,
+            'mean_abs_score_error': round(error_sum / compared, 2) if compared else None,
+            'first_seen': first.isoformat() if first else None,
+            'last_seen': last.isoformat() if last else None,
+        } for version, compared, agreements, within, error_sum, first, last in versions]
+        recent = MLShadowDisagreement.query.order_by(MLShadowDisagreement.id.desc()).limit(limit).all()
+        return jsonify({
+            'success': True,
+            'worker': shadow_scorer.stats(),
+            'versions': stored,
+            'recent_disagreements': [{
+                'history_id': row.history_id,
+                'model_version': row.model_version,
+                'rule_category': row.rule_category,
+                'rule_score': row.rule_score,
+                'ml_category': row.ml_category,
+                'ml_score': row.ml_score,
+                'probabilities': json.loads(row.probabilities) if row.probabilities else None,
+                'created_at': row.created_at.isoformat() if row.created_at else None,
+            } for row in recent],
+        }), 200
+    except Exception as e:
+        logger.error(f"Error getting ML shadow stats: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to retrieve ML shadow stats.'}), 500
+
+@app.route('/api/admin/models', methods=['GET'])
+@role_required(['admin'])
+def list_model_versions():
+    try:
+        return jsonify({
+            'success': True,
+            'current': current_version(MODEL_REGISTRY_DIR),
+            'loaded': model_loader.status(),
+            'versions': list_versions(MODEL_REGISTRY_DIR),
+            'history': promotion_history(MODEL_REGISTRY_DIR),
+        }), 200
+    except Exception as e:
+        logger.error(f"Error listing model versions: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to list model versions.'}), 500
+
+@app.route('/api/admin/models/promote', methods=['POST'])
+@role_required(['admin'])
+def promote_model_version():
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    if not version or not isinstance(version, str):
+        return jsonify({'success': False, 'message': 'version is required'}), 400
+    try:
+        promote(MODEL_REGISTRY_DIR, version, by=session.get('user_id'))
+    except RegistryError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except Exception as e:
+        logger.error(f"Error promoting model version {version}: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to promote model version.'}), 500
+    # This worker switches now, the others at their next poll
+    model_loader.reload_async()
+    logger.info(f"Model version {version} promoted by user {session.get('user_id')}")
+    return jsonify({'success': True, 'message': f'Promoted model version {version}', 'current': version}), 200
+
+@app.route('/api/admin/models/rollback', methods=['POST'])
+@role_required(['admin'])
+def rollback_model_version():
+    try:
+        version = rollback(MODEL_REGISTRY_DIR, by=session.get('user_id'))
+    except RegistryError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except Exception as e:
+        logger.error(f"Error rolling back model version: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to roll back model version.'}), 500
+    model_loader.reload_async()
+    logger.info(f"Model version rolled back to {version} by user {session.get('user_id')}")
+    return jsonify({'success': True, 'message': f'Rolled back to model version {version}', 'current': version}), 200
+
 @app.route('/api/admin/error-logs', methods=['GET'])
 @role_required(['admin'])
 def error_logs():
@@ -2275,8 +2460,189 @@ def reset_password():
         return jsonify({'success': False, 'message': 'An unexpected error occurred.'}), 500
 
 
+def add_missing_columns():
+    """create_all only creates missing tables, so add nullable columns that
+    were introduced after a table was first created"""
+    inspector = sa_inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                logger.info(f"Added column {table.name}.{column.name}")
+
+
+def migrate_recommendation_text(batch_size=1000):
+    """Replace recommendation text stored on older assessments with template
+    ids and item codes. Rows whose text matches no template are left as-is."""
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(
+            SymptomHistory.id,
+            SymptomHistory.predefined_recommendations_text,
+            SymptomHistory.personalized_recommendations_text
+        ).filter(
+            SymptomHistory.id > last_id,
+            db.or_(
+                db.and_(SymptomHistory.recommendation_template_id.is_(None),
+                        SymptomHistory.predefined_recommendations_text.isnot(None)),
+                db.and_(SymptomHistory.personalized_codes.is_(None),
+                        SymptomHistory.personalized_recommendations_text.isnot(None))
+            )
+        ).order_by(SymptomHistory.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        mappings = []
+        for row_id, general_text, personalized_text in rows:
+            mapping = {'id': row_id}
+            template_id = template_id_for_text(general_text)
+            if template_id is not None:
+                mapping.update(recommendation_template_id=template_id, predefined_recommendations_text=None)
+            codes = codes_for_text(personalized_text)
+            if codes is not None:
+                mapping.update(personalized_codes=encode_codes(codes), personalized_recommendations_text=None)
+            if len(mapping) > 1:
+                mappings.append(mapping)
+
+        db.session.bulk_update_mappings(SymptomHistory, mappings)
+        db.session.commit()
+        migrated += len(mappings)
+
+    if migrated:
+        logger.info(f"Migrated recommendation text on {migrated} assessments")
+    return migrated
+
+
+@app.cli.command('migrate-recommendations')
+def migrate_recommendations_command():
+    """Move stored recommendation text to template ids and item codes"""
+    db.create_all()
+    add_missing_columns()
+    print(f"Migrated {migrate_recommendation_text()} assessments")
+
+
+def _stale_assessment_chunks(after_id, chunk_size):
+    """Yield (ids, answer columns) for assessments not yet scored under the
+    current rules, in primary key order, chunk_size rows at a time"""
+    fields = ['age'] + list(SymptomHistory.ANSWER_COLUMNS)
+    columns = [SymptomHistory.id, SymptomHistory.age] + \
+        [getattr(SymptomHistory, column) for column in SymptomHistory.ANSWER_COLUMNS.values()]
+    stale = db.or_(SymptomHistory.rules_version.is_(None), SymptomHistory.rules_version != RULES_VERSION)
+
+    def chunk(rows):
+        values = list(zip(*rows))
+        return list(values[0]), dict(zip(fields, values[1:]))
+
+    if db.engine.dialect.supports_server_side_cursors:
+        # One streaming query on its own connection; results are written
+        # and committed through the session
+        query = db.select(*columns).where(SymptomHistory.id > after_id, stale).order_by(SymptomHistory.id)
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(query)
+            for rows in result.partitions(chunk_size):
+                yield chunk(rows)
+    else:
+        # No server-side cursors (SQLite): page by primary key instead
+        while True:
+            query = db.select(*columns).where(SymptomHistory.id > after_id, stale) \
+                .order_by(SymptomHistory.id).limit(chunk_size)
+            rows = db.session.execute(query).all()
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            yield chunk(rows)
+
+
+def _save_rescored_chunk(ids, scores):
+    mappings = [{
+        'id': row_id,
+        'risk_score': scores['risk_score'][i],
+        'risk_category': scores['risk_category'][i],
+        'scenario_id': scores['scenario_id'][i],
+        'risk_modifiers': scores['risk_modifiers'][i],
+        'risk_levels': scores['risk_levels'][i],
+        # Advice follows the new category
+        'recommendation_template_id': scores['recommendation_template_id'][i],
+        'personalized_codes': scores['personalized_codes'][i],
+        # Legacy rows stored rendered text; it is rendered from the codes now
+        'scenario_text': None,
+        'predefined_recommendations_text': None,
+        'personalized_recommendations_text': None,
+        'rules_version': RULES_VERSION
+    } for i, row_id in enumerate(ids)]
+    db.session.bulk_update_mappings(SymptomHistory, mappings)
+
+    checkpoint = db.session.get(RescoreCheckpoint, RULES_VERSION)
+    if checkpoint is None:
+        checkpoint = RescoreCheckpoint(rules_version=RULES_VERSION)
+        db.session.add(checkpoint)
+    checkpoint.last_id = ids[-1]
+    db.session.commit()
+
+
+def backfill_risk_scores(chunk_size=2000, workers=None):
+    """
+    Re-score every assessment not yet scored under the current RULES_VERSION
+    from its stored answers. Chunks are scored in a process pool and written
+    back with bulk UPDATEs in id order; each commit records the last id, so an
+    interrupted run resumes after the last committed chunk. Recommendation
+    template ids and personalized codes are derived again with the scores, so
+    a row whose category changes also gets that category's advice.
+    """
+    checkpoint = db.session.get(RescoreCheckpoint, RULES_VERSION)
+    after_id = checkpoint.last_id if checkpoint else 0
+    chunks = _stale_assessment_chunks(after_id, chunk_size)
+    rescored = 0
+
+    if workers is not None and workers <= 1:
+        for ids, answers in chunks:
+            _save_rescored_chunk(ids, rescore_columns(answers))
+            rescored += len(ids)
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_risk_table) as pool:
+            # Keep a few chunks in flight and commit them in order
+            pending = deque()
+            max_pending = 2 * workers
+            for ids, answers in chunks:
+                pending.append((ids, pool.submit(rescore_columns, answers)))
+                if len(pending) >= max_pending:
+                    done_ids, future = pending.popleft()
+                    _save_rescored_chunk(done_ids, future.result())
+                    rescored += len(done_ids)
+            while pending:
+                done_ids, future = pending.popleft()
+                _save_rescored_chunk(done_ids, future.result())
+                rescored += len(done_ids)
+
+    logger.info(f"Re-scored {rescored} assessments under rules v{RULES_VERSION}")
+    return rescored
+
+
+@app.cli.command('rescore-history')
+@click.option('--chunk-size', default=2000, show_default=True, help='Assessments per chunk')
+@click.option('--workers', default=None, type=int, help='Scoring processes (default: CPU count, 1 to run inline)')
+def rescore_history_command(chunk_size, workers):
+    """Re-score stored assessments after the risk rules change"""
+    db.create_all()
+    add_missing_columns()
+    print(f"Re-scored {backfill_risk_scores(chunk_size, workers)} assessments under rules v{RULES_VERSION}")
+
+
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
+        add_missing_columns()
+        migrate_recommendation_text()
+    model_loader.start()
+    load_risk_table()
     logger.info("Starting Flask application...")
     app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 8000)))
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Declarative schema for symptom checker payloads.
+
+ASSESSMENT_FIELDS lists every answer the form submits, the symptom_history
+column it is stored in and how it is parsed. compile_schema binds the list to
+the table once at startup and returns a single-pass validator: each field is
+read and parsed once, every error is collected, and the result is a typed
+record holding both the column values to persist and the preprocessed
+answers the risk engine scores (the same dict preprocess_answers builds).
+
+Every write path that stores answers from a client goes through it: new
+symptom checker submissions and re-scored assessments, whose stored answers
+merged with the edits are validated as a whole.
+"""
+
+from datetime import datetime
+
+from risk_engine import TRUE_STRINGS, age_from_dob, encode_answers, parse_parity
+
+TEXT = "text"      # stored as submitted
+DATE = "date"      # YYYY-MM-DD; also gives the patient's age
+FLAG = "flag"      # yes/no answer, scored as a boolean
+CHOICE = "choice"  # categorical answer, scored as a risk_engine code
+PARITY = "parity"  # number of children, or a ">=5 children" style answer
+
+# (form field, column, kind, must be non-empty). Whether an answer may be
+# missing and how long it may be come from the column itself.
+ASSESSMENT_FIELDS = (
+    ("full_name", "full_name", TEXT, True),
+    ("dob", "dob", DATE, True),
+    ("ethnicity", "ethnicity", TEXT, True),
+    ("ethnicity_other_input", "ethnicity_other_input", TEXT, False),
+    ("abnormal_vaginal_bleeding", "abnormal_bleeding", FLAG, False),
+    ("bleeding_type", "bleeding_type", CHOICE, False),
+    ("is_post_coital_or_post_menopausal", "post_coital_or_post_menopausal", FLAG, False),
+    ("abnormal_vaginal_discharge", "abnormal_discharge", FLAG, False),
+    ("lower_abdominal_pain", "pelvic_pain", FLAG, False),
+    ("dyspareunia", "painful_intercourse", FLAG, False),
+    ("change_in_periods", "menstrual_changes", FLAG, False),
+    ("weight_loss", "weight_loss", FLAG, False),
+    ("unusual_fatigue", "fatigue", FLAG, False),
+    ("is_pregnant", "pregnant", TEXT, False),
+    ("sexual_partners", "num_sexual_partners", CHOICE, False),
+    ("age_first_intercourse", "age_first_intercourse", CHOICE, False),
+    ("oral_contraceptive_use", "contraceptive_use", CHOICE, False),
+    ("contraceptive_years", "contraceptive_duration", CHOICE, False),
+    ("smoking", "smoking_status", CHOICE, False),
+    ("cigarettes_per_day", "cigarettes_per_day", CHOICE, False),
+    ("had_pap_smear", "pap_smear_history", TEXT, False),
+    ("abnormal_pap_smear", "abnormal_pap_result", FLAG, False),
+    ("hiv_status", "hiv_status", TEXT, False),
+    ("hiv_positive", "hiv_positive", FLAG, False),
+    ("parity", "parity", PARITY, False),
+    ("high_parity", "high_parity", FLAG, False),
+    ("marital_status", "marital_status", CHOICE, False),
+)
+
+# Every form field, and form field -> column for every answer stored as
+# submitted (all but dob)
+FORM_FIELDS = frozenset(field for field, _, _, _ in ASSESSMENT_FIELDS)
+ANSWER_COLUMNS = {field: column for field, column, kind, _ in ASSESSMENT_FIELDS if kind != DATE}
+
+SCALAR_TYPES = (str, int, float, bool)
+MISSING = "Missing field"
+
+
+def compile_schema(table, fields=ASSESSMENT_FIELDS):
+    """
+    Build the validator for `fields` stored in `table` (a SQLAlchemy Table).
+    The validator takes the raw payload and returns (record, errors): record
+    has "columns", "answers", "dob" and "age", errors maps each bad field to
+    a message and is empty when the payload is valid.
+    """
+    true_strings = frozenset(TRUE_STRINGS)
+    steps = []
+    for field, column_name, kind, non_empty in fields:
+        column = table.columns[column_name]
+        required = non_empty or not column.nullable
+        max_length = getattr(column.type, "length", None) if kind != DATE else None
+        steps.append((field, column_name, kind, non_empty, required, max_length))
+    steps = tuple(steps)
+
+    def validate(data):
+        columns = {}
+        answers = {}
+        errors = {}
+        dob = age = None
+        for field, column_name, kind, non_empty, required, max_length in steps:
+            value = data.get(field)
+            if value is None or (non_empty and value == ""):
+                if required:
+                    errors[field] = MISSING
+                columns[column_name] = value
+                continue
+            if not isinstance(value, SCALAR_TYPES):
+                errors[field] = f"{field} must be a single value"
+                continue
+            if max_length is not None and len(str(value)) > max_length:
+                errors[field] = f"{field} must be at most {max_length} characters"
+                continue
+
+            if kind == FLAG:
+                answers[field] = str(value).lower() in true_strings
+            elif kind == PARITY:
+                answers["parity"] = parse_parity(value)
+            elif kind == DATE:
+                try:
+                    dob = datetime.strptime(value, "%Y-%m-%d").date()
+                except (TypeError, ValueError):
+                    errors[field] = "Invalid DOB format (YYYY-MM-DD)"
+                    continue
+                age = age_from_dob(dob)
+                value = dob
+            columns[column_name] = value
+
+        if errors:
+            return None, errors
+
+        if age is not None:
+            answers["age"] = age
+        answers.update(encode_answers(data))
+        return {"columns": columns, "answers": answers, "dob": dob, "age": age}, {}
+
+    return validate
+
+
+def error_message(errors):
+    """One line summary of a validator's errors for API responses"""
+    missing = [field for field, message in errors.items() if message == MISSING]
+    messages = [f'Missing fields: {", ".join(missing)}'] if missing else []
+    messages.extend(message for message in errors.values() if message != MISSING)
+    return "; ".join(messages)
@@ -0,0 +1,147 @@
+"""
+Score survey exports in bulk.
+
+Reads a CSV in the column layout of cervical_cancer_synthetic_data_*.csv (or
+the symptom checker's field names) in fixed-size chunks, scores each chunk
+with the vectorized engine and appends it to the output as it goes, so memory
+stays flat however large the input is. Each output row has the same results
+calculate_risk_and_recommendations gives for that patient: risk score and
+category, scenario id, recommendation template id and personalized item
+codes. --text adds the recommendation text and --modifiers the encoded score
+modifiers (walking the rules per patient costs most of the run time).
+
+    python batch_score.py export.csv scored.csv
+    python batch_score.py export.csv scored.parquet --chunk-size 200000
+
+Parquet output needs pyarrow.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+from recommendations import expand_codes, expand_template, general_template_ids, personalized_code_columns
+from risk_engine import (answer_levels, column_answers, load_risk_table, modifier_columns, risk_categories,
+                         scenario_ids, table_indices)
+
+
+def score_chunk(chunk, keep_columns=(), text=False, modifiers=False):
+    """Scored DataFrame for one chunk of raw answers"""
+    answers = column_answers(chunk)
+    levels = answer_levels(answers)
+    indices = table_indices(levels)
+    risk_score = load_risk_table()[indices] / 10.0
+    category = risk_categories(risk_score)
+
+    scored = pd.DataFrame({column: chunk[column].to_numpy() for column in keep_columns if column in chunk})
+    scored["risk_score"] = risk_score
+    scored["risk_category"] = category
+    scored["scenario_id"] = scenario_ids(levels)
+    if modifiers:
+        scored["risk_modifiers"] = modifier_columns(indices)[1]
+    scored["recommendation_template_id"] = general_template_ids(category)
+    scored["personalized_codes"] = personalized_code_columns(answers)
+    if text:
+        scored["predefined_recommendations"] = scored["recommendation_template_id"].map(expand_template)
+        scored["personalized_recommendations"] = scored["personalized_codes"].map(
+            lambda codes: "\n".join(expand_codes(codes)))
+    return scored
+
+
+class CsvSink:
+    def __init__(self, path):
+        self.path = path
+        self.header = True
+
+    def write(self, frame):
+        frame.to_csv(self.path, mode="w" if self.header else "a", header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        pass
+
+
+class ParquetSink:
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.path = path
+        self.writer = None
+
+    def write(self, frame):
+        table = self.pyarrow.Table.from_pandas(frame, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def open_sink(path):
+    if path.endswith(".parquet"):
+        try:
+            return ParquetSink(path)
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+    return CsvSink(path)
+
+
+def score_file(input_path, output_path, chunk_size=100_000, keep_columns=("patient_id",), text=False,
+               modifiers=False, progress=True):
+    """Stream input_path through the engine into output_path; returns the number of rows scored"""
+    load_risk_table()
+    total_bytes = os.path.getsize(input_path)
+    sink = open_sink(output_path)
+    rows = 0
+    start = time.perf_counter()
+    # Every value is read as text, as the symptom checker submits it, so a
+    # column's dtype never depends on which rows landed in a chunk
+    with open(input_path, newline="") as source:
+        try:
+            for chunk in pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False):
+                try:
+                    scored = score_chunk(chunk, keep_columns, text, modifiers)
+                except ValueError as e:
+                    raise SystemExit(f"Rows {rows + 1}-{rows + len(chunk)} of {input_path}: {e}")
+                sink.write(scored)
+                rows += len(chunk)
+                if progress:
+                    elapsed = time.perf_counter() - start
+                    print(f"{rows:,} rows ({source.tell() / total_bytes:.0%}) "
+                          f"{rows / elapsed:,.0f} rows/sec", file=sys.stderr)
+        finally:
+            sink.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV export to score")
+    parser.add_argument("output", help="output file; .parquet writes Parquet, anything else CSV")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="rows read and scored at a time")
+    parser.add_argument("--keep-columns", default="patient_id",
+                        help="comma separated input columns copied to the output (default: patient_id)")
+    parser.add_argument("--text", action="store_true", help="also write the recommendation text")
+    parser.add_argument("--modifiers", action="store_true", help="also write the encoded score modifiers")
+    parser.add_argument("--quiet", action="store_true", help="no progress output")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    keep_columns = [column for column in args.keep_columns.split(",") if column]
+    rows = score_file(args.input, args.output, args.chunk_size, keep_columns, args.text, args.modifiers,
+                      not args.quiet)
+    elapsed = time.perf_counter() - start
+    print(f"Scored {rows:,} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:,.0f} rows/sec) "
+          f"into {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+# app.py falls back to the production database when DATABASE_URL is unset;
+# tests always get a throwaway in-memory one
+os.environ["DATABASE_URL"] = "sqlite://"
+
+ASSESSMENT = {
+    "full_name": "Test Patient",
+    "dob": "1985-06-15",
+    "ethnicity": "Other",
+    "abnormal_vaginal_bleeding": "yes",
+    "bleeding_type": "intermenstrual",
+    "is_post_coital_or_post_menopausal": "no",
+    "abnormal_vaginal_discharge": "no",
+    "lower_abdominal_pain": "no",
+    "dyspareunia": "no",
+    "change_in_periods": "yes",
+    "weight_loss": "no",
+    "unusual_fatigue": "no",
+    "is_pregnant": "no",
+    "sexual_partners": "1–3",
+    "age_first_intercourse": "16–20 years",
+    "oral_contraceptive_use": "no",
+    "smoking": "Never",
+    "had_pap_smear": "yes",
+    "abnormal_pap_smear": "no",
+    "hiv_status": "negative",
+    "hiv_positive": "no",
+    "parity": "<5 children",
+    "high_parity": "no",
+    "marital_status": "Married",
+}
+HEADERS = {"X-Requested-With": "XMLHttpRequest"}
+
+
+@pytest.fixture
+def app_db():
+    from app import app, db
+    with app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app_db):
+    from app import User, app
+    user = User(username="patient", password="x", state="Lagos", city="Ikeja", email="patient@example.com",
+                occupation="Teacher", has_cancer="no", is_aware="yes", has_screening="no")
+    app_db.session.add(user)
+    app_db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user.id
+    return client
@@ -0,0 +1,207 @@
+"""
+Encoded training data cached on disk, keyed by content.
+
+Parsing the CSV, filling bleeding_type, splitting and fitting the imputers
+and one-hot encoder give the same result every time the data file and the
+preprocessing settings are unchanged. load_features does that work once and
+saves the result as .npy files under FEATURE_CACHE_DIR, in a directory named
+after a hash of the data file's contents and of those settings; later runs
+memory-map them instead.
+
+    feature_cache/3f2a9c0d1e2b4a5c/
+        meta.json                   key, settings, classes, columns, shapes
+        preprocessor.pkl            the preprocessor fitted on the training split
+        X_train.npy, X_test.npy     encoded features (float32)
+        y_category_*.npy            category codes (meta.json has the labels)
+        y_score_*.npy               risk scores
+        raw_test/                   test split as load_data returns it, per column
+
+Changing the data, the feature lists, the preprocessor, the split or
+CACHE_FORMAT gives a new key, so a stale entry is never read.
+
+    python feature_cache.py             build or load the cache and show it
+    python feature_cache.py --clear     delete every entry
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+
+from model_registry import file_sha256
+import train_model
+
+CACHE_DIR = os.getenv("FEATURE_CACHE_DIR", "feature_cache")
+# Bump when load_data or the files written here change
+CACHE_FORMAT = 1
+META_FILE = "meta.json"
+PREPROCESSOR_FILE = "preprocessor.pkl"
+RAW_TEST_DIR = "raw_test"
+SPLITS = ("train", "test")
+
+
+def cache_settings(data_file):
+    """Everything the encoded data depends on"""
+    return {
+        "format": CACHE_FORMAT,
+        "data_sha256": file_sha256(data_file),
+        "numerical_features": train_model.numerical_features,
+        "categorical_features": train_model.categorical_features,
+        "preprocessor": json.dumps(train_model.build_preprocessor().get_params(deep=True), default=repr,
+                                   sort_keys=True),
+        "test_size": train_model.TEST_SIZE,
+        "random_state": train_model.RANDOM_STATE,
+        "sklearn_version": sklearn.__version__,
+    }
+
+
+def cache_key(settings):
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def _save_frame(directory, frame):
+    # Numbers and booleans as they are; text as fixed-width strings plus a
+    # mask of the missing values, so nothing needs pickling
+    os.makedirs(directory)
+    columns = []
+    for i, column in enumerate(frame.columns):
+        values = frame[column]
+        if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+            np.save(os.path.join(directory, f"{i}.npy"), values.to_numpy())
+            columns.append({"column": column, "text": False})
+        else:
+            np.save(os.path.join(directory, f"{i}.npy"), values.fillna("").to_numpy(dtype=str))
+            np.save(os.path.join(directory, f"{i}.missing.npy"), values.isna().to_numpy())
+            columns.append({"column": column, "text": True})
+    return columns
+
+
+def _load_frame(directory, columns):
+    data = {}
+    for i, item in enumerate(columns):
+        values = np.load(os.path.join(directory, f"{i}.npy"), mmap_mode="r")
+        if item["text"]:
+            values = values.astype(object)
+            values[np.load(os.path.join(directory, f"{i}.missing.npy"))] = np.nan
+        data[item["column"]] = values
+    return pd.DataFrame(data)
+
+
+class Features:
+    """
+    One cache entry: preprocessor, X_train/X_test (memory-mapped),
+    y_category_train/test (labels), y_score_train/test, raw_test (DataFrame),
+    columns and categories.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.key = self.meta["key"]
+        self.columns = self.meta["columns"]
+        self.categories = self.meta["classes"]
+        self.preprocessor = joblib.load(os.path.join(directory, PREPROCESSOR_FILE))
+        classes = np.array(self.categories, dtype=object)
+        for split in SPLITS:
+            setattr(self, f"X_{split}", self.array(f"X_{split}"))
+            setattr(self, f"y_category_{split}", classes[self.array(f"y_category_{split}")])
+            setattr(self, f"y_score_{split}", self.array(f"y_score_{split}"))
+        self.raw_test = _load_frame(os.path.join(directory, RAW_TEST_DIR), self.meta["raw_test_columns"])
+
+    def array(self, name):
+        return np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+
+
+def build_features(directory, settings, data_file, verbose=False):
+    """Load, split and encode data_file into directory"""
+    X, y_category, y_score = train_model.load_data(data_file, verbose=verbose)
+    X_train, X_test, y_category_train, y_category_test, y_score_train, y_score_test = train_model.split_data(
+        X, y_category, y_score)
+    preprocessor = train_model.build_preprocessor().fit(X_train)
+    classes = sorted(y_category.unique().tolist())
+
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    # Written aside and renamed into place, so a reader never sees half an entry
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=parent)
+    try:
+        for split, X_split, y_category_split, y_score_split in (
+                ("train", X_train, y_category_train, y_score_train), ("test", X_test, y_category_test, y_score_test)):
+            encoded = preprocessor.transform(X_split)
+            encoded = encoded.toarray() if hasattr(encoded, "toarray") else encoded
+            # Forests fit and predict on float32, so they take this without a copy
+            np.save(os.path.join(staging, f"X_{split}.npy"), np.ascontiguousarray(encoded, dtype=np.float32))
+            np.save(os.path.join(staging, f"y_category_{split}.npy"),
+                    np.searchsorted(classes, y_category_split.to_numpy(dtype=str)))
+            np.save(os.path.join(staging, f"y_score_{split}.npy"), y_score_split.to_numpy(dtype=np.float64))
+        joblib.dump(preprocessor, os.path.join(staging, PREPROCESSOR_FILE))
+        meta = {
+            "key": cache_key(settings),
+            "settings": settings,
+            "data_file": data_file,
+            "columns": X.columns.tolist(),
+            "classes": classes,
+            "rows": {"train": len(X_train), "test": len(X_test)},
+            "n_features": int(encoded.shape[1]),
+            "raw_test_columns": _save_frame(os.path.join(staging, RAW_TEST_DIR), X_test),
+            "created_at": time.time(),
+        }
+        with open(os.path.join(staging, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+        os.chmod(staging, 0o755)
+        try:
+            os.rename(staging, directory)
+        except OSError:
+            # Another run built the same entry first
+            if not os.path.isfile(os.path.join(directory, META_FILE)):
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def load_features(data_file=train_model.DATA_FILE, cache_dir=CACHE_DIR, refresh=False, verbose=False):
+    """Features for data_file, from the cache when it has them; verbose also prints load_data's summary"""
+    settings = cache_settings(data_file)
+    directory = os.path.join(cache_dir, cache_key(settings)[:16])
+    if refresh and os.path.isdir(directory):
+        shutil.rmtree(directory)
+    if not os.path.isfile(os.path.join(directory, META_FILE)):
+        start = time.perf_counter()
+        build_features(directory, settings, data_file, verbose)
+        print(f"Encoded features cached in {directory} ({time.perf_counter() - start:.2f}s)", file=sys.stderr)
+    else:
+        print(f"Using encoded features cached in {directory}", file=sys.stderr)
+    return Features(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--data", default=train_model.DATA_FILE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--refresh", action="store_true", help="rebuild the entry for --data")
+    parser.add_argument("--clear", action="store_true", help="delete every cached entry")
+    args = parser.parse_args(argv)
+    if args.clear:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+        print(f"Removed {args.cache_dir}")
+        return 0
+    start = time.perf_counter()
+    features = load_features(args.data, args.cache_dir, args.refresh)
+    elapsed = time.perf_counter() - start
+    print(f"{features.directory}: {features.meta['rows']['train']:,} training and {features.meta['rows']['test']:,} "
+          f"test rows, {features.meta['n_features']} encoded features, loaded in {elapsed * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Check and time the flat forest exports against the sklearn pipelines.
+
+Exports the pickled pipelines in the model directory to a scratch directory
+(model_artifacts.py), then on sample rows (the held-out rows in the feature
+cache, or --sample-csv) checks that the exports' class probabilities and
+scores match the pipelines' within --tolerance, and times both through the
+app's prediction function: latency of single-row calls and throughput of
+batches. Exits 1 when outputs differ.
+
+    python forest_benchmark.py
+    python forest_benchmark.py --model-dir /tmp/models --single-calls 2000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from ml_service import COMBINED_MODEL, FEATURE_COLUMNS, FOREST_DIRS, MODEL_FILES, predictor_for
+from model_artifacts import export_forest, load_forest
+
+
+def latencies_ms(predict_batch, rows, calls):
+    timings = []
+    for i in range(calls):
+        start = time.perf_counter()
+        predict_batch([rows[i % len(rows)]])
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return np.percentile(timings, [50, 99])
+
+
+def rows_per_second(predict_batch, rows, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        predict_batch(rows[i:i + batch_size])
+    return len(rows) / (time.perf_counter() - start)
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=os.path.join(here, "models"), help="directory with the pickles")
+    parser.add_argument("--sample-csv", default=None, help="rows to use instead of the cached held-out rows")
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="largest allowed absolute difference")
+    parser.add_argument("--single-calls", type=int, default=500, help="single-row calls timed")
+    parser.add_argument("--batch-sizes", default="32,1000,10000", help="comma separated batch sizes timed")
+    args = parser.parse_args()
+
+    import joblib
+    # The single score forest when the directory has one, as load_models does
+    names = [COMBINED_MODEL] if os.path.exists(os.path.join(args.model_dir, MODEL_FILES[COMBINED_MODEL])) \
+        else ["classifier", "regressor"]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        pipelines = {name: joblib.load(os.path.join(args.model_dir, MODEL_FILES[name])) for name in names}
+    scratch = tempfile.mkdtemp(prefix="forest-export-")
+    try:
+        exports = {}
+        for name, pipeline in pipelines.items():
+            start = time.perf_counter()
+            export_forest(pipeline, os.path.join(scratch, FOREST_DIRS[name]))
+            exports[name] = load_forest(os.path.join(scratch, FOREST_DIRS[name]))
+            print(f"Exported {name} in {time.perf_counter() - start:.2f}s "
+                  f"({exports[name].meta['n_trees']} trees, depth {exports[name].meta['max_depth']})")
+
+        if args.sample_csv:
+            sample = pd.read_csv(args.sample_csv)
+            sample["bleeding_type"] = sample["bleeding_type"].fillna("none")
+        else:
+            from feature_cache import load_features
+            sample = load_features().raw_test
+        frame = sample[FEATURE_COLUMNS]
+        rows = frame.to_dict("records")
+
+        regressor = "regressor" if "regressor" in pipelines else COMBINED_MODEL
+        differences = {
+            "risk_score": np.abs(pipelines[regressor].predict(frame) - exports[regressor].predict(rows)).max(),
+        }
+        category_mismatches = 0
+        if "classifier" in pipelines:
+            differences["probabilities"] = np.abs(pipelines["classifier"].predict_proba(frame)
+                                                  - exports["classifier"].predict_proba(rows)).max()
+            category_mismatches = int((pipelines["classifier"].predict(frame)
+                                       != exports["classifier"].predict(rows)).sum())
+        print(f"\n{len(rows):,} rows: largest difference "
+              + ", ".join(f"{value:.3g} ({name.replace('_', ' ')})" for name, value in differences.items())
+              + f"; {category_mismatches} category mismatches")
+
+        predictors = {"pipeline": predictor_for(pipelines), "flat": predictor_for(exports)}
+        batch_sizes = [int(size) for size in args.batch_sizes.split(",") if size]
+        print(f"\n{'predictor':<10}{'p50 ms':>9}{'p99 ms':>9}"
+              + "".join(f"{f'rows/s @{size}':>16}" for size in batch_sizes))
+        for name, predict_batch in predictors.items():
+            p50, p99 = latencies_ms(predict_batch, rows, args.single_calls)
+            throughput = [rows_per_second(predict_batch, rows, size) for size in batch_sizes]
+            print(f"{name:<10}{p50:>9.2f}{p99:>9.2f}" + "".join(f"{value:>16,.0f}" for value in throughput))
+
+        if max(differences.values()) > args.tolerance or category_mismatches:
+            print("\nFlat exports do not match the pipelines", file=sys.stderr)
+            return 1
+        return 0
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
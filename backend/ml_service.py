@@ -0,0 +1,584 @@
+"""
+RandomForest predictions served next to the rule score.
+
+ModelLoader loads the models in a background thread, so importing the app
+costs nothing and a booting worker serves rule scores while they load. The
+forests are memory-mapped from the flat arrays train_model.py exports
+(model_artifacts.py), so every worker shares one copy of the trees; the
+pickles are the fallback when no export exists. Given a model registry it
+serves the promoted bundle and swaps in newly promoted ones while running.
+A model directory may hold one risk score forest instead of the classifier
+and regressor; the category then comes from the score (score_predictor).
+
+ShadowScorer runs the models in shadow on live assessments: off the request
+thread, comparing them with the rule score and storing what it finds in
+batches.
+
+Most of the cost of a single sklearn Pipeline.predict is per call overhead
+(DataFrame construction, the ColumnTransformer, the one-hot step), not the
+trees. PredictionBatcher collects requests from concurrent threads for up
+to a few milliseconds and runs them through the models as one batch, so
+that overhead is paid once per batch instead of once per request. The flat
+exports have almost none of it: they encode the feature dicts directly.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+from model_artifacts import FlatForest, is_forest_dir, load_forest
+from model_registry import bundle_dir, current_version
+from risk_engine import (BLEEDING_NONE, BLEEDING_INTERMENSTRUAL, BLEEDING_POST_COITAL, BLEEDING_POST_MENOPAUSAL,
+                         BLEEDING_HEAVIER, POST_COITAL_BLEEDING, PARTNERS_NONE, PARTNERS_1_3, PARTNERS_4_7,
+                         PARTNERS_8_PLUS, SMOKING_NONE, SMOKING_1_9, SMOKING_10_19, SMOKING_20_PLUS, MARITAL_OTHER,
+                         MARITAL_SINGLE, MARITAL_DIVORCED, CONTRACEPTIVE_UNDER_5, CONTRACEPTIVE_5_9,
+                         CONTRACEPTIVE_10_PLUS, FIRST_INTERCOURSE_UNDER_16, FIRST_INTERCOURSE_16_20,
+                         FIRST_INTERCOURSE_21_PLUS, risk_categories)
+
+logger = logging.getLogger(__name__)
+
+# Columns the pipelines were fitted on (train_model.py), in order
+FEATURE_COLUMNS = [
+    "age", "abnormal_vaginal_bleeding", "abnormal_vaginal_discharge", "lower_abdominal_pain", "bleeding_type",
+    "is_post_coital_or_post_menopausal", "change_in_periods", "dyspareunia", "weight_loss", "unusual_fatigue",
+    "sexual_partners", "smoking", "marital_status", "oral_contraceptive_use", "age_first_intercourse",
+    "abnormal_pap_smear", "parity", "high_parity", "hiv_positive",
+]
+FLAG_FEATURES = ("abnormal_vaginal_bleeding", "abnormal_vaginal_discharge", "lower_abdominal_pain",
+                 "change_in_periods", "dyspareunia", "weight_loss", "unusual_fatigue", "abnormal_pap_smear",
+                 "hiv_positive")
+
+# Canonical code -> the spelling the training CSV uses. Codes with no
+# training spelling get one the one-hot step has never seen, which it ignores.
+BLEEDING_TYPE_LABELS = {BLEEDING_NONE: "none", BLEEDING_INTERMENSTRUAL: "intermenstrual",
+                        BLEEDING_POST_COITAL: "post-coital", BLEEDING_POST_MENOPAUSAL: "post-menopausal",
+                        BLEEDING_HEAVIER: "longer periods"}
+PARTNER_LABELS = {PARTNERS_NONE: "0", PARTNERS_1_3: "1-3", PARTNERS_4_7: "4-7", PARTNERS_8_PLUS: ">8"}
+SMOKING_LABELS = {SMOKING_NONE: "non-smoker", SMOKING_1_9: "1-9/day", SMOKING_10_19: "10-19/day",
+                  SMOKING_20_PLUS: ">20/day"}
+MARITAL_LABELS = {MARITAL_OTHER: "married", MARITAL_SINGLE: "single", MARITAL_DIVORCED: "divorced"}
+CONTRACEPTIVE_LABELS = {CONTRACEPTIVE_UNDER_5: "<5 years", CONTRACEPTIVE_5_9: "5-9 years",
+                        CONTRACEPTIVE_10_PLUS: ">10 years"}
+FIRST_INTERCOURSE_LABELS = {FIRST_INTERCOURSE_UNDER_16: "<16 years", FIRST_INTERCOURSE_16_20: "17-20 years",
+                            FIRST_INTERCOURSE_21_PLUS: ">21 years"}
+NO_CONTRACEPTIVES = ("", "none", "no")
+
+
+def model_features(patient_data, answers):
+    """
+    One feature row in the training CSV's vocabulary. `patient_data` is the
+    raw payload and `answers` its preprocessed form (preprocess_answers).
+    """
+    features = {field: bool(answers.get(field, False)) for field in FLAG_FEATURES}
+    bleeding_type = answers.get("bleeding_type", BLEEDING_NONE)
+    parity = answers.get("parity", 0)
+    contraceptive = answers.get("oral_contraceptive_use", CONTRACEPTIVE_UNDER_5)
+    # The codes do not tell "none" from "<5 years"; the raw answer does
+    if contraceptive == CONTRACEPTIVE_UNDER_5 and \
+            str(patient_data.get("oral_contraceptive_use", "")).strip().lower() in NO_CONTRACEPTIVES:
+        contraceptive_label = "none"
+    else:
+        contraceptive_label = CONTRACEPTIVE_LABELS[contraceptive]
+    features.update(
+        age=answers.get("age", 35),
+        bleeding_type=BLEEDING_TYPE_LABELS.get(bleeding_type, "other"),
+        is_post_coital_or_post_menopausal=bool(answers.get("is_post_coital_or_post_menopausal", False))
+        or bleeding_type in POST_COITAL_BLEEDING,
+        sexual_partners=PARTNER_LABELS[answers.get("sexual_partners", PARTNERS_NONE)],
+        smoking=SMOKING_LABELS.get(answers.get("smoking", SMOKING_NONE), "current"),
+        marital_status=MARITAL_LABELS[answers.get("marital_status", MARITAL_OTHER)],
+        oral_contraceptive_use=contraceptive_label,
+        # Unknown is missing in the training data
+        age_first_intercourse=FIRST_INTERCOURSE_LABELS.get(answers.get("age_first_intercourse"), np.nan),
+        parity=parity,
+        # synthetic_data.py flags more than five children
+        high_parity=bool(answers.get("high_parity", False)) or parity > 5,
+    )
+    return features
+
+
+def forest_predictor(classifier, regressor):
+    """Batch prediction function for the category and score pipelines or their flat exports"""
+    # The exports encode feature dicts themselves; sklearn pipelines need a DataFrame
+    takes_rows = isinstance(classifier, FlatForest) and isinstance(regressor, FlatForest)
+
+    def predict_batch(rows):
+        features = rows if takes_rows else pd.DataFrame(rows, columns=FEATURE_COLUMNS)
+        probabilities = classifier.predict_proba(features)
+        scores = regressor.predict(features)
+        classes = [str(label) for label in classifier.classes_]
+        return [{
+            "risk_category": classes[int(np.argmax(row))],
+            "risk_score": round(float(score), 1),
+            "probabilities": {label: round(float(p), 4) for label, p in zip(classes, row)},
+        } for row, score in zip(probabilities, scores)]
+    return predict_batch
+
+
+# Sorted like the classifier's classes_
+RISK_CATEGORIES = ("High risk", "Low risk", "Medium risk")
+
+
+def score_predictor(model):
+    """
+    Batch prediction function for a single risk score forest (the pipeline or
+    its flat export, train_model.py --single-model). The category is the
+    score's under the rule engine's thresholds, and its probabilities are the
+    share of trees whose own score falls in each category.
+    """
+    takes_rows = isinstance(model, FlatForest)
+
+    def predict_batch(rows):
+        if takes_rows:
+            tree_scores = model.tree_values(rows)[:, :, 0]
+        else:
+            X = model[:-1].transform(pd.DataFrame(rows, columns=FEATURE_COLUMNS))
+            tree_scores = np.stack([tree.predict(X) for tree in model[-1].estimators_], axis=1)
+        scores = tree_scores.mean(axis=1)
+        votes = risk_categories(tree_scores)
+        shares = np.stack([(votes == label).mean(axis=1) for label in RISK_CATEGORIES], axis=1)
+        return [{
+            "risk_category": category,
+            "risk_score": round(float(score), 1),
+            "probabilities": {label: round(float(p), 4) for label, p in zip(RISK_CATEGORIES, row)},
+        } for category, score, row in zip(risk_categories(scores), scores, shares)]
+    return predict_batch
+
+
+def predictor_for(models):
+    """Batch prediction function for what load_models loaded"""
+    if COMBINED_MODEL in models:
+        return score_predictor(models[COMBINED_MODEL])
+    return forest_predictor(models["classifier"], models["regressor"])
+
+
+# Artifact name -> exported forest directory in the model directory, used
+# instead of the pickle when present
+FOREST_DIRS = {
+    "classifier": "rf_classifier",
+    "regressor": "rf_regressor",
+    "combined": "rf_combined",
+}
+# Artifact name -> file in the model directory
+MODEL_FILES = {
+    "classifier": "rf_classifier_pipeline.pkl",
+    "regressor": "rf_regressor_pipeline.pkl",
+    "combined": "rf_combined_pipeline.pkl",
+    "label_encoder": "label_encoder.pkl",
+}
+# One score forest standing in for the classifier and the regressor; served
+# instead of them when a directory has it
+COMBINED_MODEL = "combined"
+# Not needed for predictions, so bundles may leave them out
+OPTIONAL_MODELS = ("label_encoder",)
+
+
+def load_models(directory, mmap=True):
+    """(models, formats, timings) for the MODEL_FILES in directory"""
+    # Imported here so importing this module stays cheap
+    import joblib
+    models, formats, timings = {}, {}, {}
+    combined = is_forest_dir(os.path.join(directory, FOREST_DIRS[COMBINED_MODEL])) or \
+        os.path.exists(os.path.join(directory, MODEL_FILES[COMBINED_MODEL]))
+    skipped = ("classifier", "regressor") if combined else (COMBINED_MODEL,)
+    for name, filename in MODEL_FILES.items():
+        if name in skipped:
+            continue
+        start = time.perf_counter()
+        forest_dir = os.path.join(directory, FOREST_DIRS[name]) if name in FOREST_DIRS else None
+        path = os.path.join(directory, filename)
+        if mmap and forest_dir and is_forest_dir(forest_dir):
+            models[name] = load_forest(forest_dir)
+            formats[name] = "mmap"
+        elif name in OPTIONAL_MODELS and not os.path.exists(path):
+            continue
+        else:
+            models[name] = joblib.load(path)
+            formats[name] = "pickle"
+        timings[name] = round(time.perf_counter() - start, 3)
+    return models, formats, timings
+
+
+class ModelLoader:
+    """
+    Loads MODEL_FILES in a background thread started by start(),
+    memory-mapping the FOREST_DIRS exports unless mmap is False. State goes
+    from "not_started" to "loading" to "ready" or "failed"; wait() blocks
+    until loading finishes or a timeout passes.
+
+    With a registry_dir (model_registry.py) the models come from the bundle
+    CURRENT points at, falling back to model_dir before anything is promoted.
+    The same thread then checks CURRENT every poll_seconds and loads a new
+    bundle next to the old one before swapping them; batches already running
+    finish on the models they started with.
+    """
+
+    def __init__(self, model_dir, mmap=True, registry_dir=None, poll_seconds=10.0):
+        self.model_dir = model_dir
+        self.mmap = mmap
+        self.registry_dir = registry_dir
+        self.poll_seconds = poll_seconds
+        self.state = "not_started"
+        self.error = None
+        self.version = None
+        self.formats = {}
+        self.timings = {}
+        self.models = {}
+        self.started_at = None
+        self.finished_at = None
+        self.reloads = 0
+        self.reload_error = None
+        self._failed_version = None
+        self._predict_batch = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def start(self):
+        """Start loading unless already started; cheap to call on every request"""
+        if self.state != "not_started":
+            return
+        with self._lock:
+            if self.state != "not_started":
+                return
+            self.state = "loading"
+            self.started_at = time.time()
+        threading.Thread(target=self._run, name="model-loader", daemon=True).start()
+
+    def _run(self):
+        self._load()
+        if not self.registry_dir:
+            return
+        while True:
+            time.sleep(self.poll_seconds)
+            self.check_for_update()
+
+    def _current_version(self):
+        return current_version(self.registry_dir) if self.registry_dir else None
+
+    def _activate(self, version, models, formats, timings):
+        # One reference swap: predict_batch picks up the new models on its
+        # next call while a running batch keeps the ones it started with
+        self.models = models
+        self.formats = formats
+        self.timings = timings
+        self.version = version
+        self._predict_batch = predictor_for(models)
+
+    def _load(self):
+        version = None
+        try:
+            version = self._current_version()
+            directory = bundle_dir(self.registry_dir, version) if version else self.model_dir
+            self._activate(version, *load_models(directory, self.mmap))
+            self.state = "ready"
+            logger.info(f"Machine learning models {version or directory} loaded in "
+                        f"{sum(self.timings.values()):.2f}s: {self.timings}")
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            self._failed_version = version
+            logger.error(f"Error loading models: {e}")
+        finally:
+            self.finished_at = time.time()
+            self._done.set()
+
+    def check_for_update(self):
+        """Load and swap in the bundle CURRENT points at if it changed; True if models were swapped"""
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            version = self._current_version()
+            if version is None or version in (self.version, self._failed_version):
+                return False
+            start = time.perf_counter()
+            try:
+                loaded = load_models(bundle_dir(self.registry_dir, version), self.mmap)
+            except Exception as e:
+                # Keep serving the models already loaded; retried once CURRENT changes
+                self._failed_version = version
+                self.reload_error = f"{version}: {e}"
+                logger.error(f"Error loading model version {version}: {e}")
+                return False
+            previous = self.version
+            self._activate(version, *loaded)
+            self.state = "ready"
+            self.error = None
+            self.reload_error = None
+            self._failed_version = None
+            self.reloads += 1
+            logger.info(f"Machine learning models switched from {previous} to {version} "
+                        f"in {time.perf_counter() - start:.2f}s")
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def reload_async(self):
+        """Check CURRENT now instead of at the next poll"""
+        threading.Thread(target=self.check_for_update, name="model-reload", daemon=True).start()
+
+    @property
+    def available(self):
+        return self.state == "ready"
+
+    def wait(self, timeout=None):
+        """Start loading if needed and wait up to timeout; True if the models are ready"""
+        self.start()
+        self._done.wait(timeout)
+        return self.available
+
+    def predict_batch(self, rows):
+        predict_batch = self._predict_batch
+        if not self.available or predict_batch is None:
+            raise RuntimeError(f"Models are not loaded ({self.state})")
+        return predict_batch(rows)
+
+    def status(self):
+        return {
+            "state": self.state,
+            "ready": self.available,
+            "error": self.error,
+            "version": self.version,
+            "reloads": self.reloads,
+            "reload_error": self.reload_error,
+            "formats": dict(self.formats),
+            "load_seconds": dict(self.timings),
+            "total_load_seconds": round(self.finished_at - self.started_at, 3) if self.finished_at else None,
+        }
+
+
+class PredictionBatcher:
+    """
+    Runs predict_batch on requests from many threads at once. A batch is
+    sent as soon as it holds max_batch_size requests or max_wait_ms after
+    its first request arrived, whichever comes first.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=32, max_wait_ms=5.0):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.errors = 0
+
+    def _ensure_started(self):
+        # Started on first use, so importing the app starts no threads
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="prediction-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, features):
+        """Queue one feature row; returns a Future for its prediction"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((features, future))
+        return future
+
+    def predict(self, features, timeout=None):
+        return self.submit(features).result(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        # Callers that gave up waiting may have cancelled their futures
+        live = [(features, future) for features, future in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        try:
+            results = self.predict_batch([features for features, _ in live])
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            for _, future in live:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self.requests += len(live)
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(live))
+        for (_, future), result in zip(live, results):
+            future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "errors": self.errors,
+                "queued": self._queue.qsize(),
+            }
+
+
+class ShadowScorer:
+    """
+    Compares forest predictions with the rule score on live traffic without
+    touching the request: submit() only puts the case on a bounded queue and
+    drops it when the queue is full. A daemon thread predicts whatever is
+    queued as one batch, counts agreement per model version and hands
+    disagreements and the window's counts to store(disagreements, windows)
+    every flush_seconds, or sooner once flush_size disagreements are waiting.
+    Results not yet stored when the process exits are lost.
+    """
+
+    def __init__(self, predict_batch, store, ready=lambda: True, model_version=lambda: None, max_queue=1000,
+                 batch_size=64, flush_seconds=30.0, flush_size=200, score_tolerance=10.0):
+        self.predict_batch = predict_batch
+        self.ready = ready
+        self.store = store
+        self.model_version = model_version
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self.score_tolerance = score_tolerance
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._disagreements = []
+        self._windows = {}
+        self._window_start = time.time()
+        self.totals = {"submitted": 0, "dropped": 0, "compared": 0, "category_agreements": 0,
+                       "score_within_tolerance": 0, "skipped": 0, "errors": 0, "stored": 0, "store_errors": 0}
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+                    self._thread.start()
+
+    def submit(self, history_id, features, rule_category, rule_score, prediction=None):
+        """Queue one case; False if it was dropped because the queue is full"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((history_id, features, rule_category, rule_score, prediction))
+        except queue.Full:
+            with self._lock:
+                self.totals["dropped"] += 1
+            return False
+        with self._lock:
+            self.totals["submitted"] += 1
+        return True
+
+    def _run(self):
+        while True:
+            timeout = max(0.0, self._window_start + self.flush_seconds - time.time())
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self._score(batch)
+            if time.time() >= self._window_start + self.flush_seconds or len(self._disagreements) >= self.flush_size:
+                self.flush()
+
+    def _score(self, batch):
+        pending = [case for case in batch if case[4] is None]
+        predictions = iter(())
+        if pending:
+            failure = "skipped"
+            try:
+                # Cases that arrive before the models are loaded are skipped
+                if self.ready():
+                    predictions = iter(self.predict_batch([case[1] for case in pending]))
+                    failure = None
+            except Exception as e:
+                failure = "errors"
+                logger.error(f"Shadow prediction failed: {e}")
+            if failure:
+                with self._lock:
+                    self.totals[failure] += len(pending)
+                batch = [case for case in batch if case[4] is not None]
+        version = self.model_version()
+        with self._lock:
+            window = self._windows.setdefault(version, {
+                "compared": 0, "category_agreements": 0, "score_within_tolerance": 0, "abs_score_error_sum": 0.0,
+                "confusion": {},
+            })
+            for history_id, _, rule_category, rule_score, prediction in batch:
+                if prediction is None:
+                    prediction = next(predictions)
+                category_agrees = prediction["risk_category"] == rule_category
+                score_error = prediction["risk_score"] - rule_score
+                within_tolerance = abs(score_error) <= self.score_tolerance
+                window["compared"] += 1
+                window["category_agreements"] += category_agrees
+                window["score_within_tolerance"] += within_tolerance
+                window["abs_score_error_sum"] += abs(score_error)
+                row = window["confusion"].setdefault(rule_category, {})
+                row[prediction["risk_category"]] = row.get(prediction["risk_category"], 0) + 1
+                self.totals["compared"] += 1
+                self.totals["category_agreements"] += category_agrees
+                self.totals["score_within_tolerance"] += within_tolerance
+                if not (category_agrees and within_tolerance):
+                    self._disagreements.append({
+                        "history_id": history_id,
+                        "model_version": version,
+                        "rule_category": rule_category,
+                        "rule_score": rule_score,
+                        "ml_category": prediction["risk_category"],
+                        "ml_score": prediction["risk_score"],
+                        "probabilities": prediction.get("probabilities"),
+                    })
+
+    def flush(self):
+        """Store the waiting disagreements and the current window's counts"""
+        with self._lock:
+            disagreements, self._disagreements = self._disagreements, []
+            now = time.time()
+            windows = [dict(counts, model_version=version, window_start=self._window_start, window_end=now)
+                       for version, counts in self._windows.items() if counts["compared"]]
+            self._windows = {}
+            self._window_start = now
+        if not disagreements and not windows:
+            return
+        try:
+            self.store(disagreements, windows)
+        except Exception as e:
+            with self._lock:
+                self.totals["store_errors"] += 1
+            logger.error(f"Error storing {len(disagreements)} shadow disagreements: {e}")
+            return
+        with self._lock:
+            self.totals["stored"] += len(disagreements)
+
+    def stats(self):
+        with self._lock:
+            totals = dict(self.totals)
+            compared = totals["compared"]
+            return dict(totals, queued=self._queue.qsize(), queue_size=self._queue.maxsize,
+                        pending_disagreements=len(self._disagreements),
+                        category_agreement=round(totals["category_agreements"] / compared, 4) if compared else None,
+                        score_agreement=round(totals["score_within_tolerance"] / compared, 4) if compared else None,
+                        score_tolerance=self.score_tolerance)
@@ -9,6 +9,7 @@ import numpy as np
 from datetime import datetime
 from fpdf import FPDF
 import os
+from risk_engine import score_answers, render_scenario
 
 def calculate_age(dob_str):
     """Calculate age from date of birth string"""
@@ -20,139 +21,6 @@ def calculate_age(dob_str):
     except:
         return 0
 
-def determine_scenario(abnormal_bleeding, abnormal_discharge, lower_abdominal_pain):
-    """Determine which risk scenario applies based on primary symptoms"""
-    if abnormal_bleeding and abnormal_discharge and lower_abdominal_pain:
-        return 1
-    elif abnormal_bleeding and abnormal_discharge and not lower_abdominal_pain:
-        return 2
-    elif abnormal_bleeding and not abnormal_discharge and not lower_abdominal_pain:
-        return 3
-    elif not abnormal_bleeding and abnormal_discharge and not lower_abdominal_pain:
-        return 4
-    elif not abnormal_bleeding and abnormal_discharge and lower_abdominal_pain:
-        return 5
-    elif abnormal_bleeding and not abnormal_discharge and lower_abdominal_pain:
-        return 6
-    elif not abnormal_bleeding and not abnormal_discharge and lower_abdominal_pain:
-        return 7
-    else:
-        return 8
-
-def calculate_base_risk(scenario, bleeding_type=None):
-    """Calculate base risk percentage based on scenario"""
-    if scenario == 1:
-        return 95
-    elif scenario == 2:
-        if bleeding_type in ["post-coital", "postmenopausal"]:
-            return 76
-        else:
-            return 50
-    elif scenario == 3:
-        if bleeding_type in ["post-coital", "postmenopausal"]:
-            return 76
-        else:
-            return 50
-    elif scenario == 4:
-        return 40
-    elif scenario == 5:
-        return 45
-    elif scenario == 6:
-        if bleeding_type in ["post-coital", "postmenopausal"]:
-            return 70
-        else:
-            return 50
-    elif scenario == 7:
-        return 30
-    else:  # scenario 8
-        return 0
-
-def apply_age_modification(risk, age, scenario, bleeding_type=None, abnormal_bleeding=False, abnormal_discharge=False, lower_abdominal_pain=False):
-    """Apply age-related risk modifications"""
-    if age < 20:
-        if scenario == 1:
-            return risk  # Let scenario 1 calculations play out as intended
-        elif scenario == 2 and bleeding_type == "post-coital":
-            return risk  # Let calculations play out for post-coital bleeding
-        else:
-            return min(30, 10 + 2 * sum([1 for x in [abnormal_bleeding, abnormal_discharge, lower_abdominal_pain] if x]))
-    else:
-        # For all other age groups, let scenarios play out as calculated
-        return risk
-
-def apply_symptom_checklist_modifiers(risk, changed_periods, painful_intercourse, weight_loss, unusual_fatigue):
-    """Apply modifiers based on additional symptoms"""
-    if changed_periods:
-        risk += 2
-    
-    if painful_intercourse:  # Dyspareunia
-        risk += 5
-    
-    # Special case for weight loss and fatigue
-    if weight_loss and unusual_fatigue:
-        risk += 20
-    else:
-        if weight_loss:
-            risk += 5
-        if unusual_fatigue:
-            risk += 5
-    
-    return min(risk, 99)
-
-def apply_risk_factor_modifiers(risk, sexual_partners, smoking_status, cigarettes_per_day,
-                             marital_status, contraceptive_use_years, first_intercourse_age,
-                             abnormal_pap, parity, hiv_status):
-    """Apply modifiers based on risk factors"""
-    
-    # Sexual partners
-    if sexual_partners == "1-3":
-        risk += 2
-    elif sexual_partners == "4-7":
-        risk += 5
-    elif sexual_partners == ">8":
-        risk += 10
-    
-    # Smoking
-    if smoking_status == "Current":
-        if cigarettes_per_day == "1-9":
-            risk += 5
-        elif cigarettes_per_day == "10-19":
-            risk += 10
-        elif cigarettes_per_day == ">20":
-            risk += 15
-    
-    # Marital Status
-    if marital_status in ["Single", "Divorced"]:
-        risk += 2
-    
-    # Oral contraceptive use
-    if contraceptive_use_years == "5-9 years":
-        risk += 5
-    elif contraceptive_use_years == ">10 years":
-        risk += 10
-    
-    # Age at first intercourse
-    if first_intercourse_age == "<16 years":
-        risk += 10
-    elif first_intercourse_age == "17-20 years":
-        risk += 5
-    elif first_intercourse_age == ">21 years":
-        risk += 2
-    
-    # Previous abnormal pap smear
-    if abnormal_pap:
-        risk += 50
-    
-    # Parity
-    if parity == ">5 children":
-        risk += 5
-    
-    # HIV status
-    if hiv_status == "Positive":
-        risk = min(99, risk + (risk * 0.5))
-    
-    return min(risk, 99)
-
 def get_risk_category(risk_percentage):
     """Categorize risk as Low, Medium, or High"""
     if risk_percentage < 40:
@@ -270,27 +138,28 @@ def main():
         elif not (abnormal_bleeding or abnormal_discharge or lower_abdominal_pain):
             st.warning("Please indicate at least one primary symptom to assess risk")
         else:
-            # Determine scenario
-            scenario = determine_scenario(abnormal_bleeding, abnormal_discharge, lower_abdominal_pain)
-            
-            # Calculate base risk
-            base_risk = calculate_base_risk(scenario, bleeding_type)
-            
-            # Apply age modification
-            risk = apply_age_modification(base_risk, age, scenario, bleeding_type, abnormal_bleeding, abnormal_discharge, lower_abdominal_pain)
-            
-            # Apply primary symptom modifiers (2% per symptom)
-            symptom_count = sum([abnormal_bleeding, abnormal_discharge, lower_abdominal_pain])
-            risk = min(99, risk + (2 * symptom_count))
-            
-            # Apply symptom checklist modifiers
-            risk = apply_symptom_checklist_modifiers(risk, changed_periods, painful_intercourse, 
-                                                  weight_loss, unusual_fatigue)
-            
-            # Apply risk factor modifiers
-            risk = apply_risk_factor_modifiers(risk, sexual_partners, smoking_status, cigarettes_per_day,
-                                           marital_status, contraceptive_use_years, first_intercourse_age,
-                                           abnormal_pap, parity, hiv_status)
+            # Score with the same rules as the web app
+            risk, scenario, modifiers = score_answers({
+                "age": age,
+                "abnormal_vaginal_bleeding": abnormal_bleeding,
+                "bleeding_type": bleeding_type or "",
+                "abnormal_vaginal_discharge": abnormal_discharge,
+                "lower_abdominal_pain": lower_abdominal_pain,
+                "change_in_periods": changed_periods,
+                "dyspareunia": painful_intercourse,
+                "weight_loss": weight_loss,
+                "unusual_fatigue": unusual_fatigue,
+                "sexual_partners": sexual_partners,
+                "smoking": smoking_status,
+                "cigarettes_per_day": cigarettes_per_day,
+                "marital_status": marital_status,
+                "oral_contraceptive_use": "yes" if contraceptive_use else "no",
+                "contraceptive_years": contraceptive_use_years,
+                "age_first_intercourse": first_intercourse_age,
+                "abnormal_pap_smear": abnormal_pap,
+                "high_parity": parity == ">5 children",
+                "hiv_positive": hiv_status == "Positive",
+            })
             
             # Get risk category
             risk_category = get_risk_category(risk)
@@ -301,6 +170,7 @@ def main():
             st.subheader(f"Risk Percentage: {risk:.1f}%")
             st.subheader(f"Risk Category: {risk_category}")
             st.subheader(f"Recommendation: {recommendation}")
+            st.write(render_scenario(scenario, modifiers))
             
             # Warning message
             st.warning("This tool is for informational purposes only and does not replace medical advice. " +
@@ -0,0 +1,311 @@
+"""
+Forest models stored as flat arrays that workers memory-map.
+
+A pickled RandomForest is unpickled into private memory in every worker
+process: sklearn copies each tree's nodes into its own buffers on load. Here
+every tree of a fitted pipeline's forest is written as one set of .npy files
+(split feature, threshold, children, leaf values, concatenated across trees)
+that load_forest opens with np.load(mmap_mode="r"). The pages come from the
+OS page cache and are shared read-only by every process that maps the same
+files, so adding workers adds almost nothing for the trees.
+
+The preprocessing step (imputers and one-hot encoder) is flattened too, into
+the fill value and the output column of every category, so prediction needs
+neither sklearn nor a DataFrame: FlatForest encodes plain feature dicts and
+walks all trees over the whole batch at once with array indexing. Results
+match the pipeline to floating point tolerance (forest_benchmark.py checks).
+
+    export_forest(clf_pipeline, "models/rf_classifier")
+    classifier = load_forest("models/rf_classifier")
+    classifier.predict_proba([features, ...])
+
+Pickled pipelines can be exported afterwards:
+
+    python model_artifacts.py models/rf_classifier_pipeline.pkl models/rf_classifier
+"""
+
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 2
+ARRAYS = ("feature", "threshold", "children_left", "children_right", "value", "roots")
+META_FILE = "forest.json"
+MISSING = "missing"
+# Rows walked through the trees at a time, bounding the (rows, trees) work arrays
+WALK_CHUNK_ROWS = 4096
+# Smallest (row, tree) active set worth compacting as trees reach their leaves
+COMPACT_MIN_PAIRS = 20000
+
+
+def flatten_trees(estimators, classifier):
+    """
+    Concatenate the trees' node arrays. Children are indices into the
+    concatenated arrays and a leaf's children are the leaf itself, so a walk
+    of max_depth steps ends on the leaf from any root. Classifier leaf values
+    are class probabilities, regressor leaf values the prediction.
+    """
+    feature, threshold, children_left, children_right, value = [], [], [], [], []
+    roots = []
+    offset = 0
+    for estimator in estimators:
+        tree = estimator.tree_
+        nodes = np.arange(offset, offset + tree.node_count)
+        is_leaf = tree.children_left == -1
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(np.where(is_leaf, 0.0, tree.threshold))
+        children_left.append(np.where(is_leaf, nodes, tree.children_left + offset))
+        children_right.append(np.where(is_leaf, nodes, tree.children_right + offset))
+        leaf_value = tree.value[:, 0, :]
+        if classifier:
+            # Older sklearn versions store class counts, newer ones fractions
+            leaf_value = leaf_value / leaf_value.sum(axis=1, keepdims=True)
+        value.append(leaf_value)
+        roots.append(offset)
+        offset += tree.node_count
+    return {
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold).astype(np.float64),
+        "children_left": np.concatenate(children_left).astype(np.int32),
+        "children_right": np.concatenate(children_right).astype(np.int32),
+        "value": np.ascontiguousarray(np.concatenate(value), dtype=np.float64),
+        "roots": np.array(roots, dtype=np.int32),
+    }
+
+
+def _steps(transformer):
+    return [step for _, step in transformer.steps] if hasattr(transformer, "steps") else [transformer]
+
+
+def _category(value):
+    # JSON keeps bools and strings; numpy scalars become their Python value
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def flatten_encoder(preprocessor):
+    """
+    The fitted ColumnTransformer as plain data: for each numeric column the
+    output column and the value imputed for missing input, for each one-hot
+    column the output column of its first category and the categories in
+    output order. Raises ValueError for steps it cannot flatten.
+    """
+    numeric, categorical = [], []
+    position = 0
+    for name, transformer, columns in preprocessor.transformers_:
+        if isinstance(transformer, str) and transformer == "drop":
+            continue
+        steps = _steps(transformer)
+        kinds = [type(step).__name__ for step in steps]
+        if kinds == ["SimpleImputer"] and steps[0].strategy in ("mean", "median"):
+            for column, fill in zip(columns, steps[0].statistics_):
+                numeric.append({"column": column, "index": position, "fill": float(fill)})
+                position += 1
+        elif kinds == ["SimpleImputer", "OneHotEncoder"] and steps[0].strategy == "constant" \
+                and steps[0].fill_value == MISSING and steps[1].drop is None \
+                and steps[1].handle_unknown == "ignore" \
+                and getattr(steps[1], "infrequent_categories_", None) is None:
+            for column, categories in zip(columns, steps[1].categories_):
+                categorical.append({"column": column, "offset": position,
+                                    "categories": [_category(value) for value in categories]})
+                position += len(categories)
+        else:
+            raise ValueError(f"Cannot flatten preprocessing step {name!r}: {kinds}")
+    return {"numeric": numeric, "categorical": categorical, "n_features": position}
+
+
+def export_forest(pipeline, directory):
+    """Write a fitted preprocessing + RandomForest Pipeline to directory"""
+    forest = pipeline.steps[-1][1]
+    classifier = hasattr(forest, "classes_")
+    encoder = flatten_encoder(pipeline.steps[0][1])
+    if encoder["n_features"] != forest.n_features_in_:
+        raise ValueError(f"Encoder gives {encoder['n_features']} features, the forest takes {forest.n_features_in_}")
+    directory = os.path.abspath(directory)
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    # Written aside and renamed into place, so a worker loading meanwhile
+    # never maps new arrays with old metadata or the reverse
+    staging = tempfile.mkdtemp(prefix=f".staging-{os.path.basename(directory)}-", dir=parent)
+    try:
+        _write_forest(forest, classifier, encoder, staging)
+        # mkdtemp creates the directory private to its owner
+        os.chmod(staging, 0o755)
+        _replace_directory(staging, directory)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _write_forest(forest, classifier, encoder, directory):
+    for name, array in flatten_trees(forest.estimators_, classifier).items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "estimator": "classifier" if classifier else "regressor",
+        "classes": [str(label) for label in forest.classes_] if classifier else None,
+        "n_features": int(forest.n_features_in_),
+        "n_trees": len(forest.estimators_),
+        "max_depth": max(int(estimator.tree_.max_depth) for estimator in forest.estimators_),
+        "encoder": encoder,
+    }
+    with open(os.path.join(directory, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _replace_directory(source, target):
+    # rename cannot replace a non-empty directory, so the old export is moved
+    # aside first; load_forest retries if it catches the swap
+    old = None
+    if os.path.exists(target):
+        old = tempfile.mkdtemp(prefix=f".old-{os.path.basename(target)}-", dir=os.path.dirname(target))
+        os.rename(target, os.path.join(old, "forest"))
+    os.rename(source, target)
+    if old:
+        # Workers still mapping the old files keep them until they unmap
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def is_forest_dir(directory):
+    return os.path.isfile(os.path.join(directory, META_FILE))
+
+
+def _is_missing(value):
+    return value is None or isinstance(value, float) and math.isnan(value)
+
+
+class FlatForest:
+    """
+    Predicts like the exported Pipeline: predict_proba/predict and classes_
+    for a classifier, predict for a regressor. Inputs are a list of feature
+    dicts or a DataFrame with the pipeline's input columns.
+    """
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.arrays = arrays
+        self.classes_ = np.array(meta["classes"]) if meta["classes"] else None
+        encoder = meta["encoder"]
+        self.n_features = encoder["n_features"]
+        self.numeric = [(item["column"], item["index"], item["fill"]) for item in encoder["numeric"]]
+        # Category -> output column. Looked up with the raw value, so as in
+        # the encoder True matches 1 and unknown values set no column
+        self.categorical = [(item["column"], {category: item["offset"] + i
+                                              for i, category in enumerate(item["categories"])})
+                            for item in encoder["categorical"]]
+
+    def encode(self, rows):
+        """Float32 feature matrix, the dtype sklearn's trees compare in"""
+        if hasattr(rows, "columns"):
+            column_values = lambda column: rows[column].tolist()  # noqa: E731
+        else:
+            column_values = lambda column: [row.get(column) for row in rows]  # noqa: E731
+        X = np.zeros((len(rows), self.n_features), dtype=np.float32)
+        for column, index, fill in self.numeric:
+            X[:, index] = [fill if _is_missing(value) else value for value in column_values(column)]
+        row_index = np.arange(len(rows))
+        for column, lookup in self.categorical:
+            missing = lookup.get(MISSING, -1)
+            outputs = np.array([missing if _is_missing(value) else lookup.get(value, -1)
+                                for value in column_values(column)], dtype=np.int64)
+            known = outputs >= 0
+            X[row_index[known], outputs[known]] = 1.0
+        return X
+
+    def leaf_values(self, rows):
+        """Mean leaf value over the trees for each row"""
+        X = self.encode(rows)
+        result = np.empty((len(X), self.arrays["value"].shape[1]))
+        for start in range(0, len(X), WALK_CHUNK_ROWS):
+            result[start:start + WALK_CHUNK_ROWS] = self._walk(X[start:start + WALK_CHUNK_ROWS]).mean(axis=1)
+        return result
+
+    def tree_values(self, rows):
+        """Each tree's leaf value for each row, shaped (rows, trees, outputs)"""
+        X = self.encode(rows)
+        result = np.empty((len(X), len(self.arrays["roots"]), self.arrays["value"].shape[1]))
+        for start in range(0, len(X), WALK_CHUNK_ROWS):
+            result[start:start + WALK_CHUNK_ROWS] = self._walk(X[start:start + WALK_CHUNK_ROWS])
+        return result
+
+    def _walk(self, X):
+        feature, threshold = self.arrays["feature"], self.arrays["threshold"]
+        children_left, children_right = self.arrays["children_left"], self.arrays["children_right"]
+        roots = np.asarray(self.arrays["roots"])
+        n_rows, n_trees = len(X), len(roots)
+        # One entry per (row, tree) pair, advanced a level at a time. In large
+        # batches pairs whose node stops moving are at their leaf and leave
+        # the active set, so deeper levels only walk the trees that go deeper;
+        # for a few rows the bookkeeping costs more than it saves.
+        node = np.tile(roots, n_rows)
+        offset = np.repeat(np.arange(n_rows) * X.shape[1], n_trees)
+        position = np.arange(len(node))
+        leaves = np.empty_like(node)
+        X = X.ravel()
+        for _ in range(self.meta["max_depth"]):
+            go_left = X[offset + feature[node]] <= threshold[node]
+            next_node = np.where(go_left, children_left[node], children_right[node])
+            moved = next_node != node
+            if not moved.any():
+                break
+            if len(node) >= COMPACT_MIN_PAIRS and not moved.all():
+                leaves[position[~moved]] = node[~moved]
+                next_node, offset, position = next_node[moved], offset[moved], position[moved]
+            node = next_node
+        leaves[position] = node
+        return self.arrays["value"][leaves].reshape(n_rows, n_trees, -1)
+
+    def predict_proba(self, rows):
+        return self.leaf_values(rows)
+
+    def predict(self, rows):
+        values = self.leaf_values(rows)
+        if self.classes_ is not None:
+            return self.classes_[np.argmax(values, axis=1)]
+        return values[:, 0]
+
+
+def load_forest(directory, mmap_mode="r", attempts=5):
+    """Open an exported forest; mmap_mode=None reads the arrays into private memory instead"""
+    for attempt in range(attempts):
+        try:
+            before = os.stat(directory).st_ino
+            forest = _load_forest(directory, mmap_mode)
+            # An export swapped in meanwhile may have given files from both
+            if os.stat(directory).st_ino == before:
+                return forest
+        except FileNotFoundError:
+            if attempt == attempts - 1:
+                raise
+        time.sleep(0.05)
+    raise RuntimeError(f"{directory} kept changing while it was loaded")
+
+
+def _load_forest(directory, mmap_mode):
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+    if meta.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"{directory} has forest format {meta.get('format_version')}, expected "
+                         f"{FORMAT_VERSION}; export it again")
+    # Plain ndarray views of the maps: indexing np.memmap objects is slower
+    arrays = {name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode))
+              for name in ARRAYS}
+    return FlatForest(meta, arrays)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__.split("\n\n")[-1].strip(), file=sys.stderr)
+        return 2
+    import joblib
+    export_forest(joblib.load(sys.argv[1]), sys.argv[2])
+    print(f"Exported {sys.argv[1]} to {sys.argv[2]}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Measure how much memory the ML models cost per worker.
+
+Starts 1 and then N fresh worker processes at once, the way the app's
+workers run, each loading the models through ModelLoader and predicting a
+sample of rows. While all of them are alive each reports its resident memory
+from /proc/self/smaps_rollup (Linux only): RSS, the part shared with other
+processes, the private part, and PSS (shared pages split between the
+processes mapping them, so the workers' PSS adds up to the memory they
+really use together).
+
+    python model_memory.py --workers 4
+    python model_memory.py --workers 4 --format pickle --model-dir /tmp/models
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def read_smaps():
+    """This process's memory totals in MB"""
+    totals = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in SMAPS_FIELDS:
+                totals[name] = int(rest.split()[0]) / 1024.0
+    return {
+        "rss": totals["Rss"],
+        "pss": totals["Pss"],
+        "shared": totals["Shared_Clean"] + totals["Shared_Dirty"],
+        "private": totals["Private_Clean"] + totals["Private_Dirty"],
+    }
+
+
+def sample_rows(csv_path, rows):
+    import pandas as pd
+    from ml_service import FEATURE_COLUMNS
+    sample = pd.read_csv(csv_path, nrows=rows)
+    sample["bleeding_type"] = sample["bleeding_type"].fillna("none")
+    return sample[FEATURE_COLUMNS].to_dict("records")
+
+
+def worker(model_dir, mmap, csv_path, rows, results, release):
+    from ml_service import ModelLoader
+    # Imported before the baseline so the difference is the models themselves
+    import joblib  # noqa: F401
+    import sklearn.compose, sklearn.ensemble, sklearn.impute, sklearn.pipeline  # noqa: F401, E401
+    rows = sample_rows(csv_path, rows)
+    before = read_smaps()
+    loader = ModelLoader(model_dir, mmap=mmap)
+    if not loader.wait():
+        results.put({"error": loader.error})
+        return
+    loader.predict_batch(rows)
+    after = read_smaps()
+    results.put({"pid": os.getpid(), "formats": loader.formats, "before": before, "after": after})
+    # Stay alive until every worker has measured, so pages are shared as in production
+    release.wait()
+
+
+def measure(model_dir, mmap, workers, csv_path, rows, timeout=600):
+    """Start `workers` processes together; returns their reports"""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    release = context.Event()
+    processes = [context.Process(target=worker, args=(model_dir, mmap, csv_path, rows, results, release))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        reports = [results.get(timeout=timeout) for _ in processes]
+    finally:
+        release.set()
+        for process in processes:
+            process.join()
+    errors = [report["error"] for report in reports if "error" in report]
+    if errors:
+        raise SystemExit(f"Models failed to load: {errors[0]}")
+    return reports
+
+
+def summarize(reports):
+    count = len(reports)
+
+    def mean(stage, field):
+        return round(sum(report[stage][field] for report in reports) / count, 1)
+
+    return {
+        "workers": count,
+        "formats": reports[0]["formats"],
+        "rss_per_worker_mb": mean("after", "rss"),
+        "shared_per_worker_mb": mean("after", "shared"),
+        "private_per_worker_mb": mean("after", "private"),
+        "model_rss_per_worker_mb": round(mean("after", "rss") - mean("before", "rss"), 1),
+        "total_pss_mb": round(sum(report["after"]["pss"] for report in reports), 1),
+    }
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    csv_files = sorted(glob.glob(os.path.join(here, "cervical_cancer_synthetic_data_*.csv")))
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="worker count compared with a single worker")
+    parser.add_argument("--format", choices=("mmap", "pickle", "both"), default="both",
+                        help="load the memory-mapped exports, the pickles, or compare both")
+    parser.add_argument("--model-dir", default=os.path.join(here, "models"))
+    parser.add_argument("--sample-csv", default=csv_files[-1] if csv_files else None,
+                        help="rows predicted by each worker (default: the synthetic training data)")
+    parser.add_argument("--rows", type=int, default=2000, help="rows predicted by each worker")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        raise SystemExit("Needs Linux /proc/<pid>/smaps_rollup")
+    if not args.sample_csv:
+        raise SystemExit("No sample rows: pass --sample-csv")
+
+    formats = ("mmap", "pickle") if args.format == "both" else (args.format,)
+    results = []
+    for model_format in formats:
+        for workers in sorted({1, args.workers}):
+            reports = measure(args.model_dir, model_format == "mmap", workers, args.sample_csv, args.rows)
+            results.append(dict(summarize(reports), requested_format=model_format))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print(f"{'format':<8}{'workers':>8}{'RSS/worker':>12}{'shared':>10}{'private':>10}"
+          f"{'models/worker':>15}{'total PSS':>11}   (MB)")
+    for result in results:
+        loaded = next(iter(result["formats"].values()), "")
+        print(f"{loaded:<8}{result['workers']:>8}{result['rss_per_worker_mb']:>12.1f}"
+              f"{result['shared_per_worker_mb']:>10.1f}{result['private_per_worker_mb']:>10.1f}"
+              f"{result['model_rss_per_worker_mb']:>15.1f}{result['total_pss_mb']:>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
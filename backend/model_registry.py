@@ -0,0 +1,183 @@
+"""
+Versioned model bundles with an atomic "current" pointer.
+
+    registry/
+        20261018-134500-3f2a9c/     one immutable bundle per training run
+            manifest.json           training data hash, metrics, feature list
+            rf_classifier/ ...      the model files ModelLoader reads
+        CURRENT                     name of the bundle workers serve
+        history.json                promotions, newest last, for rollback
+
+A bundle is assembled in a hidden staging directory and renamed into place,
+so a bundle directory is always complete; it is never modified afterwards.
+CURRENT and history.json are replaced with os.replace, so a reader sees the
+old or the new pointer and never a partly written one. Workers poll CURRENT
+(ml_service.ModelLoader) and swap to the new bundle in the background.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+HISTORY_FILE = "history.json"
+
+
+class RegistryError(Exception):
+    """Unknown version, nothing to roll back to, or a malformed bundle"""
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def publish_bundle(registry_dir, paths, manifest, version=None):
+    """
+    Copy files and directories `paths` into a new bundle with `manifest`
+    (a dict; version and created_at are added) and return its version.
+    The version defaults to the time plus the start of the training data hash.
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    created_at = time.time()
+    if version is None:
+        data_hash = manifest.get("training_data_sha256") or ""
+        version = time.strftime("%Y%m%d-%H%M%S", time.gmtime(created_at)) + (f"-{data_hash[:6]}" if data_hash else "")
+    target = os.path.join(registry_dir, version)
+    if os.path.exists(target):
+        raise RegistryError(f"Version {version} already exists")
+
+    staging = tempfile.mkdtemp(prefix=f".staging-{version}-", dir=registry_dir)
+    try:
+        for path in paths:
+            destination = os.path.join(staging, os.path.basename(path.rstrip(os.sep)))
+            if os.path.isdir(path):
+                shutil.copytree(path, destination)
+            else:
+                shutil.copy2(path, destination)
+        manifest = dict(manifest, version=version, created_at=created_at)
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        # mkdtemp creates the directory private to its owner
+        os.chmod(staging, 0o755)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return version
+
+
+def list_versions(registry_dir):
+    """Manifests of every published bundle, oldest first"""
+    if not os.path.isdir(registry_dir):
+        return []
+    manifests = []
+    for name in os.listdir(registry_dir):
+        path = os.path.join(registry_dir, name, MANIFEST_FILE)
+        if name.startswith(".") or not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            manifests.append(json.load(f))
+    return sorted(manifests, key=lambda manifest: (manifest.get("created_at", 0), manifest["version"]))
+
+
+def read_manifest(registry_dir, version):
+    path = os.path.join(registry_dir, version, MANIFEST_FILE)
+    if os.sep in version or version.startswith(".") or not os.path.isfile(path):
+        raise RegistryError(f"Unknown model version {version}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def current_version(registry_dir):
+    """Version CURRENT points at, or None before anything was promoted"""
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def bundle_dir(registry_dir, version):
+    return os.path.join(registry_dir, version)
+
+
+def promotion_history(registry_dir):
+    try:
+        with open(os.path.join(registry_dir, HISTORY_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+@contextmanager
+def _locked(registry_dir):
+    # Serializes promotions from several workers or scripts
+    if not os.path.isdir(registry_dir):
+        raise RegistryError(f"No model registry at {registry_dir}")
+    with open(os.path.join(registry_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def promote(registry_dir, version, by=None):
+    """Point CURRENT at version and record the promotion"""
+    with _locked(registry_dir):
+        return _set_current(registry_dir, version, by, "promote")
+
+
+def _set_current(registry_dir, version, by, action):
+    read_manifest(registry_dir, version)
+    history = promotion_history(registry_dir)
+    history.append({"version": version, "previous": current_version(registry_dir), "action": action,
+                    "by": by, "at": time.time()})
+    _write_atomic(os.path.join(registry_dir, HISTORY_FILE), json.dumps(history, indent=2))
+    _write_atomic(os.path.join(registry_dir, CURRENT_FILE), version + "\n")
+    return version
+
+
+def _served_stack(history):
+    # Promotions push a version, rollbacks pop back to the one before it
+    stack = []
+    for entry in history:
+        if entry["action"] == "rollback":
+            stack.pop()
+        elif not stack or stack[-1] != entry["version"]:
+            stack.append(entry["version"])
+    return stack
+
+
+def rollback(registry_dir, by=None):
+    """Point CURRENT back at the version promoted before the current one"""
+    with _locked(registry_dir):
+        stack = _served_stack(promotion_history(registry_dir))
+        if len(stack) < 2:
+            raise RegistryError("No earlier model version to roll back to")
+        return _set_current(registry_dir, stack[-2], by, "rollback")
@@ -0,0 +1,273 @@
+"""
+Cross-validated hyperparameter search for the risk forests.
+
+The training split comes encoded from the feature cache (feature_cache.py).
+Every (candidate, fold) pair is fitted in a pool of --jobs processes that
+memory-map the cached matrix, and its held-out metrics are appended to
+results.jsonl in --work-dir as soon as it finishes. Run the same command
+again after an interruption and it only fits the pairs missing from
+results.jsonl.
+
+    python model_search.py --grid n_estimators=50,100 max_depth=none,12 min_samples_leaf=1,5
+    python model_search.py --random 30 --target score --jobs 8
+    python train_model.py --search --random 30 --refit
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.metrics import accuracy_score, mean_absolute_error, mean_squared_error
+from sklearn.model_selection import StratifiedKFold
+
+from feature_cache import Features, load_features
+from risk_engine import risk_categories
+import train_model
+
+RESULTS_FILE = "results.jsonl"
+SEARCH_FILE = "search.json"
+# Random search draws combinations of these without replacement
+SEARCH_SPACE = {
+    "n_estimators": [25, 50, 100, 150, 200, 300],
+    "max_depth": [None, 6, 8, 10, 12, 16, 20, 30],
+    "min_samples_leaf": [1, 2, 5, 10, 20, 50],
+    "max_features": ["sqrt", "log2", 0.5, 1.0],
+}
+# Fitted forest for each target, and the metric candidates are ranked by
+# (True when larger is better)
+TARGETS = {
+    "category": (RandomForestClassifier, "accuracy", True),
+    "score": (RandomForestRegressor, "mae", False),
+}
+
+
+def parse_value(text):
+    if text.lower() == "none":
+        return None
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_grid(items):
+    """['n_estimators=50,100', 'max_depth=none'] -> every combination as a list of dicts"""
+    grid = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        if not values:
+            raise SystemExit(f"Grid entries look like name=value,value: {item}")
+        grid[name] = [parse_value(value) for value in values.split(",")]
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+def random_candidates(count, seed):
+    combinations = list(itertools.product(*SEARCH_SPACE.values()))
+    if count > len(combinations):
+        raise SystemExit(f"--random {count} is more than the {len(combinations)} combinations in SEARCH_SPACE")
+    # Seeded, so a resumed search draws the same candidates
+    return [dict(zip(SEARCH_SPACE, values)) for values in random.Random(seed).sample(combinations, count)]
+
+
+def candidate_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+_worker = {}
+
+
+def _init_worker(features_dir):
+    # Memory-mapped, so the pool shares one copy of the matrix
+    features = Features(features_dir)
+    _worker.update(X=features.X_train, y_category=features.y_category_train, y_score=features.y_score_train)
+
+
+def fold_indices(y_category, folds, seed):
+    return list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(
+        np.zeros(len(y_category)), y_category))
+
+
+def evaluate_fold(target, params, fold, folds, seed):
+    """Fit one candidate on the other folds and score it on this one (runs in a worker)"""
+    X, y_category, y_score = _worker["X"], _worker["y_category"], _worker["y_score"]
+    train_index, test_index = fold_indices(y_category, folds, seed)[fold]
+    estimator, _, _ = TARGETS[target]
+    model = estimator(random_state=train_model.RANDOM_STATE, **params)
+    start = time.perf_counter()
+    if target == "category":
+        model.fit(X[train_index], y_category[train_index])
+        fit_seconds = time.perf_counter() - start
+        metrics = {"accuracy": accuracy_score(y_category[test_index], model.predict(X[test_index]))}
+    else:
+        model.fit(X[train_index], y_score[train_index])
+        fit_seconds = time.perf_counter() - start
+        predicted = model.predict(X[test_index])
+        metrics = {
+            "mae": mean_absolute_error(y_score[test_index], predicted),
+            "rmse": float(np.sqrt(mean_squared_error(y_score[test_index], predicted))),
+            # The category the single-model setup would give (train_model.py --single-model)
+            "accuracy": accuracy_score(y_category[test_index], risk_categories(predicted)),
+        }
+    return {"candidate": candidate_key(params), "params": params, "fold": fold,
+            "metrics": {name: float(value) for name, value in metrics.items()},
+            "fit_seconds": round(fit_seconds, 3), "nodes": sum(tree.tree_.node_count for tree in model.estimators_)}
+
+
+def read_results(path):
+    results = []
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                # A line cut short when the search was killed; that fold runs again
+                continue
+    return results
+
+
+def end_partial_line(path):
+    # A killed search can leave half a line; the next result starts on its own
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+
+def append_result(f, result):
+    f.write(json.dumps(result) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def check_search(work_dir, search):
+    """Refuse to resume a work directory holding a different search"""
+    path = os.path.join(work_dir, SEARCH_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != search:
+            raise SystemExit(f"{work_dir} holds a different search ({previous}); use another --work-dir")
+        return
+    with open(path, "w") as f:
+        json.dump(search, f, indent=2)
+
+
+def summarize(results, target):
+    """Per-candidate means over the finished folds, best first"""
+    _, metric, larger_is_better = TARGETS[target]
+    by_candidate = {}
+    for result in results:
+        by_candidate.setdefault(result["candidate"], []).append(result)
+    summary = []
+    for folds in by_candidate.values():
+        entry = {"params": folds[0]["params"], "folds": len(folds),
+                 "fit_seconds": round(float(np.mean([fold["fit_seconds"] for fold in folds])), 3),
+                 "nodes": int(np.mean([fold["nodes"] for fold in folds]))}
+        for name in folds[0]["metrics"]:
+            values = [fold["metrics"][name] for fold in folds]
+            entry[name] = round(float(np.mean(values)), 4)
+            entry[f"{name}_std"] = round(float(np.std(values)), 4)
+        summary.append(entry)
+    return sorted(summary, key=lambda entry: -entry[metric] if larger_is_better else entry[metric])
+
+
+def print_summary(summary, target, top):
+    _, metric, _ = TARGETS[target]
+    print(f"\n{'rank':>4}  {metric:>8}  {'std':>7}  {'folds':>5}  {'fit s':>6}  {'nodes':>8}  params")
+    for rank, entry in enumerate(summary[:top], 1):
+        print(f"{rank:>4}  {entry[metric]:>8.4f}  {entry[metric + '_std']:>7.4f}  {entry['folds']:>5}  "
+              f"{entry['fit_seconds']:>6.2f}  {entry['nodes']:>8,}  {json.dumps(entry['params'])}")
+
+
+def refit_best(best, target, features):
+    """Fit the best candidate on the whole training split, then save and publish it unpromoted"""
+    # A category search tunes the classifier, which may take parameters the
+    # regressor does not (class_weight, criterion="entropy"), so the regressor
+    # keeps the defaults; a score search tunes the single score forest
+    if target == "category":
+        fitted = train_model.fit_models(features, classifier_params=best["params"])
+    else:
+        fitted = train_model.fit_models(features, regressor_params=best["params"], single_model=True)
+    pipelines, metrics, _, _ = fitted
+    print(f"\nBest candidate on the test split: accuracy {metrics['accuracy']:.4f}, MAE {metrics['mae']:.2f}")
+    return train_model.save_and_publish(pipelines, metrics, features.columns, features.categories,
+                                        directory="tuned", extra_manifest={"search": best}, promote_first=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="train_model.py --search", description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    candidates = parser.add_mutually_exclusive_group(required=True)
+    candidates.add_argument("--grid", nargs="+", metavar="NAME=VALUES", help="forest parameters and values to combine")
+    candidates.add_argument("--random", type=int, metavar="N", help="draw N candidates from SEARCH_SPACE")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="category",
+                        help="tune the category classifier or the score regressor")
+    parser.add_argument("--folds", type=int, default=5, help="cross-validation folds")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the folds and the random draws")
+    parser.add_argument("--work-dir", default="search", help="checkpointed results and summary")
+    parser.add_argument("--top", type=int, default=10, help="candidates printed")
+    parser.add_argument("--refit", action="store_true",
+                        help="fit the best candidate on the training split, save it in tuned/ and publish it")
+    args = parser.parse_args(argv)
+
+    params_list = parse_grid(args.grid) if args.grid else random_candidates(args.random, args.seed)
+    os.makedirs(args.work_dir, exist_ok=True)
+    features = load_features()
+    # Results on other data or encodings cannot be resumed
+    check_search(args.work_dir, {"target": args.target, "folds": args.folds, "seed": args.seed,
+                                 "features": features.key, "candidates": params_list})
+
+    results_path = os.path.join(args.work_dir, RESULTS_FILE)
+    results = read_results(results_path)
+    done = {(result["candidate"], result["fold"]) for result in results}
+    pending = [(params, fold) for params in params_list for fold in range(args.folds)
+               if (candidate_key(params), fold) not in done]
+    print(f"{len(params_list)} candidates x {args.folds} folds: {len(done)} fits done, {len(pending)} to run "
+          f"on {args.jobs} processes", file=sys.stderr)
+
+    end_partial_line(results_path)
+    start = time.perf_counter()
+    with open(results_path, "a") as checkpoint, \
+            ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(features.directory,)) as pool:
+        futures = [pool.submit(evaluate_fold, args.target, params, fold, args.folds, args.seed)
+                   for params, fold in pending]
+        try:
+            for finished, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                append_result(checkpoint, result)
+                results.append(result)
+                print(f"[{finished}/{len(pending)}] fold {result['fold']} {result['candidate']}: "
+                      f"{result['metrics']}", file=sys.stderr)
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            print(f"\nInterrupted; run the same command to resume from {results_path}", file=sys.stderr)
+            return 130
+    if pending:
+        print(f"{len(pending)} fits in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    summary = summarize(results, args.target)
+    with open(os.path.join(args.work_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    print_summary(summary, args.target, args.top)
+    if args.refit and summary:
+        version = refit_best(summary[0], args.target, features)
+        print(f"Promote it with POST /api/admin/models/promote {{\"version\": \"{version}\"}}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
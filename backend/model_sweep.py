@@ -0,0 +1,224 @@
+"""
+Size, latency and accuracy of forest settings, for picking a compact model.
+
+For every combination of --trees, --max-depth and --min-samples-leaf the
+classifier and regressor (or with --single-model one risk score forest, both
+with --compare) are fitted on the training split, then measured: held-out
+accuracy and MAE, size on disk of the flat exports the app serves and of the
+pickles, load time, single-row latency and batch throughput of the app's
+prediction function on the exports. A configuration is on the Pareto
+front when no other one is at least as good on size, latency, accuracy and
+MAE and better on one of them. The report (--report, JSON or .csv) lists
+every configuration; the smallest one whose accuracy reaches
+--accuracy-floor is saved to --output and published to the model registry
+without being promoted.
+
+    python train_model.py --sweep --accuracy-floor 0.9
+    python model_sweep.py --trees 10,25,50 --max-depth none,8 --min-samples-leaf 1,10
+    python model_sweep.py --trees 100 --max-depth none --min-samples-leaf 1 --compare
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import joblib
+import pandas as pd
+
+from feature_cache import load_features
+from forest_benchmark import latencies_ms, rows_per_second
+from ml_service import FOREST_DIRS, MODEL_FILES, predictor_for
+from model_artifacts import export_forest, load_forest
+import train_model
+
+# Classifier and regressor, or one score forest with the category derived
+# from the score (train_model.py --single-model)
+SEPARATE = "separate"
+SINGLE = "single"
+# (report field, True when larger is better) for the Pareto front
+OBJECTIVES = (("size_bytes", False), ("latency_p50_ms", False), ("accuracy", True), ("mae", False))
+
+
+def parse_grid(text, cast=int):
+    """'25,50,none' -> [25, 50, None]"""
+    return [None if value.strip().lower() == "none" else cast(value) for value in text.split(",") if value.strip()]
+
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def measure_config(params, features, scratch, latency_calls=200, setup=SEPARATE):
+    """Fit one configuration of a setup and measure it; returns a report row"""
+    pipelines, metrics, _, fit_seconds = train_model.fit_models(features, params, single_model=setup == SINGLE)
+
+    directory = tempfile.mkdtemp(dir=scratch)
+    forest_dirs = {name: os.path.join(directory, FOREST_DIRS[name]) for name in pipelines}
+    pickles = {name: os.path.join(directory, MODEL_FILES[name]) for name in pipelines}
+    for name, pipeline in pipelines.items():
+        export_forest(pipeline, forest_dirs[name])
+        joblib.dump(pipeline, pickles[name])
+
+    start = time.perf_counter()
+    forests = {name: load_forest(path) for name, path in forest_dirs.items()}
+    load_ms = (time.perf_counter() - start) * 1000.0
+    start = time.perf_counter()
+    for path in pickles.values():
+        joblib.load(path)
+    pickle_load_ms = (time.perf_counter() - start) * 1000.0
+
+    # The same prediction function the app builds for these models
+    predict_batch = predictor_for(forests)
+    rows = features.raw_test.to_dict("records")
+    p50, p99 = latencies_ms(predict_batch, rows, latency_calls)
+
+    row = {
+        "setup": setup,
+        "n_estimators": params["n_estimators"],
+        "max_depth": params["max_depth"],
+        "min_samples_leaf": params["min_samples_leaf"],
+        "accuracy": round(metrics["accuracy"], 4),
+        "mae": round(metrics["mae"], 3),
+        "size_bytes": sum(directory_size(path) for path in forest_dirs.values()),
+        "pickle_bytes": sum(directory_size(path) for path in pickles.values()),
+        "nodes": sum(int(len(forest.arrays["feature"])) for forest in forests.values()),
+        "load_ms": round(load_ms, 2),
+        "pickle_load_ms": round(pickle_load_ms, 1),
+        "latency_p50_ms": round(float(p50), 3),
+        "latency_p99_ms": round(float(p99), 3),
+        "batch_rows_per_sec": round(rows_per_second(predict_batch, rows, len(rows))),
+        "fit_seconds": round(fit_seconds, 2),
+    }
+    shutil.rmtree(directory, ignore_errors=True)
+    return row
+
+
+def pareto_front(rows, objectives=OBJECTIVES):
+    """Marks each row's "pareto" field"""
+    def at_least_as_good(a, b):
+        return all(a[field] >= b[field] if larger else a[field] <= b[field] for field, larger in objectives)
+
+    for row in rows:
+        row["pareto"] = not any(other is not row and at_least_as_good(other, row)
+                                and any(other[field] != row[field] for field, _ in objectives)
+                                for other in rows)
+    return rows
+
+
+def select_compact(rows, accuracy_floor, max_mae=None):
+    """Smallest configuration meeting the floor (ties go to the more accurate), or None"""
+    eligible = [row for row in rows if row["accuracy"] >= accuracy_floor and (max_mae is None or row["mae"] <= max_mae)]
+    return min(eligible, key=lambda row: (row["size_bytes"], -row["accuracy"])) if eligible else None
+
+
+def write_report(path, rows, selected, settings):
+    if path.endswith(".csv"):
+        frame = pd.DataFrame(rows)
+        frame["selected"] = [row is selected for row in rows]
+        frame.to_csv(path, index=False)
+        return
+    with open(path, "w") as f:
+        json.dump({"settings": settings, "selected": selected, "configurations": rows}, f, indent=2)
+
+
+def print_table(rows, selected):
+    print(f"\n{'setup':>10}{'trees':>6}{'depth':>7}{'leaf':>6}{'accuracy':>10}{'MAE':>8}{'size KB':>10}"
+          f"{'pickle KB':>11}{'load ms':>9}{'p50 ms':>8}{'rows/s':>10}{'fit s':>8}")
+    for row in sorted(rows, key=lambda row: row["size_bytes"]):
+        mark = ">" if row is selected else "*" if row["pareto"] else " "
+        print(f"{mark}{row['setup']:>9}{row['n_estimators']:>6}{str(row['max_depth']):>7}{row['min_samples_leaf']:>6}"
+              f"{row['accuracy']:>10.4f}{row['mae']:>8.2f}{row['size_bytes'] / 1024:>10,.0f}"
+              f"{row['pickle_bytes'] / 1024:>11,.0f}{row['load_ms']:>9.1f}{row['latency_p50_ms']:>8.2f}"
+              f"{row['batch_rows_per_sec']:>10,}{row['fit_seconds']:>8.2f}")
+    print("* on the Pareto front (size, latency, accuracy, MAE)   > selected")
+
+
+def print_comparison(rows):
+    """Single model against the separate pair at each configuration with both"""
+    pairs = {}
+    for row in rows:
+        pairs.setdefault((row["n_estimators"], row["max_depth"], row["min_samples_leaf"]), {})[row["setup"]] = row
+    print(f"\nSingle model vs classifier + regressor:\n{'trees':>6}{'depth':>7}{'leaf':>6}{'accuracy':>10}"
+          f"{'MAE':>8}{'size':>8}{'fit':>8}{'p50':>8}{'rows/s':>8}")
+    for (trees, depth, leaf), pair in pairs.items():
+        if len(pair) < 2:
+            continue
+        single, separate = pair[SINGLE], pair[SEPARATE]
+        print(f"{trees:>6}{str(depth):>7}{leaf:>6}{single['accuracy'] - separate['accuracy']:>+10.4f}"
+              f"{single['mae'] - separate['mae']:>+8.2f}{single['size_bytes'] / separate['size_bytes']:>7.2f}x"
+              f"{single['fit_seconds'] / separate['fit_seconds']:>7.2f}x"
+              f"{single['latency_p50_ms'] / separate['latency_p50_ms']:>7.2f}x"
+              f"{single['batch_rows_per_sec'] / separate['batch_rows_per_sec']:>7.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="train_model.py --sweep", description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trees", default="10,25,50,100", help="tree counts to try")
+    parser.add_argument("--max-depth", default="none,16,12,8", help="maximum depths to try ('none' for unlimited)")
+    parser.add_argument("--min-samples-leaf", default="1,5,20", help="minimum samples per leaf to try")
+    parser.add_argument("--single-model", action="store_true",
+                        help="sweep one risk score forest instead of the classifier and regressor")
+    parser.add_argument("--compare", action="store_true",
+                        help="sweep both setups and compare them at each configuration")
+    parser.add_argument("--accuracy-floor", type=float, default=0.9,
+                        help="held-out accuracy the saved model must reach")
+    parser.add_argument("--max-mae", type=float, default=None, help="optionally also cap the risk score MAE")
+    parser.add_argument("--report", default="sweep_report.json", help="report file (.json or .csv)")
+    parser.add_argument("--output", default="compact", help="directory the selected model is saved in")
+    parser.add_argument("--latency-calls", type=int, default=200, help="single-row calls timed per configuration")
+    parser.add_argument("--no-save", action="store_true", help="only write the report")
+    args = parser.parse_args(argv)
+    setups = (SEPARATE, SINGLE) if args.compare else (SINGLE,) if args.single_model else (SEPARATE,)
+
+    features = load_features()
+    grid = list(itertools.product(parse_grid(args.trees), parse_grid(args.max_depth), parse_grid(args.min_samples_leaf),
+                                  setups))
+    scratch = tempfile.mkdtemp(prefix="model-sweep-")
+    rows = []
+    try:
+        for i, (trees, depth, leaf, setup) in enumerate(grid, 1):
+            params = {"n_estimators": trees, "max_depth": depth, "min_samples_leaf": leaf}
+            rows.append(measure_config(params, features, scratch, args.latency_calls, setup))
+            row = rows[-1]
+            print(f"[{i}/{len(grid)}] {setup} trees={trees} depth={depth} leaf={leaf}: accuracy {row['accuracy']:.4f}, "
+                  f"MAE {row['mae']:.2f}, {row['size_bytes'] / 1024:,.0f} KB, {row['latency_p50_ms']:.2f} ms",
+                  file=sys.stderr)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    pareto_front(rows)
+    selected = select_compact(rows, args.accuracy_floor, args.max_mae)
+    settings = {"accuracy_floor": args.accuracy_floor, "max_mae": args.max_mae, "setups": list(setups),
+                "data": train_model.DATA_FILE, "features": features.key, "test_size": train_model.TEST_SIZE}
+    write_report(args.report, rows, selected, settings)
+    print_table(rows, selected)
+    if args.compare:
+        print_comparison(rows)
+    print(f"\nReport written to {args.report}")
+
+    if selected is None:
+        print(f"No configuration reaches accuracy {args.accuracy_floor}; nothing saved")
+        return 1
+    if args.no_save:
+        return 0
+    params = {field: selected[field] for field in ("n_estimators", "max_depth", "min_samples_leaf")}
+    # Fits are seeded, so refitting gives the measured model
+    pipelines, metrics, _, _ = train_model.fit_models(features, params, single_model=selected["setup"] == SINGLE)
+    version = train_model.save_and_publish(pipelines, metrics, features.columns, features.categories,
+                                           directory=args.output,
+                                           extra_manifest={"sweep": dict(settings, selected=selected)},
+                                           promote_first=False)
+    print(f"Promote it with POST /api/admin/models/promote {{\"version\": \"{version}\"}}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
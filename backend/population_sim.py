@@ -0,0 +1,253 @@
+"""
+Monte Carlo population risk simulator.
+
+Draws virtual patients from a prevalence configuration and scores them with
+the compiled risk table, to estimate the risk category mix of a region when
+planning screening capacity. Patients only ever exist as arrays of rule
+levels, drawn and scored a chunk at a time; each chunk is reduced to counts
+per table value, so any number of patients runs in constant memory and the
+summary statistics are exact for the drawn sample.
+
+A configuration is a JSON object whose keys replace those of
+DEFAULT_PREVALENCE (the assumptions synthetic_data.py generates with).
+Each field is either a probability (yes/no answers) or a mapping of answer
+to probability (categorical answers, in any spelling the app accepts), or a
+list of age bands of those:
+
+    {"hiv_positive": 0.1,
+     "smoking": {"non-smoker": 0.8, "1-9/day": 0.1, "10-19/day": 0.05, ">20/day": 0.05},
+     "abnormal_pap_smear": [{"below_age": 30, "p": 0.05}, {"below_age": null, "p": 0.12}]}
+
+    python population_sim.py region_a.json region_b.json --patients 5000000 --workers 4
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from risk_engine import (POST_COITAL_BLEEDING, YOUNG_AGE, encode_value, load_risk_table, preprocess_answers,
+                         table_indices)
+
+DEFAULT_PREVALENCE = {
+    # [first age, last age, probability]; ages are uniform within a group
+    "age_groups": [[15, 19, 0.05], [20, 40, 0.3], [40, 60, 0.4], [60, 69, 0.2], [70, 89, 0.05]],
+    "abnormal_vaginal_bleeding": [{"below_age": 20, "p": 0.1}, {"below_age": 70, "p": 0.3},
+                                  {"below_age": None, "p": 0.4}],
+    "abnormal_vaginal_discharge": [{"below_age": 20, "p": 0.2}, {"below_age": 70, "p": 0.35},
+                                   {"below_age": None, "p": 0.3}],
+    "lower_abdominal_pain": [{"below_age": 20, "p": 0.3}, {"below_age": 70, "p": 0.3},
+                             {"below_age": None, "p": 0.4}],
+    # Only drawn for patients with abnormal bleeding
+    "bleeding_type": [
+        {"below_age": 20, "p": {"post-coital": 0.2, "post-menopausal": 0.0, "intermenstrual": 0.5, "longer periods": 0.3}},
+        {"below_age": 51, "p": {"post-coital": 0.3, "post-menopausal": 0.0, "intermenstrual": 0.4, "longer periods": 0.3}},
+        {"below_age": None, "p": {"post-coital": 0.2, "post-menopausal": 0.6, "intermenstrual": 0.1, "longer periods": 0.1}},
+    ],
+    "change_in_periods": 0.3,
+    "dyspareunia": 0.2,
+    "weight_loss": 0.15,
+    "unusual_fatigue": 0.25,
+    "sexual_partners": {"1-3": 0.7, "4-7": 0.2, ">8": 0.1},
+    "smoking": {"non-smoker": 0.7, "1-9/day": 0.1, "10-19/day": 0.1, ">20/day": 0.1},
+    "marital_status": {"single": 0.3, "married": 0.6, "divorced": 0.1},
+    "oral_contraceptive_use": [
+        {"below_age": 15, "p": {"none": 1.0}},
+        {"below_age": 61, "p": {"none": 0.4, "<5 years": 0.3, "5-9 years": 0.2, ">10 years": 0.1}},
+        {"below_age": None, "p": {"none": 1.0}},
+    ],
+    "age_first_intercourse": [
+        {"below_age": 16, "p": {"": 1.0}},
+        {"below_age": None, "p": {"<16 years": 0.2, "17-20 years": 0.5, ">21 years": 0.3}},
+    ],
+    "abnormal_pap_smear": 0.1,
+    # Number of children
+    "parity": [
+        {"below_age": 18, "p": {"0": 1.0}},
+        {"below_age": 30, "p": {str(n): 1 / 3 for n in range(3)}},
+        {"below_age": None, "p": {str(n): 1 / 8 for n in range(8)}},
+    ],
+    "hiv_positive": 0.02,
+}
+
+FLAG_FIELDS = ("abnormal_vaginal_bleeding", "abnormal_vaginal_discharge", "lower_abdominal_pain",
+               "change_in_periods", "dyspareunia", "weight_loss", "unusual_fatigue", "abnormal_pap_smear",
+               "hiv_positive")
+CODE_FIELDS = ("sexual_partners", "smoking", "marital_status", "oral_contraceptive_use", "age_first_intercourse")
+
+# Scores are stored in the table as tenths of a percent
+TABLE_VALUES = 1000
+CATEGORY_BOUNDS = (("Low risk", 0, 40), ("Medium risk", 40, 65), ("High risk", 65, 100))
+PERCENTILES = (5, 25, 50, 75, 95)
+Z_95 = 1.959963984540054
+
+
+def load_config(path):
+    """A prevalence configuration from a JSON file, on top of DEFAULT_PREVALENCE"""
+    with open(path) as f:
+        overrides = json.load(f)
+    unknown = set(overrides) - set(DEFAULT_PREVALENCE)
+    if unknown:
+        raise ValueError(f"{path}: unknown fields {', '.join(sorted(unknown))}")
+    return dict(DEFAULT_PREVALENCE, **overrides)
+
+
+def _bands(spec):
+    """Normalize a field spec to [(below_age, p), ...] with None for no upper bound"""
+    if isinstance(spec, list):
+        return [(band["below_age"], band["p"]) for band in spec]
+    return [(None, spec)]
+
+
+def _draw(rng, p, n, encode):
+    """Draw n answers: booleans for a probability, codes for a mapping of answers to probabilities"""
+    if not isinstance(p, dict):
+        return rng.random(n) < p
+    codes = np.array([encode(answer) for answer in p], dtype=np.int64)
+    weights = np.array(list(p.values()), dtype=np.float64)
+    return codes[rng.choice(len(codes), size=n, p=weights / weights.sum())]
+
+
+def _draw_by_age(rng, spec, ages, encode=None):
+    values = np.zeros(len(ages), dtype=np.int64)
+    remaining = np.ones(len(ages), dtype=bool)
+    for below_age, p in _bands(spec):
+        rows = remaining if below_age is None else remaining & (ages < below_age)
+        values[rows] = _draw(rng, p, int(rows.sum()), encode)
+        remaining &= ~rows
+    return values
+
+
+def draw_ages(rng, age_groups, n):
+    groups = np.array([group[:2] for group in age_groups], dtype=np.int64)
+    weights = np.array([group[2] for group in age_groups], dtype=np.float64)
+    group = rng.choice(len(groups), size=n, p=weights / weights.sum())
+    low, high = groups[group, 0], groups[group, 1]
+    return low + (rng.random(n) * (high - low + 1)).astype(np.int64)
+
+
+def draw_indices(rng, config, n):
+    """Flat risk table indices for n virtual patients"""
+    ages = draw_ages(rng, config["age_groups"], n)
+    levels = {field: _draw_by_age(rng, config[field], ages) for field in FLAG_FIELDS}
+    for field in CODE_FIELDS:
+        levels[field] = _draw_by_age(rng, config[field], ages, lambda answer, field=field: encode_value(field, answer))
+
+    bleeding_type = _draw_by_age(rng, config["bleeding_type"], ages,
+                                 lambda answer: encode_value("bleeding_type", answer))
+    levels["is_post_coital_or_post_menopausal"] = levels["abnormal_vaginal_bleeding"] & \
+        np.isin(bleeding_type, POST_COITAL_BLEEDING)
+    levels["young"] = ages < YOUNG_AGE
+    parity = _draw_by_age(rng, config["parity"], ages, lambda answer: preprocess_answers({"parity": answer})["parity"])
+    levels["high_parity"] = parity >= 5
+    return table_indices(levels)
+
+
+def simulate_counts(config, patients, seed=0, chunk_size=1_000_000):
+    """Number of simulated patients at each table value (score * 10)"""
+    table = load_risk_table()
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(TABLE_VALUES, dtype=np.int64)
+    for start in range(0, patients, chunk_size):
+        n = min(chunk_size, patients - start)
+        counts += np.bincount(table[draw_indices(rng, config, n)], minlength=TABLE_VALUES)
+    return counts
+
+
+def _wilson_interval(successes, n):
+    if n == 0:
+        return 0.0, 0.0
+    share = successes / n
+    denominator = 1 + Z_95 ** 2 / n
+    centre = (share + Z_95 ** 2 / (2 * n)) / denominator
+    spread = Z_95 * math.sqrt(share * (1 - share) / n + Z_95 ** 2 / (4 * n ** 2)) / denominator
+    return max(0.0, centre - spread), min(1.0, centre + spread)
+
+
+def summarize(counts):
+    """Category shares, score histogram, percentiles and 95% confidence intervals"""
+    n = int(counts.sum())
+    scores = np.arange(TABLE_VALUES) / 10.0
+    mean = float((counts * scores).sum() / n)
+    variance = float((counts * (scores - mean) ** 2).sum() / max(n - 1, 1))
+    half_width = Z_95 * math.sqrt(variance / n)
+
+    categories = {}
+    for name, low, high in CATEGORY_BOUNDS:
+        in_category = int(counts[low * 10:high * 10].sum())
+        low_ci, high_ci = _wilson_interval(in_category, n)
+        categories[name] = {"share": in_category / n, "ci_95": [low_ci, high_ci], "patients": in_category}
+
+    cumulative = np.cumsum(counts)
+    percentiles = {f"p{q}": float(scores[np.searchsorted(cumulative, q / 100 * n)]) for q in PERCENTILES}
+    # Whole percent bins: bin i holds scores from i up to but not including i + 1
+    histogram = np.add.reduceat(counts, np.arange(0, TABLE_VALUES, 10))
+    return {
+        "patients": n,
+        "categories": categories,
+        "mean_score": mean,
+        "mean_score_ci_95": [mean - half_width, mean + half_width],
+        "percentiles": percentiles,
+        "histogram": histogram.tolist(),
+    }
+
+
+def simulate(config, patients, seed=0, chunk_size=1_000_000):
+    return summarize(simulate_counts(config, patients, seed, chunk_size))
+
+
+def simulate_many(configs, patients, seed=0, workers=None, chunk_size=1_000_000):
+    """Simulate each configuration in its own process; results come back in order"""
+    seeds = np.random.SeedSequence(seed).spawn(len(configs))
+    workers = min(workers or os.cpu_count() or 1, len(configs))
+    if workers <= 1:
+        return [simulate(config, patients, child, chunk_size) for config, child in zip(configs, seeds)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(simulate, configs, [patients] * len(configs), seeds, [chunk_size] * len(configs)))
+
+
+def print_summary(name, result):
+    print(f"{name}: {result['patients']:,} patients")
+    for category, stats in result["categories"].items():
+        low, high = stats["ci_95"]
+        print(f"  {category:<12} {stats['share']:7.2%}  (95% CI {low:.2%} - {high:.2%})")
+    low, high = result["mean_score_ci_95"]
+    print(f"  Mean score   {result['mean_score']:.2f}  (95% CI {low:.2f} - {high:.2f})")
+    print("  " + "  ".join(f"{name} {value:g}" for name, value in result["percentiles"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("configs", nargs="*", help="prevalence configuration JSON files (default: synthetic data assumptions)")
+    parser.add_argument("--patients", type=int, default=1_000_000, help="virtual patients per configuration")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="patients drawn and scored at a time")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    names = args.configs or ["default"]
+    configs = [load_config(path) for path in args.configs] or [DEFAULT_PREVALENCE]
+    # Build the table once up front rather than in every worker
+    load_risk_table()
+    start = time.perf_counter()
+    results = simulate_many(configs, args.patients, args.seed, args.workers, args.chunk_size)
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps(dict(zip(names, results)), indent=2))
+    else:
+        for name, result in zip(names, results):
+            print_summary(name, result)
+        print(f"{len(results)} configuration(s) in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
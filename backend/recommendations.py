@@ -0,0 +1,196 @@
+"""
+Versioned recommendation templates.
+
+Assessments store a general template id and a short list of personalized item
+codes instead of the text itself. Text is expanded from the registries below,
+so a wording change is a new template version and old rows keep showing what
+the patient was actually given.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from risk_engine import SMOKING_NONE
+
+# General advice per template id. Ids are never reused; a new wording gets a
+# new id and TEMPLATE_BY_CATEGORY is pointed at it.
+GENERAL_TEMPLATES = {
+    1: """
+        Based on your responses, your risk of cervical cancer is low.
+        
+        Over 99% of cervical cancer cases are caused by the human papillomavirus (HPV). The good news is that HPV is preventable.
+        
+        To protect yourself:
+        • Get the HPV vaccine if you haven't already and you are under 45
+        • Use condoms every time you have sex to lower your risk of infection
+        • Keep healthy habits—exercise, don't smoke, eat well, treat STIs early
+        • If you notice unusual vaginal bleeding, discharge, or pain, see your doctor right away
+        
+        If you're aged 21 to 65 and haven't been screened for cervical cancer, it's time to take that step. Screening options include:
+        • HPV DNA test
+        • Pap test
+        • VIA (Visual Inspection with Acetic Acid)
+        
+        If it's been over 3 years since your last Pap test or over 5 years since your last VIA or HPV DNA test, you're due for another one.
+        
+        Next step: Please book a check-up with your doctor to review your symptoms and get screened if needed. It's quick, and it will make a big difference in your health.
+        
+        Small prevention dey save big wahala.
+        """,
+    2: """
+        Based on your responses, your risk of cervical cancer is medium.
+        
+        We recommend that you schedule an appointment with your healthcare provider within the next 2-4 weeks. Discuss your symptoms and risk factors with your doctor.
+        • You may need further testing such as a pelvic exam, HPV test, or colposcopy
+        
+        Over 99% of cervical cancer cases are caused by the human papillomavirus (HPV). The good news is that HPV is preventable.
+        
+        To protect yourself:
+        • Get the HPV vaccine if you haven't already and you are under 45
+        • Use condoms every time you have sex to lower your risk of infection
+        • Keep healthy habits—exercise, don't smoke, eat well, treat STIs early
+        • If you notice unusual vaginal bleeding, discharge, or pain, see your doctor right away
+        
+        If you're aged 21 to 65 and haven't been screened for cervical cancer, it's time to take that step. Screening options include:
+        • HPV DNA test
+        • Pap test
+        • VIA (Visual Inspection with Acetic Acid)
+        
+        If it's been over 3 years since your last Pap test or over 5 years since your last VIA or HPV DNA test, you're due for another one.
+        
+        Next step: Please book a check-up with your doctor to review your symptoms and get screened if needed. It's quick, and it will make a big difference in your health.
+        
+        Small prevention dey save big wahala.
+        """,
+    3: """
+        Based on your responses, your risk for cervical cancer is high.
+        
+        While other causes of your symptoms are possible, we strongly recommend that you contact your healthcare provider immediately (within the next week) for a full evaluation. A referral to a gynecologist may be necessary, and diagnostic testing such as a VIA, pap, colposcopy or biopsy is recommended. 
+        
+        Taking action now helps you get answers faster—and gives you the best chance at staying healthy. Early diagnosis can significantly improve outcomes.
+        """,
+}
+
+# Template used for new assessments in each risk category
+TEMPLATE_BY_CATEGORY = {
+    "Low risk": 1,
+    "Medium risk": 2,
+    "High risk": 3,
+}
+
+# Personalized items per code. Like template ids, codes are never reused.
+REC_ABNORMAL_PAP = 1
+REC_HIV_POSITIVE = 2
+REC_SMOKING = 3
+REC_HPV_VACCINE = 4
+REC_POST_COITAL_BLEEDING = 5
+REC_WEIGHT_LOSS_AND_FATIGUE = 6
+
+PERSONALIZED_TEXT = {
+    REC_ABNORMAL_PAP: "Follow up on your abnormal Pap test results with your healthcare provider",
+    REC_HIV_POSITIVE: "As an HIV-positive individual, you should receive more frequent cervical screening. Consult your HIV care provider",
+    REC_SMOKING: "Consider smoking cessation as smoking increases cervical cancer risk",
+    REC_HPV_VACCINE: "If you haven't received the HPV vaccine, discuss this option with your healthcare provider",
+    REC_POST_COITAL_BLEEDING: "Post-coital or post-menopausal bleeding requires prompt medical evaluation",
+    REC_WEIGHT_LOSS_AND_FATIGUE: "Your weight loss and fatigue should be evaluated by a healthcare provider",
+}
+
+_TEMPLATE_BY_TEXT = {text.strip(): template_id for template_id, text in GENERAL_TEMPLATES.items()}
+_CODE_BY_TEXT = {text: code for code, text in PERSONALIZED_TEXT.items()}
+
+
+def general_template_id(risk_category):
+    # Anything that is not low or medium gets the high risk advice
+    return TEMPLATE_BY_CATEGORY.get(risk_category, TEMPLATE_BY_CATEGORY["High risk"])
+
+
+def personalized_codes(patient_data):
+    """Codes of the personalized items that apply to a preprocessed patient"""
+    codes = []
+    if patient_data.get("abnormal_pap_smear", False):
+        codes.append(REC_ABNORMAL_PAP)
+    if patient_data.get("hiv_positive", False):
+        codes.append(REC_HIV_POSITIVE)
+    # Only for patients who actually smoke
+    if patient_data.get("smoking", SMOKING_NONE) != SMOKING_NONE:
+        codes.append(REC_SMOKING)
+    # HPV vaccination is recommended up to 45
+    if patient_data.get("age", 35) < 45:
+        codes.append(REC_HPV_VACCINE)
+    if patient_data.get("abnormal_vaginal_bleeding", False) and patient_data.get("is_post_coital_or_post_menopausal", False):
+        codes.append(REC_POST_COITAL_BLEEDING)
+    if patient_data.get("weight_loss", False) and patient_data.get("unusual_fatigue", False):
+        codes.append(REC_WEIGHT_LOSS_AND_FATIGUE)
+    return codes
+
+
+def general_template_ids(risk_categories):
+    """Vectorized general_template_id"""
+    risk_categories = np.asarray(risk_categories, dtype=object)
+    template_ids = np.full(len(risk_categories), general_template_id("High risk"), dtype=np.int16)
+    for category in ("Low risk", "Medium risk"):
+        template_ids[risk_categories == category] = general_template_id(category)
+    return template_ids
+
+
+def personalized_code_columns(answers):
+    """
+    Vectorized personalized_codes for the answer arrays
+    risk_engine.column_answers returns. Gives the encoded code string per row.
+    """
+    applies = [
+        (REC_ABNORMAL_PAP, answers["abnormal_pap_smear"].astype(bool)),
+        (REC_HIV_POSITIVE, answers["hiv_positive"].astype(bool)),
+        (REC_SMOKING, answers["smoking"] != SMOKING_NONE),
+        (REC_HPV_VACCINE, answers["age"] < 45),
+        (REC_POST_COITAL_BLEEDING, answers["abnormal_vaginal_bleeding"].astype(bool) &
+         answers["is_post_coital_or_post_menopausal"].astype(bool)),
+        (REC_WEIGHT_LOSS_AND_FATIGUE, answers["weight_loss"].astype(bool) & answers["unusual_fatigue"].astype(bool)),
+    ]
+    # One bit per item; encode each distinct combination once
+    mask = np.zeros(len(answers["age"]), dtype=np.int64)
+    for bit, (_, flags) in enumerate(applies):
+        mask |= flags.astype(np.int64) << bit
+    encoded = np.array([encode_codes([code for bit, (code, _) in enumerate(applies) if combination >> bit & 1])
+                        for combination in range(1 << len(applies))], dtype=object)
+    return encoded[mask]
+
+
+def expand_template(template_id):
+    return GENERAL_TEMPLATES.get(template_id, "")
+
+
+def encode_codes(codes):
+    """Compact comma separated form of a code list for storage"""
+    return ",".join(str(code) for code in codes)
+
+
+@lru_cache(maxsize=256)
+def expand_codes(encoded):
+    """Personalized item texts for a stored code string"""
+    if not encoded:
+        return ()
+    return tuple(PERSONALIZED_TEXT[int(code)] for code in encoded.split(",") if int(code) in PERSONALIZED_TEXT)
+
+
+def template_id_for_text(text):
+    """Template id of a stored general text, or None if it matches no template"""
+    if text is None:
+        return None
+    return _TEMPLATE_BY_TEXT.get(text.strip())
+
+
+def codes_for_text(text):
+    """Codes for a stored newline-joined personalized list, or None if any line is unknown"""
+    if text is None:
+        return None
+    codes = []
+    for line in text.split("\n"):
+        if not line:
+            continue
+        code = _CODE_BY_TEXT.get(line.strip())
+        if code is None:
+            return None
+        codes.append(code)
+    return codes
@@ -0,0 +1,933 @@
+"""
+Cervical cancer risk scoring engine.
+
+Every input the rules read is a boolean or a small categorical level, so the
+whole rule set is compiled once into a dense table of fixed-point scores
+(risk * 10 as uint16) stored next to the ML models and memory-mapped by every
+worker. Scoring a patient is one index computation and one array read, and
+calculate_risk_score_batch does the same for whole columns at once. Scores are
+identical to walking the rules one patient at a time.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the scoring rules change so stale tables are rebuilt and
+# stored assessments get re-scored (flask rescore-history)
+RULES_VERSION = 2
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+RISK_TABLE_PATH = os.path.join(MODEL_DIR, f"risk_table_v{RULES_VERSION}.npy")
+
+TRUE_STRINGS = ("yes", "true", "1", "y")
+
+BOOLEAN_FIELDS = ("abnormal_vaginal_bleeding", "abnormal_vaginal_discharge",
+                  "lower_abdominal_pain", "change_in_periods", "dyspareunia",
+                  "weight_loss", "unusual_fatigue", "is_post_coital_or_post_menopausal",
+                  "hiv_positive", "abnormal_pap_smear", "high_parity")
+
+# Scenario id indexed by bleeding * 4 + discharge * 2 + pain
+SCENARIO_BY_SYMPTOMS_LIST = [8, 7, 4, 5, 3, 6, 2, 1]
+SCENARIO_BY_SYMPTOMS = np.array(SCENARIO_BY_SYMPTOMS_LIST, dtype=np.int8)
+
+SCENARIO_NAMES = {
+    1: "Scenario 1: All three primary symptoms present",
+    2: "Scenario 2: Bleeding and discharge without pain",
+    3: "Scenario 3: Bleeding only",
+    4: "Scenario 4: Discharge only",
+    5: "Scenario 5: Discharge and pain without bleeding",
+    6: "Scenario 6: Bleeding and pain without discharge",
+    7: "Scenario 7: Pain only",
+    8: "Scenario 8: No primary symptoms",
+}
+
+# The rules, shared by the Flask app, the Streamlit tool (model.py) and the
+# synthetic data generator. They are applied in this order:
+#   1. base risk for the scenario, higher with post-coital/post-menopausal bleeding
+#   2. patients under YOUNG_AGE restart from YOUNG_BASE_RISK unless their scenario
+#      is in YOUNG_EXEMPT_SCENARIOS or they have post-coital bleeding
+#   3. ADDITIVE_RULES, in order
+#   4. HIV adds HIV_RISK_SHARE of the risk so far, without passing MAX_RISK
+#   5. everything is capped at MAX_RISK, and young patients at YOUNG_RISK_CAP
+
+# Scenario id: (base risk, base risk with post-coital/post-menopausal bleeding)
+SCENARIO_BASE_RISK = {
+    1: (95.0, 95.0),
+    2: (50.0, 76.0),
+    3: (50.0, 76.0),
+    4: (40.0, 40.0),
+    5: (45.0, 45.0),
+    6: (50.0, 70.0),
+    7: (30.0, 30.0),
+    8: (0.0, 0.0),
+}
+YOUNG_AGE = 20
+YOUNG_BASE_RISK = 10.0
+YOUNG_EXEMPT_SCENARIOS = (1,)
+YOUNG_RISK_CAP = 30.0
+HIV_RISK_SHARE = 0.5
+MAX_RISK = 99.0
+
+# Base risk indexed by scenario id (index 0 unused)
+BASE_RISK = np.array([0.0] + [SCENARIO_BASE_RISK[s][0] for s in range(1, 9)])
+BASE_RISK_POST_COITAL = np.array([0.0] + [SCENARIO_BASE_RISK[s][1] for s in range(1, 9)])
+
+# Canonical codes for the categorical answers. The tables are keyed by the
+# normalized spelling (stripped, lower case, en dashes as hyphens) of every
+# value the frontend, model.py and the synthetic CSV send.
+BLEEDING_NONE, BLEEDING_INTERMENSTRUAL, BLEEDING_POST_COITAL, BLEEDING_POST_MENOPAUSAL, \
+    BLEEDING_HEAVIER, BLEEDING_OTHER = range(6)
+BLEEDING_TYPE_CODES = {
+    "": BLEEDING_NONE, "none": BLEEDING_NONE, "nan": BLEEDING_NONE,
+    "intermenstrual": BLEEDING_INTERMENSTRUAL,
+    "post-coital": BLEEDING_POST_COITAL, "postcoital": BLEEDING_POST_COITAL,
+    "post-menopausal": BLEEDING_POST_MENOPAUSAL, "postmenopausal": BLEEDING_POST_MENOPAUSAL,
+    "heavier": BLEEDING_HEAVIER, "heavier periods": BLEEDING_HEAVIER, "longer periods": BLEEDING_HEAVIER,
+}
+POST_COITAL_BLEEDING = (BLEEDING_POST_COITAL, BLEEDING_POST_MENOPAUSAL)
+
+PARTNERS_NONE, PARTNERS_1_3, PARTNERS_4_7, PARTNERS_8_PLUS = range(4)
+PARTNER_CODES = {
+    "": PARTNERS_NONE, "0": PARTNERS_NONE, "none": PARTNERS_NONE,
+    "1-3": PARTNERS_1_3, "4-7": PARTNERS_4_7, ">8": PARTNERS_8_PLUS, "8+": PARTNERS_8_PLUS,
+}
+
+# SMOKING_CURRENT is a current smoker who did not say how much
+SMOKING_NONE, SMOKING_1_9, SMOKING_10_19, SMOKING_20_PLUS, SMOKING_CURRENT = range(5)
+SMOKING_CODES = {
+    "": SMOKING_NONE, "none": SMOKING_NONE, "no": SMOKING_NONE, "non-smoker": SMOKING_NONE,
+    "never": SMOKING_NONE, "previous": SMOKING_NONE,
+    "1-9/day": SMOKING_1_9, "1-9": SMOKING_1_9,
+    "10-19/day": SMOKING_10_19, "10-19": SMOKING_10_19,
+    ">20/day": SMOKING_20_PLUS, ">20": SMOKING_20_PLUS, "20+": SMOKING_20_PLUS,
+    "current": SMOKING_CURRENT, "yes": SMOKING_CURRENT, "smoker": SMOKING_CURRENT,
+}
+
+MARITAL_OTHER, MARITAL_SINGLE, MARITAL_DIVORCED = range(3)
+MARITAL_CODES = {
+    "": MARITAL_OTHER, "married": MARITAL_OTHER,
+    "single": MARITAL_SINGLE, "divorced": MARITAL_DIVORCED,
+}
+
+CONTRACEPTIVE_UNDER_5, CONTRACEPTIVE_5_9, CONTRACEPTIVE_10_PLUS = range(3)
+CONTRACEPTIVE_CODES = {
+    "": CONTRACEPTIVE_UNDER_5, "none": CONTRACEPTIVE_UNDER_5, "no": CONTRACEPTIVE_UNDER_5,
+    "yes": CONTRACEPTIVE_UNDER_5, "<5 years": CONTRACEPTIVE_UNDER_5,
+    "5-9 years": CONTRACEPTIVE_5_9, ">10 years": CONTRACEPTIVE_10_PLUS,
+}
+
+FIRST_INTERCOURSE_UNKNOWN, FIRST_INTERCOURSE_UNDER_16, FIRST_INTERCOURSE_16_20, FIRST_INTERCOURSE_21_PLUS = range(4)
+FIRST_INTERCOURSE_CODES = {
+    "": FIRST_INTERCOURSE_UNKNOWN, "not applicable": FIRST_INTERCOURSE_UNKNOWN,
+    "<16 years": FIRST_INTERCOURSE_UNDER_16,
+    "16-20 years": FIRST_INTERCOURSE_16_20, "17-20 years": FIRST_INTERCOURSE_16_20,
+    ">21 years": FIRST_INTERCOURSE_21_PLUS,
+}
+
+AFFIRMATIVE_ANSWERS = ("yes", "true", "1", "y", "current")
+
+# Modifier codes reported by risk_modifiers. Each is paired with the change
+# in risk it caused, so the base risk plus the deltas gives the final score.
+MOD_YOUNG_AGE = 1
+MOD_CHANGE_IN_PERIODS = 2
+MOD_DYSPAREUNIA = 3
+MOD_WEIGHT_LOSS_AND_FATIGUE = 4
+MOD_WEIGHT_LOSS = 5
+MOD_FATIGUE = 6
+MOD_PARTNERS_1_3 = 7
+MOD_PARTNERS_4_7 = 8
+MOD_PARTNERS_8_PLUS = 9
+MOD_SMOKING_1_9 = 10
+MOD_SMOKING_10_19 = 11
+MOD_SMOKING_20_PLUS = 12
+MOD_MARITAL_SINGLE = 13
+MOD_MARITAL_DIVORCED = 14
+MOD_CONTRACEPTIVE_5_9 = 15
+MOD_CONTRACEPTIVE_10_PLUS = 16
+MOD_FIRST_INTERCOURSE_UNDER_16 = 17
+MOD_FIRST_INTERCOURSE_16_20 = 18
+MOD_FIRST_INTERCOURSE_21_PLUS = 19
+MOD_ABNORMAL_PAP = 20
+MOD_HIGH_PARITY = 21
+MOD_HIV_POSITIVE = 22
+MOD_YOUNG_CAP = 23
+MOD_MAX_CAP = 24
+
+# Explanation text per modifier code; {delta} is the change in risk.
+# MOD_YOUNG_AGE is rendered on the scenario name and MOD_MAX_CAP is silent.
+MODIFIER_TEXT = {
+    MOD_CHANGE_IN_PERIODS: "Change in periods (+2%)",
+    MOD_DYSPAREUNIA: "Painful intercourse (+5%)",
+    MOD_WEIGHT_LOSS_AND_FATIGUE: "Weight loss and fatigue (+20%)",
+    MOD_WEIGHT_LOSS: "Weight loss (+5%)",
+    MOD_FATIGUE: "Unusual fatigue (+5%)",
+    MOD_PARTNERS_1_3: "1-3 sexual partners (+2%)",
+    MOD_PARTNERS_4_7: "4-7 sexual partners (+5%)",
+    MOD_PARTNERS_8_PLUS: ">8 sexual partners (+10%)",
+    MOD_SMOKING_1_9: "Smoking 1-9/day (+5%)",
+    MOD_SMOKING_10_19: "Smoking 10-19/day (+10%)",
+    MOD_SMOKING_20_PLUS: "Smoking 20+/day (+15%)",
+    MOD_MARITAL_SINGLE: "Marital status: single (+2%)",
+    MOD_MARITAL_DIVORCED: "Marital status: divorced (+2%)",
+    MOD_CONTRACEPTIVE_5_9: "Oral contraceptive use 5-9 years (+5%)",
+    MOD_CONTRACEPTIVE_10_PLUS: "Oral contraceptive use 10+ years (+10%)",
+    MOD_FIRST_INTERCOURSE_UNDER_16: "First intercourse <16 years (+10%)",
+    MOD_FIRST_INTERCOURSE_16_20: "First intercourse 17-20 years (+5%)",
+    MOD_FIRST_INTERCOURSE_21_PLUS: "First intercourse >21 years (+2%)",
+    MOD_ABNORMAL_PAP: "Abnormal pap smear history (+50%)",
+    MOD_HIGH_PARITY: "High parity (5+ births) (+5%)",
+    MOD_HIV_POSITIVE: "HIV positive (+{delta:.1f}%)",
+    MOD_YOUNG_CAP: "Risk capped at 30% for young patients",
+}
+
+# Additive rules: (levels read, risk added, modifier code). With several
+# levels the combined level is first + size(first) * second, and the risk and
+# code tuples are indexed by it; a code of None means the rule does not fire.
+ADDITIVE_RULES = (
+    (("change_in_periods",), (0.0, 2.0), (None, MOD_CHANGE_IN_PERIODS)),
+    (("dyspareunia",), (0.0, 5.0), (None, MOD_DYSPAREUNIA)),
+    (("weight_loss", "unusual_fatigue"), (0.0, 5.0, 5.0, 20.0),
+     (None, MOD_WEIGHT_LOSS, MOD_FATIGUE, MOD_WEIGHT_LOSS_AND_FATIGUE)),
+    (("sexual_partners",), (0.0, 2.0, 5.0, 10.0),
+     (None, MOD_PARTNERS_1_3, MOD_PARTNERS_4_7, MOD_PARTNERS_8_PLUS)),
+    (("smoking",), (0.0, 5.0, 10.0, 15.0, 0.0),
+     (None, MOD_SMOKING_1_9, MOD_SMOKING_10_19, MOD_SMOKING_20_PLUS, None)),
+    (("marital_status",), (0.0, 2.0, 2.0), (None, MOD_MARITAL_SINGLE, MOD_MARITAL_DIVORCED)),
+    (("oral_contraceptive_use",), (0.0, 5.0, 10.0),
+     (None, MOD_CONTRACEPTIVE_5_9, MOD_CONTRACEPTIVE_10_PLUS)),
+    (("age_first_intercourse",), (0.0, 10.0, 5.0, 2.0),
+     (None, MOD_FIRST_INTERCOURSE_UNDER_16, MOD_FIRST_INTERCOURSE_16_20, MOD_FIRST_INTERCOURSE_21_PLUS)),
+    (("abnormal_pap_smear",), (0.0, 50.0), (None, MOD_ABNORMAL_PAP)),
+    (("high_parity",), (0.0, 5.0), (None, MOD_HIGH_PARITY)),
+)
+
+# Axes of the compiled risk table, most significant first
+TABLE_DIMENSIONS = (
+    ("abnormal_vaginal_bleeding", 2),
+    ("abnormal_vaginal_discharge", 2),
+    ("lower_abdominal_pain", 2),
+    ("is_post_coital_or_post_menopausal", 2),
+    ("young", 2),
+    ("change_in_periods", 2),
+    ("dyspareunia", 2),
+    ("weight_loss", 2),
+    ("unusual_fatigue", 2),
+    ("sexual_partners", 4),
+    ("smoking", 5),
+    ("marital_status", 3),
+    ("oral_contraceptive_use", 3),
+    ("age_first_intercourse", 4),
+    ("abnormal_pap_smear", 2),
+    ("high_parity", 2),
+    ("hiv_positive", 2),
+)
+TABLE_SHAPE = tuple(size for _, size in TABLE_DIMENSIONS)
+TABLE_STRIDES = {name: int(np.prod(TABLE_SHAPE[i + 1:], dtype=np.int64))
+                 for i, (name, _) in enumerate(TABLE_DIMENSIONS)}
+
+
+def _compile_rules(rules):
+    """Multipliers for the combined level plus per-row and array forms of the risks"""
+    sizes = dict(TABLE_DIMENSIONS)
+    compiled = []
+    for names, risks, codes in rules:
+        multipliers = []
+        combined_size = 1
+        for name in names:
+            multipliers.append(combined_size)
+            combined_size *= sizes[name]
+        if len(risks) != combined_size or len(codes) != combined_size:
+            raise ValueError(f"Rule on {names} needs {combined_size} risks and codes")
+        compiled.append((tuple(zip(names, multipliers)), tuple(float(r) for r in risks),
+                         np.array(risks, dtype=float), tuple(codes)))
+    return tuple(compiled)
+
+
+_COMPILED_RULES = _compile_rules(ADDITIVE_RULES)
+
+# Modifiable factors for what-if analysis, with a label per level. Level 0
+# of each is the answer that adds no risk.
+WHAT_IF_FACTORS = {
+    "smoking": ["Non-smoker", "1-9/day", "10-19/day", "20+/day", "Current, amount not given"],
+    "oral_contraceptive_use": ["None or under 5 years", "5-9 years", "10+ years"],
+    "sexual_partners": ["0", "1-3", "4-7", "8+"],
+}
+
+# Raw answers each table level is derived from
+LEVEL_SOURCES = {name: (name,) for name, _ in TABLE_DIMENSIONS}
+LEVEL_SOURCES.update({
+    "is_post_coital_or_post_menopausal": ("is_post_coital_or_post_menopausal", "bleeding_type"),
+    "young": ("age", "dob"),
+    "smoking": ("smoking", "cigarettes_per_day"),
+    "oral_contraceptive_use": ("oral_contraceptive_use", "contraceptive_years"),
+    "high_parity": ("high_parity", "parity"),
+})
+
+_risk_table = None
+
+
+def _normalize(value):
+    return str(value).strip().lower().replace("\u2013", "-").replace("\u2014", "-")
+
+
+def _is_true(text):
+    return text.lower() in TRUE_STRINGS
+
+
+# Fallbacks for spellings missing from the code tables below; they keep the
+# substring rules the engine has always applied to free text
+def _bleeding_type_fallback(key):
+    if any(type_str in key for type_str in ("post-coital", "postcoital")):
+        return BLEEDING_POST_COITAL
+    elif any(type_str in key for type_str in ("post-menopausal", "postmenopausal")):
+        return BLEEDING_POST_MENOPAUSAL
+    return BLEEDING_OTHER if key else BLEEDING_NONE
+
+
+def _partner_fallback(key):
+    if "1-3" in key:
+        return PARTNERS_1_3
+    elif "4-7" in key:
+        return PARTNERS_4_7
+    elif ">8" in key or "8+" in key:
+        return PARTNERS_8_PLUS
+    return PARTNERS_NONE
+
+
+def _smoking_fallback(key):
+    if "1-9/day" in key:
+        return SMOKING_1_9
+    elif "10-19/day" in key:
+        return SMOKING_10_19
+    elif ">20/day" in key or "20+" in key:
+        return SMOKING_20_PLUS
+    return SMOKING_NONE
+
+
+def _marital_fallback(key):
+    if "single" in key:
+        return MARITAL_SINGLE
+    elif "divorced" in key:
+        return MARITAL_DIVORCED
+    return MARITAL_OTHER
+
+
+def _contraceptive_fallback(key):
+    if "5-9 years" in key:
+        return CONTRACEPTIVE_5_9
+    elif ">10 years" in key or "10+" in key:
+        return CONTRACEPTIVE_10_PLUS
+    return CONTRACEPTIVE_UNDER_5
+
+
+def _first_intercourse_fallback(key):
+    if "<16 years" in key:
+        return FIRST_INTERCOURSE_UNDER_16
+    elif "17-20 years" in key or "16-20 years" in key:
+        return FIRST_INTERCOURSE_16_20
+    elif ">21 years" in key:
+        return FIRST_INTERCOURSE_21_PLUS
+    return FIRST_INTERCOURSE_UNKNOWN
+
+
+ENCODERS = {
+    "bleeding_type": (BLEEDING_TYPE_CODES, _bleeding_type_fallback),
+    "sexual_partners": (PARTNER_CODES, _partner_fallback),
+    "smoking": (SMOKING_CODES, _smoking_fallback),
+    "cigarettes_per_day": (SMOKING_CODES, _smoking_fallback),
+    "marital_status": (MARITAL_CODES, _marital_fallback),
+    "oral_contraceptive_use": (CONTRACEPTIVE_CODES, _contraceptive_fallback),
+    "contraceptive_years": (CONTRACEPTIVE_CODES, _contraceptive_fallback),
+    "age_first_intercourse": (FIRST_INTERCOURSE_CODES, _first_intercourse_fallback),
+}
+
+
+def encode_value(field, value):
+    """Canonical code for one categorical answer"""
+    codes, fallback = ENCODERS[field]
+    key = _normalize(value)
+    code = codes.get(key)
+    return fallback(key) if code is None else code
+
+
+def encode_answers(data):
+    """
+    Map the categorical answers to canonical codes once, so nothing downstream
+    has to search the raw strings again. The frontend sends smoking and
+    contraceptive use as a yes/no style answer plus a separate amount field.
+    """
+    encoded = {field: encode_value(field, data.get(field, ""))
+               for field in ("bleeding_type", "sexual_partners", "smoking", "marital_status",
+                             "oral_contraceptive_use", "age_first_intercourse")}
+    if encoded["smoking"] == SMOKING_CURRENT and data.get("cigarettes_per_day"):
+        encoded["smoking"] = encode_value("cigarettes_per_day", data["cigarettes_per_day"]) or SMOKING_CURRENT
+    if _normalize(data.get("oral_contraceptive_use", "")) in AFFIRMATIVE_ANSWERS:
+        encoded["oral_contraceptive_use"] = encode_value("contraceptive_years", data.get("contraceptive_years", ""))
+    return encoded
+
+
+def parse_parity(value):
+    try:
+        return int(value)
+    except ValueError:
+        return 5 if ">=5" in str(value) else 0
+
+
+def age_from_dob(dob):
+    """Age in whole years from a YYYY-MM-DD string or a date"""
+    if isinstance(dob, str):
+        dob = datetime.strptime(dob, "%Y-%m-%d").date()
+    today = datetime.now().date()
+    return today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+
+
+def preprocess_answers(data):
+    """Parse one patient's raw answers into the flags, age, parity and codes the rules read"""
+    processed = {}
+    for field in BOOLEAN_FIELDS:
+        if field in data:
+            processed[field] = str(data[field]).lower() in TRUE_STRINGS
+
+    if "age" in data:
+        processed["age"] = int(data["age"])
+    elif "dob" in data:
+        processed["age"] = age_from_dob(data["dob"])
+
+    if "parity" in data:
+        processed["parity"] = parse_parity(data["parity"])
+
+    processed.update(encode_answers(data))
+    return processed
+
+
+def patient_levels(data):
+    """Reduce one preprocessed patient dict to the levels the rules read"""
+    is_post_coital = bool(data.get("is_post_coital_or_post_menopausal", False)) or \
+        data.get("bleeding_type", BLEEDING_NONE) in POST_COITAL_BLEEDING
+    return {
+        "abnormal_vaginal_bleeding": int(bool(data.get("abnormal_vaginal_bleeding", False))),
+        "abnormal_vaginal_discharge": int(bool(data.get("abnormal_vaginal_discharge", False))),
+        "lower_abdominal_pain": int(bool(data.get("lower_abdominal_pain", False))),
+        "is_post_coital_or_post_menopausal": int(is_post_coital),
+        "young": int(data.get("age", 35) < YOUNG_AGE),
+        "change_in_periods": int(bool(data.get("change_in_periods", False))),
+        "dyspareunia": int(bool(data.get("dyspareunia", False))),
+        "weight_loss": int(bool(data.get("weight_loss", False))),
+        "unusual_fatigue": int(bool(data.get("unusual_fatigue", False))),
+        "sexual_partners": data.get("sexual_partners", PARTNERS_NONE),
+        "smoking": data.get("smoking", SMOKING_NONE),
+        "marital_status": data.get("marital_status", MARITAL_OTHER),
+        "oral_contraceptive_use": data.get("oral_contraceptive_use", CONTRACEPTIVE_UNDER_5),
+        "age_first_intercourse": data.get("age_first_intercourse", FIRST_INTERCOURSE_UNKNOWN),
+        "abnormal_pap_smear": int(bool(data.get("abnormal_pap_smear", False))),
+        "high_parity": int(bool(data.get("high_parity", False)) or data.get("parity", 0) >= 5),
+        "hiv_positive": int(bool(data.get("hiv_positive", False))),
+    }
+
+
+def table_index(levels):
+    """Flat index into the risk table for one patient's levels"""
+    index = 0
+    for name, stride in TABLE_STRIDES.items():
+        index += levels[name] * stride
+    return index
+
+
+def table_indices(levels):
+    """Flat indices into the risk table for arrays of levels"""
+    index = np.zeros(len(levels["young"]), dtype=np.int64)
+    for name, _ in TABLE_DIMENSIONS:
+        index += np.asarray(levels[name], dtype=np.int64) * TABLE_STRIDES[name]
+    return index
+
+
+def levels_from_index(index):
+    """Inverse of table_index"""
+    levels = {}
+    for name, size in reversed(TABLE_DIMENSIONS):
+        index, levels[name] = divmod(index, size)
+    return levels
+
+
+def patch_levels(levels, answers, changed_fields):
+    """
+    Levels after some answers changed. `answers` holds the raw answers after
+    the change; only the levels fed by `changed_fields` are derived again.
+    Returns the new levels and the names of the levels that were re-derived.
+    """
+    affected = [name for name, sources in LEVEL_SOURCES.items()
+                if any(field in changed_fields for field in sources)]
+    patched = dict(levels)
+    if affected:
+        fields = {field for name in affected for field in LEVEL_SOURCES[name]}
+        fresh = patient_levels(preprocess_answers({field: answers[field] for field in fields if field in answers}))
+        for name in affected:
+            patched[name] = fresh[name]
+    return patched, affected
+
+
+def scenario_id(levels):
+    return SCENARIO_BY_SYMPTOMS_LIST[levels["abnormal_vaginal_bleeding"] * 4
+                                     + levels["abnormal_vaginal_discharge"] * 2
+                                     + levels["lower_abdominal_pain"]]
+
+
+def scenario_ids(levels):
+    index = (np.asarray(levels["abnormal_vaginal_bleeding"], dtype=np.int64) * 4
+             + np.asarray(levels["abnormal_vaginal_discharge"], dtype=np.int64) * 2
+             + np.asarray(levels["lower_abdominal_pain"], dtype=np.int64))
+    return SCENARIO_BY_SYMPTOMS[index]
+
+
+def _young_modified(levels, scenario_id):
+    has_bleeding = np.asarray(levels["abnormal_vaginal_bleeding"], dtype=bool)
+    is_post_coital = np.asarray(levels["is_post_coital_or_post_menopausal"], dtype=bool)
+    young = np.asarray(levels["young"], dtype=bool)
+    return young & ~(np.isin(scenario_id, YOUNG_EXEMPT_SCENARIOS) | (has_bleeding & is_post_coital))
+
+
+def _score_levels(levels):
+    """Walk the rules over arrays of levels; used to compile the risk table"""
+    def flag(name):
+        return np.asarray(levels[name], dtype=bool)
+
+    scenario_id = scenario_ids(levels)
+    risk = np.where(flag("is_post_coital_or_post_menopausal"),
+                    BASE_RISK_POST_COITAL[scenario_id], BASE_RISK[scenario_id])
+    young_modified = _young_modified(levels, scenario_id)
+    risk[young_modified] = YOUNG_BASE_RISK
+
+    for inputs, _, risks, _ in _COMPILED_RULES:
+        level = 0
+        for name, multiplier in inputs:
+            level = level + np.asarray(levels[name], dtype=np.int64) * multiplier
+        risk += risks[level]
+
+    risk = np.where(flag("hiv_positive"), risk + np.minimum(risk * HIV_RISK_SHARE, MAX_RISK - risk), risk)
+
+    risk = np.minimum(risk, MAX_RISK)
+    risk[young_modified & (risk > YOUNG_RISK_CAP)] = YOUNG_RISK_CAP
+    return risk
+
+
+def build_risk_table():
+    """Evaluate the rules over every combination of levels"""
+    grid = np.indices(TABLE_SHAPE, dtype=np.int8).reshape(len(TABLE_SHAPE), -1)
+    levels = {name: grid[i] for i, (name, _) in enumerate(TABLE_DIMENSIONS)}
+    # Scores are whole numbers until the HIV step adds a half, so tenths are exact
+    return np.round(_score_levels(levels) * 10).astype(np.uint16)
+
+
+def _save_risk_table(table, path):
+    # Write to a temporary file first so other workers never map a partial table
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, table)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_risk_table(path=RISK_TABLE_PATH):
+    """Memory-map the compiled risk table, compiling it first if needed"""
+    global _risk_table
+    if _risk_table is not None:
+        return _risk_table
+
+    table = None
+    if os.path.exists(path):
+        try:
+            table = np.load(path, mmap_mode="r")
+            if table.shape != (int(np.prod(TABLE_SHAPE)),) or table.dtype != np.uint16:
+                logger.warning(f"Risk table {path} does not match the current layout, rebuilding")
+                table = None
+        except Exception as e:
+            logger.warning(f"Could not load risk table {path}: {e}")
+            table = None
+
+    if table is None:
+        table = build_risk_table()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _save_risk_table(table, path)
+            table = np.load(path, mmap_mode="r")
+            logger.info(f"Compiled risk table to {path}")
+        except OSError as e:
+            logger.warning(f"Could not save risk table {path}, keeping it in memory: {e}")
+
+    # Plain ndarray view of the mapping; np.memmap indexing goes through Python
+    _risk_table = table.view(np.ndarray)
+    return _risk_table
+
+
+def risk_category(risk_score):
+    return "Low risk" if risk_score < 40 else "Medium risk" if risk_score < 65 else "High risk"
+
+
+def lookup_risk_score(levels):
+    """Risk score for one patient's levels, read from the compiled table"""
+    return load_risk_table().item(table_index(levels)) / 10.0
+
+
+def risk_modifiers(levels):
+    """
+    Scenario id and the (modifier code, delta) pairs that apply, in rule order.
+    No text is built here; render_scenario turns the codes into the explanation.
+    """
+    scenario = scenario_id(levels)
+    has_bleeding = levels["abnormal_vaginal_bleeding"]
+    is_post_coital = levels["is_post_coital_or_post_menopausal"]
+    risk = float(BASE_RISK_POST_COITAL[scenario] if is_post_coital else BASE_RISK[scenario])
+    young_modified = bool(levels["young"]) and not (scenario in YOUNG_EXEMPT_SCENARIOS or
+                                                     (has_bleeding and is_post_coital))
+
+    modifiers = []
+    if young_modified:
+        modifiers.append((MOD_YOUNG_AGE, YOUNG_BASE_RISK - risk))
+        risk = YOUNG_BASE_RISK
+
+    for inputs, risks, _, codes in _COMPILED_RULES:
+        level = 0
+        for name, multiplier in inputs:
+            level += levels[name] * multiplier
+        if codes[level] is not None:
+            risk += risks[level]
+            modifiers.append((codes[level], risks[level]))
+
+    if levels["hiv_positive"]:
+        hiv_modifier = min(risk * HIV_RISK_SHARE, MAX_RISK - risk)
+        risk += hiv_modifier
+        modifiers.append((MOD_HIV_POSITIVE, hiv_modifier))
+
+    if risk > MAX_RISK:
+        modifiers.append((MOD_MAX_CAP, MAX_RISK - risk))
+        risk = MAX_RISK
+    if young_modified and risk > YOUNG_RISK_CAP:
+        modifiers.append((MOD_YOUNG_CAP, YOUNG_RISK_CAP - risk))
+    return scenario, modifiers
+
+
+def score_answers(data):
+    """Risk score, scenario id and modifiers for one patient's raw answers"""
+    levels = patient_levels(preprocess_answers(data))
+    scenario, modifiers = risk_modifiers(levels)
+    return lookup_risk_score(levels), scenario, modifiers
+
+
+def render_scenario(scenario_id, modifiers):
+    """Scenario text with its modifiers, as shown to patients and in reports"""
+    scenario = SCENARIO_NAMES[scenario_id]
+    texts = []
+    for code, delta in modifiers:
+        if code == MOD_YOUNG_AGE:
+            scenario += " (modified for young age)"
+        elif code in MODIFIER_TEXT:
+            texts.append(MODIFIER_TEXT[code].format(delta=delta))
+    if texts:
+        scenario += " | Modifiers: " + ", ".join(texts)
+    return scenario
+
+
+def encode_modifiers(modifiers):
+    """Compact "code:delta" form of a modifier list for storage"""
+    return ",".join(f"{code}:{delta:g}" for code, delta in modifiers)
+
+
+def decode_modifiers(text):
+    """Inverse of encode_modifiers"""
+    if not text:
+        return []
+    modifiers = []
+    for item in text.split(","):
+        code, delta = item.split(":")
+        modifiers.append((int(code), float(delta)))
+    return modifiers
+
+
+def assessment_cache_key(data):
+    """
+    Canonical answers that determine a full assessment, with age collapsed to
+    the only thresholds the rules and recommendations use (<20, <45).
+    """
+    levels = patient_levels(data)
+    age = data.get("age", 35)
+    levels["young"] = 0 if age < YOUNG_AGE else 1 if age < 45 else 2
+    # Recommendations read the submitted post-coital flag on its own
+    return (int(bool(data.get("is_post_coital_or_post_menopausal", False))),) + \
+        tuple(levels[name] for name, _ in TABLE_DIMENSIONS)
+
+
+class RiskResultCache:
+    """
+    Bounded, thread-safe LRU cache of assessment results. Entries are never
+    stale: the risk table is loaded once per process from the file for
+    RULES_VERSION, so new rules always start with an empty cache.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "rules_version": RULES_VERSION,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _map_text(values, func, dtype):
+    """Apply func to str(value) once per distinct value and broadcast the result"""
+    keys = np.asarray(values, dtype=object).astype(str).astype(object)
+    codes, uniques = pd.factorize(keys)
+    mapped = np.array([func(key) for key in uniques], dtype=dtype)
+    return mapped[codes]
+
+
+def _dob_ages(dob):
+    dob = pd.to_datetime(pd.Series(dob), format="%Y-%m-%d")
+    today = datetime.now().date()
+    before_birthday = (dob.dt.month > today.month) | ((dob.dt.month == today.month) & (dob.dt.day > today.day))
+    return (today.year - dob.dt.year - before_birthday.astype(np.int64)).to_numpy(dtype=np.int64)
+
+
+def _ages(data, n):
+    """Age column, else age from dob, else 35; blank cells count as missing answers"""
+    ages = np.full(n, 35, dtype=np.int64)
+    missing = np.ones(n, dtype=bool)
+    for field, parse in (("age", lambda values: values.astype(np.int64)), ("dob", _dob_ages)):
+        if field not in data:
+            continue
+        values = np.asarray(data[field], dtype=object)
+        present = missing & pd.notna(values) & (values != "")
+        if present.all():
+            return parse(values)
+        ages[present] = parse(values[present])
+        missing &= ~present
+    return ages
+
+
+def _parities(data, n):
+    if "parity" not in data:
+        return np.zeros(n, dtype=np.int64)
+    values = np.asarray(data["parity"])
+    if values.dtype.kind in "biu":
+        return values.astype(np.int64)
+    if values.dtype.kind == "f":
+        # int(nan) raises ValueError in the per-row path, which falls back to 0
+        return np.where(np.isnan(values), 0, np.nan_to_num(values)).astype(np.int64)
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    mapped = np.array([parse_parity(value) for value in uniques] + [0], dtype=np.int64)
+    return mapped[codes]
+
+
+def _row_count(data):
+    for field in data:
+        return len(data[field])
+    return 0
+
+
+def column_codes(data):
+    """Vectorized encode_answers: canonical code arrays for the categorical columns"""
+    n = _row_count(data)
+
+    def encode(field, source=None):
+        source = source or field
+        if source not in data:
+            return np.full(n, encode_value(field, ""), dtype=np.int8)
+        return _map_text(data[source], lambda key: encode_value(field, key), np.int8)
+
+    encoded = {field: encode(field) for field in ("bleeding_type", "sexual_partners", "smoking", "marital_status",
+                                                  "oral_contraceptive_use", "age_first_intercourse")}
+    if "cigarettes_per_day" in data:
+        cigarettes = encode("cigarettes_per_day")
+        encoded["smoking"] = np.where((encoded["smoking"] == SMOKING_CURRENT) & (cigarettes != SMOKING_NONE),
+                                      cigarettes, encoded["smoking"])
+    if "oral_contraceptive_use" in data:
+        uses = _map_text(data["oral_contraceptive_use"], lambda key: _normalize(key) in AFFIRMATIVE_ANSWERS, bool)
+        encoded["oral_contraceptive_use"] = np.where(uses, encode("contraceptive_years"),
+                                                     encoded["oral_contraceptive_use"])
+    return encoded
+
+
+def column_answers(data):
+    """Vectorized preprocess_answers: arrays of flags, age, parity and codes"""
+    n = _row_count(data)
+    answers = {field: _map_text(data[field], _is_true, np.int8) if field in data else np.zeros(n, dtype=np.int8)
+               for field in BOOLEAN_FIELDS}
+    answers["age"] = _ages(data, n)
+    answers["parity"] = _parities(data, n)
+    answers.update(column_codes(data))
+    return answers
+
+
+def answer_levels(answers):
+    """Vectorized patient_levels for the arrays column_answers returns"""
+    levels = {field: answers[field] for field in ("abnormal_vaginal_bleeding", "abnormal_vaginal_discharge",
+                                                  "lower_abdominal_pain", "change_in_periods", "dyspareunia",
+                                                  "weight_loss", "unusual_fatigue", "abnormal_pap_smear",
+                                                  "hiv_positive", "sexual_partners", "smoking", "marital_status",
+                                                  "oral_contraceptive_use", "age_first_intercourse")}
+    levels["is_post_coital_or_post_menopausal"] = answers["is_post_coital_or_post_menopausal"] | \
+        np.isin(answers["bleeding_type"], POST_COITAL_BLEEDING)
+    levels["young"] = (answers["age"] < YOUNG_AGE).astype(np.int8)
+    levels["high_parity"] = answers["high_parity"] | (answers["parity"] >= 5)
+    return levels
+
+
+def column_levels(data):
+    """Reduce raw columns to arrays of the levels the rules read"""
+    return answer_levels(column_answers(data))
+
+
+def risk_categories(risk_score):
+    """Vectorized risk_category"""
+    return np.where(risk_score < 40, "Low risk", np.where(risk_score < 65, "Medium risk", "High risk")).astype(object)
+
+
+def modifier_columns(indices):
+    """
+    Scenario ids and encoded modifiers for an array of table indices.
+    Modifier lists depend only on the index, so the rules are walked once per
+    distinct index and the results broadcast.
+    """
+    unique, inverse = np.unique(np.asarray(indices, dtype=np.int64), return_inverse=True)
+    scenarios = np.empty(len(unique), dtype=np.int8)
+    modifiers = np.empty(len(unique), dtype=object)
+    for i, index in enumerate(unique.tolist()):
+        scenarios[i], index_modifiers = risk_modifiers(levels_from_index(index))
+        modifiers[i] = encode_modifiers(index_modifiers)
+    inverse = inverse.reshape(-1)
+    return scenarios[inverse], modifiers[inverse]
+
+
+def rescore_columns(data):
+    """
+    Score stored assessments given as columns of raw answers, as
+    calculate_risk_score_batch does, also returning the scenario id, encoded
+    modifiers, table index, recommendation template id and personalized codes
+    of each row. Used by the history backfill. Returns plain lists so results
+    pickle cheaply between processes.
+    """
+    # recommendations imports this module
+    from recommendations import general_template_ids, personalized_code_columns
+
+    answers = column_answers(data)
+    indices = table_indices(answer_levels(answers))
+    risk_score = load_risk_table()[indices] / 10.0
+    category = risk_categories(risk_score)
+    scenarios, modifiers = modifier_columns(indices)
+    return {
+        "risk_score": risk_score.tolist(),
+        "risk_category": category.tolist(),
+        "scenario_id": scenarios.tolist(),
+        "risk_modifiers": modifiers.tolist(),
+        "risk_levels": indices.tolist(),
+        "recommendation_template_id": general_template_ids(category).tolist(),
+        "personalized_codes": personalized_code_columns(answers).tolist(),
+    }
+
+
+def counterfactual_scores(indices, factors=tuple(WHAT_IF_FACTORS)):
+    """
+    Score every single-factor counterfactual for many patients in one pass.
+
+    `indices` are flat risk table indices (table_index/table_indices). Each
+    counterfactual only moves the index along one axis, so all of them form
+    one (patients x counterfactuals) index matrix read from the table at once.
+    Returns the actual scores and, per factor, an array of shape
+    (patients, levels) with the score at each level of that factor.
+    """
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    sizes = dict(TABLE_DIMENSIONS)
+    columns = [indices[:, None]]
+    for name in factors:
+        stride = TABLE_STRIDES[name]
+        current = (indices // stride) % sizes[name]
+        columns.append((indices - current * stride)[:, None] + np.arange(sizes[name]) * stride)
+    scores = load_risk_table()[np.hstack(columns)] / 10.0
+
+    what_if = {}
+    start = 1
+    for name in factors:
+        what_if[name] = scores[:, start:start + sizes[name]]
+        start += sizes[name]
+    return scores[:, 0], what_if
+
+
+def factor_contributions(indices, factors=tuple(WHAT_IF_FACTORS)):
+    """
+    How many points each factor adds to each patient's score: the actual
+    score minus the score with that factor alone set to level 0.
+    Returns the actual scores and a dict of per-factor delta arrays.
+    """
+    risk_score, what_if = counterfactual_scores(indices, factors)
+    return risk_score, {name: risk_score - scores[:, 0] for name, scores in what_if.items()}
+
+
+def calculate_risk_score_batch(data):
+    """
+    Score many patients at once.
+
+    `data` is a pandas DataFrame or a dict of equal-length arrays keyed by the
+    raw field names preprocess_patient_data understands. Returns a dict of
+    arrays: risk_score (float), risk_category (str) and scenario_id (1-8).
+    """
+    levels = column_levels(data)
+    risk_score = load_risk_table()[table_indices(levels)] / 10.0
+    return {
+        "risk_score": risk_score,
+        "risk_category": risk_categories(risk_score),
+        "scenario_id": scenario_ids(levels),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    table = load_risk_table()
+    print(f"Risk table v{RULES_VERSION}: {table.size} cells, {table.nbytes / 1e6:.1f} MB at {RISK_TABLE_PATH}")
@@ -0,0 +1,421 @@
+"""
+Differential consistency and throughput harness for risk scoring.
+
+Generates random and edge-case patients as abstract answers, writes them in
+the vocabulary of each client (the React symptom checker form, the Streamlit
+tool in model.py and the synthetic CSV generator) and scores them through
+every scoring path: the per-row engine the app uses, the vectorized batch
+path, the modifier walk, the uncompiled rules and, when it can be imported,
+app.calculate_risk_and_recommendations itself. Every path is compared with a
+straight-line reference implementation of the guidelines.
+
+Any new fast path must be added here and pass before it ships:
+
+    python risk_harness.py --rows 1000000
+
+Exits with status 1 if any path disagrees with the reference. Each
+disagreement is reported with a minimal reproducer: the raw answers left
+after resetting every answer that does not matter to the disagreement.
+"""
+
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import risk_engine
+from risk_engine import (BLEEDING_NONE, BLEEDING_POST_COITAL, BLEEDING_POST_MENOPAUSAL, SMOKING_NONE, SMOKING_CURRENT,
+                         calculate_risk_score_batch, column_levels, patient_levels, preprocess_answers,
+                         risk_modifiers, score_answers)
+
+# Abstract answers: field -> number of levels. Categorical levels are the
+# canonical codes in risk_engine; "age" is drawn separately.
+ANSWER_LEVELS = {
+    "abnormal_vaginal_bleeding": 2,
+    "abnormal_vaginal_discharge": 2,
+    "lower_abdominal_pain": 2,
+    "bleeding_type": 5,
+    "post_coital_flag": 2,
+    "change_in_periods": 2,
+    "dyspareunia": 2,
+    "weight_loss": 2,
+    "unusual_fatigue": 2,
+    "sexual_partners": 4,
+    "smoking": 5,
+    "marital_status": 3,
+    "oral_contraceptive_use": 3,
+    "age_first_intercourse": 4,
+    "abnormal_pap_smear": 2,
+    "high_parity": 2,
+    "hiv_positive": 2,
+}
+EDGE_AGES = [12, 15, 19, 20, 21, 44, 45, 46, 64, 65, 90]
+NEUTRAL_AGE = 35
+
+
+# Reference implementation, written straight from the guidelines
+
+REFERENCE_BASE_RISK = {1: (95, 95), 2: (50, 76), 3: (50, 76), 4: (40, 40),
+                       5: (45, 45), 6: (50, 70), 7: (30, 30), 8: (0, 0)}
+
+
+def reference_score(p):
+    bleeding, discharge, pain = p["abnormal_vaginal_bleeding"], p["abnormal_vaginal_discharge"], p["lower_abdominal_pain"]
+    if bleeding and discharge and pain:
+        scenario = 1
+    elif bleeding and discharge:
+        scenario = 2
+    elif bleeding and pain:
+        scenario = 6
+    elif bleeding:
+        scenario = 3
+    elif discharge and pain:
+        scenario = 5
+    elif discharge:
+        scenario = 4
+    elif pain:
+        scenario = 7
+    else:
+        scenario = 8
+
+    post_coital = p["post_coital_flag"] or p["bleeding_type"] in (BLEEDING_POST_COITAL, BLEEDING_POST_MENOPAUSAL)
+    risk = REFERENCE_BASE_RISK[scenario][1 if post_coital else 0]
+
+    young_modified = p["age"] < 20 and not (scenario == 1 or (bleeding and post_coital))
+    if young_modified:
+        risk = 10
+
+    if p["change_in_periods"]:
+        risk += 2
+    if p["dyspareunia"]:
+        risk += 5
+    if p["weight_loss"] and p["unusual_fatigue"]:
+        risk += 20
+    else:
+        if p["weight_loss"]:
+            risk += 5
+        if p["unusual_fatigue"]:
+            risk += 5
+
+    risk += [0, 2, 5, 10][p["sexual_partners"]]
+    risk += [0, 5, 10, 15, 0][p["smoking"]]
+    risk += [0, 2, 2][p["marital_status"]]
+    risk += [0, 5, 10][p["oral_contraceptive_use"]]
+    risk += [0, 10, 5, 2][p["age_first_intercourse"]]
+    if p["abnormal_pap_smear"]:
+        risk += 50
+    if p["high_parity"]:
+        risk += 5
+    if p["hiv_positive"]:
+        risk += min(risk * 0.5, 99 - risk)
+
+    risk = min(risk, 99)
+    if young_modified:
+        risk = min(risk, 30)
+    return float(risk)
+
+
+# Input generation
+
+def generate_answers(n, rng):
+    """Random abstract answers, with edge-case ages and a share of maxed-out patients"""
+    answers = {field: rng.integers(0, size, n) for field, size in ANSWER_LEVELS.items()}
+    age = rng.integers(12, 91, n)
+    edge = rng.random(n) < 0.3
+    age[edge] = rng.choice(EDGE_AGES, edge.sum())
+    answers["age"] = age
+
+    # Every modifier at its riskiest, where the caps interact
+    maxed = rng.random(n) < 0.05
+    for field, level in (("change_in_periods", 1), ("dyspareunia", 1), ("weight_loss", 1),
+                         ("unusual_fatigue", 1), ("sexual_partners", 3), ("smoking", 3),
+                         ("oral_contraceptive_use", 2), ("age_first_intercourse", 1),
+                         ("abnormal_pap_smear", 1), ("high_parity", 1)):
+        answers[field][maxed] = level
+    return answers
+
+
+def _pick(options, codes):
+    return np.array(options, dtype=object)[codes]
+
+
+def _yes_no(flags, yes="yes", no="no"):
+    return np.where(flags.astype(bool), yes, no).astype(object)
+
+
+def _dob_for_age(ages, rng):
+    """Dates of birth that give exactly these ages today"""
+    today = date.today()
+    dobs = []
+    for age, days in zip(ages.tolist(), rng.integers(0, 365, len(ages)).tolist()):
+        try:
+            birthday = today.replace(year=today.year - age)
+        except ValueError:  # 29 February
+            birthday = today.replace(year=today.year - age, day=28)
+        dobs.append((birthday - timedelta(days=days)).isoformat())
+    return np.array(dobs, dtype=object)
+
+
+def form_vocabulary(answers, rng):
+    """Answers as the React symptom checker submits them"""
+    n = len(answers["age"])
+    smoking = answers["smoking"]
+    current = (smoking != SMOKING_NONE)
+    contraceptive = answers["oral_contraceptive_use"]
+    uses_contraceptives = (contraceptive > 0) | (rng.random(n) < 0.5)
+    raw = {
+        "dob": _dob_for_age(answers["age"], rng),
+        "bleeding_type": _pick(["", "intermenstrual", "postcoital", "postmenopausal", "heavier"], answers["bleeding_type"]),
+        "is_post_coital_or_post_menopausal": _yes_no(answers["post_coital_flag"]),
+        "sexual_partners": _pick(["0", "1–3", "4–7", ">8"], answers["sexual_partners"]),
+        "smoking": np.where(current, "Current", _pick(["Never", "Previous"], rng.integers(0, 2, n))).astype(object),
+        "cigarettes_per_day": _pick(["", "1–9", "10–19", ">20", ""], smoking),
+        "marital_status": _pick(["Married", "Single", "Divorced"], answers["marital_status"]),
+        "oral_contraceptive_use": _yes_no(uses_contraceptives),
+        "contraceptive_years": np.where(uses_contraceptives,
+                                        _pick(["<5 years", "5–9 years", ">10 years"], contraceptive), "").astype(object),
+        "age_first_intercourse": _pick(["Not applicable", "<16 years", "16–20 years", ">21 years"],
+                                       answers["age_first_intercourse"]),
+        "parity": np.where(answers["high_parity"].astype(bool), ">=5 children", "<5 children").astype(object),
+        "high_parity": _yes_no(answers["high_parity"]),
+    }
+    for field in ("abnormal_vaginal_bleeding", "abnormal_vaginal_discharge", "lower_abdominal_pain",
+                  "change_in_periods", "dyspareunia", "weight_loss", "unusual_fatigue",
+                  "abnormal_pap_smear", "hiv_positive"):
+        raw[field] = _yes_no(answers[field])
+    return raw, answers
+
+
+def streamlit_vocabulary(answers, rng):
+    """Answers as model.py passes them to score_answers"""
+    n = len(answers["age"])
+    effective = dict(answers)
+    # The Streamlit form has no separate post-coital question
+    effective["post_coital_flag"] = np.zeros(n, dtype=np.int64)
+    smoking = answers["smoking"]
+    contraceptive = answers["oral_contraceptive_use"]
+    uses_contraceptives = (contraceptive > 0) | (rng.random(n) < 0.5)
+    raw = {
+        "age": answers["age"],
+        "bleeding_type": _pick(["", "intermenstrual", "post-coital", "postmenopausal", "heavier periods"],
+                               answers["bleeding_type"]),
+        "sexual_partners": _pick(["0", "1-3", "4-7", ">8"], answers["sexual_partners"]),
+        "smoking": np.where(smoking != SMOKING_NONE, "Current",
+                            _pick(["", "Never", "Previous"], rng.integers(0, 3, n))).astype(object),
+        "cigarettes_per_day": _pick(["", "1-9", "10-19", ">20", ""], smoking),
+        "marital_status": _pick(["Married", "Single", "Divorced"], answers["marital_status"]),
+        "oral_contraceptive_use": _yes_no(uses_contraceptives),
+        "contraceptive_years": np.where(uses_contraceptives,
+                                        _pick(["<5 years", "5-9 years", ">10 years"], contraceptive), "").astype(object),
+        "age_first_intercourse": _pick(["Not applicable", "<16 years", "17-20 years", ">21 years"],
+                                       answers["age_first_intercourse"]),
+    }
+    for field in ("abnormal_vaginal_bleeding", "abnormal_vaginal_discharge", "lower_abdominal_pain",
+                  "change_in_periods", "dyspareunia", "weight_loss", "unusual_fatigue",
+                  "abnormal_pap_smear", "high_parity", "hiv_positive"):
+        raw[field] = answers[field].astype(bool)
+    return raw, effective
+
+
+def synthetic_vocabulary(answers, rng):
+    """Answers as synthetic_data.py writes them to the training CSV"""
+    n = len(answers["age"])
+    effective = dict(answers)
+    bleeding = answers["abnormal_vaginal_bleeding"].astype(bool)
+    # The generator only sets a bleeding type when there is bleeding, derives
+    # the post-coital flag from it and has no "current, amount unknown" smoker
+    effective["bleeding_type"] = np.where(bleeding, answers["bleeding_type"], BLEEDING_NONE)
+    post_coital = np.isin(effective["bleeding_type"], (BLEEDING_POST_COITAL, BLEEDING_POST_MENOPAUSAL))
+    effective["post_coital_flag"] = post_coital.astype(np.int64)
+    effective["smoking"] = np.where(answers["smoking"] == SMOKING_CURRENT, SMOKING_NONE, answers["smoking"])
+    high_parity = answers["high_parity"].astype(bool)
+    raw = {
+        "age": answers["age"],
+        "bleeding_type": np.where(bleeding, _pick([None, "intermenstrual", "post-coital", "post-menopausal",
+                                                   "longer periods"], answers["bleeding_type"]), None),
+        "is_post_coital_or_post_menopausal": post_coital,
+        "sexual_partners": _pick(["0", "1-3", "4-7", ">8"], answers["sexual_partners"]),
+        "smoking": _pick(["non-smoker", "1-9/day", "10-19/day", ">20/day"], effective["smoking"]),
+        "marital_status": _pick(["married", "single", "divorced"], answers["marital_status"]),
+        # "<5 years" of use adds nothing, same as "none"
+        "oral_contraceptive_use": np.where(answers["oral_contraceptive_use"] == 0,
+                                           _pick(["none", "<5 years"], rng.integers(0, 2, n)),
+                                           _pick(["", "5-9 years", ">10 years"], answers["oral_contraceptive_use"])),
+        "age_first_intercourse": _pick([np.nan, "<16 years", "17-20 years", ">21 years"],
+                                       answers["age_first_intercourse"]),
+        "parity": np.where(high_parity, rng.integers(5, 8, n), rng.integers(0, 5, n)),
+        "high_parity": np.where(high_parity, rng.random(n) < 0.5, False),
+    }
+    for field in ("abnormal_vaginal_bleeding", "abnormal_vaginal_discharge", "lower_abdominal_pain",
+                  "change_in_periods", "dyspareunia", "weight_loss", "unusual_fatigue",
+                  "abnormal_pap_smear", "hiv_positive"):
+        raw[field] = answers[field].astype(bool)
+    return raw, effective
+
+
+VOCABULARIES = {
+    "form": form_vocabulary,
+    "streamlit": streamlit_vocabulary,
+    "synthetic": synthetic_vocabulary,
+}
+
+
+# Scoring paths. Each takes raw answer columns and returns an array of scores.
+
+def _records(raw):
+    return pd.DataFrame(raw).to_dict("records")
+
+
+def score_reference(effective):
+    n = len(effective["age"])
+    columns = {field: values.tolist() for field, values in effective.items()}
+    return np.array([reference_score({field: columns[field][i] for field in columns}) for i in range(n)])
+
+
+def score_per_row(records):
+    return np.array([score_answers(record)[0] for record in records])
+
+
+def score_walk(records):
+    scores = []
+    for record in records:
+        levels = patient_levels(preprocess_answers(record))
+        scenario, modifiers = risk_modifiers(levels)
+        post_coital = levels["is_post_coital_or_post_menopausal"]
+        base = (risk_engine.BASE_RISK_POST_COITAL if post_coital else risk_engine.BASE_RISK)[scenario]
+        scores.append(float(base) + sum(delta for _, delta in modifiers))
+    return np.array(scores)
+
+
+def score_batch(raw):
+    return calculate_risk_score_batch(pd.DataFrame(raw))["risk_score"]
+
+
+def score_rules(raw):
+    return np.round(risk_engine._score_levels(column_levels(pd.DataFrame(raw))) * 10) / 10
+
+
+def _app_scorer():
+    try:
+        import app
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    return (lambda records: np.array([app.calculate_risk_and_recommendations(record)["risk_score"]
+                                      for record in records])), None
+
+
+# Path name -> (takes records instead of columns, scorer)
+PATHS = {
+    "engine.score_answers": (True, score_per_row),
+    "engine.risk_modifiers": (True, score_walk),
+    "engine.calculate_risk_score_batch": (False, score_batch),
+    "engine rules (uncompiled)": (False, score_rules),
+}
+PER_ROW_PATHS = {"engine.score_answers", "engine.risk_modifiers", "app.calculate_risk_and_recommendations"}
+
+
+def _run(path, raw):
+    takes_records, scorer = PATHS[path]
+    return scorer(_records(raw) if takes_records else raw)
+
+
+def _row(answers, i):
+    return {field: values[i:i + 1].copy() for field, values in answers.items()}
+
+
+def minimal_reproducer(path, vocabulary, answers, seed):
+    """Reset answers to neutral one at a time while the disagreement persists"""
+    def disagrees(candidate):
+        raw, effective = VOCABULARIES[vocabulary](candidate, np.random.default_rng(seed))
+        return _run(path, raw)[0] != score_reference(effective)[0], raw, effective
+
+    for field in list(ANSWER_LEVELS) + ["age"]:
+        neutral = NEUTRAL_AGE if field == "age" else 0
+        if answers[field][0] == neutral:
+            continue
+        candidate = dict(answers, **{field: np.array([neutral])})
+        if disagrees(candidate)[0]:
+            answers = candidate
+    _, raw, effective = disagrees(answers)
+    return {field: values[0].item() if hasattr(values[0], "item") else values[0]
+            for field, values in raw.items()}, \
+        score_reference(effective)[0], _run(path, raw)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="patients per vocabulary for vectorized paths")
+    parser.add_argument("--per-row-rows", type=int, default=100_000, help="patients per vocabulary for per-row paths")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-reports", type=int, default=5, help="reproducers printed per path and vocabulary")
+    args = parser.parse_args()
+
+    app_scorer, app_error = _app_scorer()
+    if app_scorer is not None:
+        PATHS["app.calculate_risk_and_recommendations"] = (True, app_scorer)
+    else:
+        print(f"Skipping app.calculate_risk_and_recommendations (import failed: {app_error})")
+
+    rng = np.random.default_rng(args.seed)
+    answers = generate_answers(args.rows, rng)
+    risk_engine.load_risk_table()
+
+    print(f"{'path':<40} {'vocabulary':<10} {'rows':>9} {'rows/sec':>12} {'disagreements':>14}")
+    failures = 0
+    reports = []
+    for offset, (vocabulary, to_vocabulary) in enumerate(VOCABULARIES.items(), 1):
+        vocab_seed = args.seed + offset
+        raw, effective = to_vocabulary(answers, np.random.default_rng(vocab_seed))
+
+        per_row_n = min(args.per_row_rows, args.rows)
+        start = time.perf_counter()
+        expected = score_reference({field: values[:per_row_n] for field, values in effective.items()})
+        elapsed = time.perf_counter() - start
+        print(f"{'reference':<40} {vocabulary:<10} {per_row_n:>9} {per_row_n / elapsed:>12,.0f} {'-':>14}")
+        full_expected = None
+
+        for path, (takes_records, scorer) in PATHS.items():
+            n = per_row_n if path in PER_ROW_PATHS else args.rows
+            subset = {field: values[:n] for field, values in raw.items()}
+            inputs = _records(subset) if takes_records else subset
+            start = time.perf_counter()
+            scores = scorer(inputs)
+            elapsed = time.perf_counter() - start
+
+            if n == per_row_n:
+                reference = expected
+            else:
+                if full_expected is None:
+                    full_expected = score_reference(effective)
+                reference = full_expected
+            mismatched = np.flatnonzero(scores != reference)
+            failures += len(mismatched)
+            print(f"{path:<40} {vocabulary:<10} {n:>9} {n / elapsed:>12,.0f} {len(mismatched):>14}")
+
+            seen = set()
+            for i in mismatched:
+                if len(seen) >= args.max_reports:
+                    break
+                reproducer = minimal_reproducer(path, vocabulary, _row(answers, i), vocab_seed)
+                key = repr(sorted(reproducer[0].items()))
+                if key not in seen:
+                    seen.add(key)
+                    reports.append((path, vocabulary) + reproducer)
+
+    for path, vocabulary, raw, expected, got in reports:
+        print(f"\n{path} ({vocabulary}): expected {expected}, got {got}")
+        print(f"  {raw}")
+
+    if failures:
+        print(f"\n{failures} disagreements")
+        return 1
+    print("\nAll paths agree with the reference")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import random
 from datetime import datetime
+from risk_engine import calculate_risk_score_batch
 
 # Set random seed for reproducibility
 np.random.seed(42)
@@ -125,178 +126,45 @@ def generate_synthetic_data():
         # HIV status
         patient['hiv_positive'] = np.random.choice([True, False], p=[0.02, 0.98])
         
-        # Calculate risk based on algorithm
-        risk_percent = calculate_risk(patient)
-        patient['risk_percent'] = risk_percent
-        
-        # Determine risk category
-        if risk_percent < 40:
-            risk_category = 'Low risk'
-        elif risk_percent < 65:
-            risk_category = 'Medium risk'
-        else:
-            risk_category = 'High risk'
-        patient['risk_category'] = risk_category
-        
         data.append(patient)
     
-    return pd.DataFrame(data)
-
-def calculate_risk(patient):
-    """
-    Calculate the risk percentage based on the algorithm.
-    """
-    # Baseline risk based on scenario
-    if patient['abnormal_vaginal_bleeding'] and patient['abnormal_vaginal_discharge'] and patient['lower_abdominal_pain']:
-        # Scenario 1
-        risk = 95.0
-    elif patient['abnormal_vaginal_bleeding'] and patient['abnormal_vaginal_discharge'] and not patient['lower_abdominal_pain']:
-        # Scenario 2
-        if patient['is_post_coital_or_post_menopausal']:
-            risk = 76.0
-        else:
-            risk = 50.0
-    elif patient['abnormal_vaginal_bleeding'] and not patient['abnormal_vaginal_discharge'] and not patient['lower_abdominal_pain']:
-        # Scenario 3
-        if patient['is_post_coital_or_post_menopausal']:
-            risk = 76.0
-        else:
-            risk = 50.0
-    elif not patient['abnormal_vaginal_bleeding'] and patient['abnormal_vaginal_discharge'] and not patient['lower_abdominal_pain']:
-        # Scenario 4
-        risk = 40.0
-    elif not patient['abnormal_vaginal_bleeding'] and patient['abnormal_vaginal_discharge'] and patient['lower_abdominal_pain']:
-        # Scenario 5
-        risk = 45.0
-    elif patient['abnormal_vaginal_bleeding'] and not patient['abnormal_vaginal_discharge'] and patient['lower_abdominal_pain']:
-        # Scenario 6
-        if patient['is_post_coital_or_post_menopausal']:
-            risk = 70.0
-        else:
-            risk = 50.0
-    elif not patient['abnormal_vaginal_bleeding'] and not patient['abnormal_vaginal_discharge'] and patient['lower_abdominal_pain']:
-        # Scenario 7
-        risk = 30.0
-    else:
-        # Scenario 8
-        risk = 0.0
-    
-    # Age effect modification
-    if patient['age'] < 20:
-        if risk == 95.0:  # Scenario 1
-            pass  # Let scenario 1 calculations play out as intended
-        elif patient['abnormal_vaginal_bleeding'] and patient['is_post_coital_or_post_menopausal']:
-            pass  # Let scenario 2 calculations play out
-        else:
-            risk = 10.0  # Baseline risk is low for young patients
-    
-    # Additional symptoms modifiers (checklist - add 2%)
-    if patient['change_in_periods']:
-        risk += 2.0
-    
-    # Additional symptoms checklist (add 5%)
-    if patient['dyspareunia']:
-        risk += 5.0
-    
-    # Weight loss and fatigue
-    if patient['weight_loss'] and patient['unusual_fatigue']:
-        risk += 20.0  # Add 20% if both are present
-    else:
-        if patient['weight_loss']:
-            risk += 5.0
-        if patient['unusual_fatigue']:
-            risk += 5.0
-    
-    # Risk factor modifiers
-    # Sexual partners
-    if patient['sexual_partners'] == '1-3':
-        risk += 2.0
-    elif patient['sexual_partners'] == '4-7':
-        risk += 5.0
-    elif patient['sexual_partners'] == '>8':
-        risk += 10.0
-    
-    # Smoking
-    if patient['smoking'] == '1-9/day':
-        risk += 5.0
-    elif patient['smoking'] == '10-19/day':
-        risk += 10.0
-    elif patient['smoking'] == '>20/day':
-        risk += 15.0
-    
-    # Marital status
-    if patient['marital_status'] in ['single', 'divorced']:
-        risk += 2.0
-    
-    # Oral contraceptive use
-    if patient['oral_contraceptive_use'] == '5-9 years':
-        risk += 5.0
-    elif patient['oral_contraceptive_use'] == '>10 years':
-        risk += 10.0
-    
-    # Age at first intercourse
-    if 'age_first_intercourse' in patient:
-        if patient['age_first_intercourse'] == '<16 years':
-            risk += 10.0
-        elif patient['age_first_intercourse'] == '17-20 years':
-            risk += 5.0
-        elif patient['age_first_intercourse'] == '>21 years':
-            risk += 2.0
-    
-    # Previous abnormal pap smear
-    if patient['abnormal_pap_smear']:
-        risk += 50.0
-    
-    # Parity
-    if patient['high_parity']:
-        risk += 5.0
-    
-    # HIV status
-    if patient['hiv_positive']:
-        risk += min(risk * 0.5, 99.0 - risk)  # Add 50% of current risk, but max out at 99%
-    
-    # Cap at 99%
-    risk = min(risk, 99.0)
-    
-    # Cap at 30% for young patients (except for scenario 1 or post-coital bleeding)
-    if patient['age'] < 20:
-        scenario_1 = patient['abnormal_vaginal_bleeding'] and patient['abnormal_vaginal_discharge'] and patient['lower_abdominal_pain']
-        post_coital_bleeding = patient['abnormal_vaginal_bleeding'] and patient['is_post_coital_or_post_menopausal']
-        
-        if not (scenario_1 or post_coital_bleeding):
-            risk = min(risk, 30.0)
-    
-    return risk
+    # Score every patient at once with the app's rules
+    df = pd.DataFrame(data)
+    scores = calculate_risk_score_batch(df)
+    df['risk_percent'] = scores['risk_score']
+    df['risk_category'] = scores['risk_category']
+    return df
 
-# Generate the synthetic data
-synthetic_data = generate_synthetic_data()
+if __name__ == "__main__":
+    # Generate the synthetic data
+    synthetic_data = generate_synthetic_data()
 
-# Export to CSV
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-filename = f"cervical_cancer_synthetic_data_{timestamp}.csv"
-synthetic_data.to_csv(filename, index=False)
+    # Export to CSV
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"cervical_cancer_synthetic_data_{timestamp}.csv"
+    synthetic_data.to_csv(filename, index=False)
 
-print(f"Generated {len(synthetic_data)} synthetic patient records and saved to {filename}")
+    print(f"Generated {len(synthetic_data)} synthetic patient records and saved to {filename}")
 
-# Display summary statistics for verification
-print("\nData Summary:")
-print(f"Number of patients: {len(synthetic_data)}")
-print(f"Age distribution: \n{synthetic_data['age'].describe()}")
-print(f"\nRisk category distribution: \n{synthetic_data['risk_category'].value_counts(normalize=True).round(2)}")
-print(f"\nSymptom prevalence:")
-print(f"Abnormal vaginal bleeding: {synthetic_data['abnormal_vaginal_bleeding'].mean().round(2)}")
-print(f"Abnormal vaginal discharge: {synthetic_data['abnormal_vaginal_discharge'].mean().round(2)}")
-print(f"Lower abdominal pain: {synthetic_data['lower_abdominal_pain'].mean().round(2)}")
+    # Display summary statistics for verification
+    print("\nData Summary:")
+    print(f"Number of patients: {len(synthetic_data)}")
+    print(f"Age distribution: \n{synthetic_data['age'].describe()}")
+    print(f"\nRisk category distribution: \n{synthetic_data['risk_category'].value_counts(normalize=True).round(2)}")
+    print(f"\nSymptom prevalence:")
+    print(f"Abnormal vaginal bleeding: {synthetic_data['abnormal_vaginal_bleeding'].mean().round(2)}")
+    print(f"Abnormal vaginal discharge: {synthetic_data['abnormal_vaginal_discharge'].mean().round(2)}")
+    print(f"Lower abdominal pain: {synthetic_data['lower_abdominal_pain'].mean().round(2)}")
 
-# Sample rows from each risk category
-print("\nSample high risk patient:")
-high_risk = synthetic_data[synthetic_data['risk_category'] == 'High risk'].iloc[0].to_dict()
-print(high_risk)
+    # Sample rows from each risk category
+    print("\nSample high risk patient:")
+    high_risk = synthetic_data[synthetic_data['risk_category'] == 'High risk'].iloc[0].to_dict()
+    print(high_risk)
 
-print("\nSample medium risk patient:")
-medium_risk = synthetic_data[synthetic_data['risk_category'] == 'Medium risk'].iloc[0].to_dict()
-print(medium_risk)
+    print("\nSample medium risk patient:")
+    medium_risk = synthetic_data[synthetic_data['risk_category'] == 'Medium risk'].iloc[0].to_dict()
+    print(medium_risk)
 
-print("\nSample low risk patient:")
-low_risk = synthetic_data[synthetic_data['risk_category'] == 'Low risk'].iloc[0].to_dict()
-print(low_risk)
\ No newline at end of file
+    print("\nSample low risk patient:")
+    low_risk = synthetic_data[synthetic_data['risk_category'] == 'Low risk'].iloc[0].to_dict()
+    print(low_risk)
\ No newline at end of file
@@ -0,0 +1,54 @@
+from conftest import ASSESSMENT, HEADERS
+
+
+def submit(client, **changes):
+    response = client.post("/api/symptom-checker", json=dict(ASSESSMENT, **changes), headers=HEADERS)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["data"]["id"]
+
+
+def make_stale(app_db, history_id, **columns):
+    """Mark an assessment as scored under older rules, optionally with other results"""
+    from app import SymptomHistory
+    row = app_db.session.get(SymptomHistory, history_id)
+    row.rules_version = 1
+    for column, value in columns.items():
+        setattr(row, column, value)
+    app_db.session.commit()
+
+
+def test_backfill_rederives_recommendations(client, app_db):
+    from app import SymptomHistory, backfill_risk_scores
+    from risk_engine import RULES_VERSION
+    # High risk under the current rules; stored as a low risk result without
+    # personalized items, as older rules could have scored it
+    history_id = submit(client, abnormal_pap_smear="yes", smoking="Current", cigarettes_per_day="10–19")
+    expected = app_db.session.get(SymptomHistory, history_id).to_dict()
+    assert expected["risk_category"] == "High risk"
+    make_stale(app_db, history_id, risk_score=12.0, risk_category="Low risk", recommendation_template_id=1,
+               personalized_codes="")
+
+    assert backfill_risk_scores(workers=1) == 1
+    app_db.session.expire_all()
+    row = app_db.session.get(SymptomHistory, history_id)
+    assert row.rules_version == RULES_VERSION
+    for field in ("risk_score", "risk_category", "scenario", "predefined_recommendations",
+                  "personalized_recommendations"):
+        assert row.to_dict()[field] == expected[field]
+
+
+def test_backfill_resumes_after_checkpoint(client, app_db):
+    from app import RescoreCheckpoint, SymptomHistory, backfill_risk_scores
+    from risk_engine import RULES_VERSION
+    ids = [submit(client) for _ in range(3)]
+    for history_id in ids:
+        make_stale(app_db, history_id)
+    # An earlier run committed the first two before it was interrupted
+    app_db.session.add(RescoreCheckpoint(rules_version=RULES_VERSION, last_id=ids[1]))
+    app_db.session.commit()
+
+    assert backfill_risk_scores(chunk_size=1, workers=1) == 1
+    app_db.session.expire_all()
+    assert [app_db.session.get(SymptomHistory, history_id).rules_version for history_id in ids] == \
+        [1, 1, RULES_VERSION]
+    assert app_db.session.get(RescoreCheckpoint, RULES_VERSION).last_id == ids[2]
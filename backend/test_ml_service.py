@@ -0,0 +1,187 @@
+import threading
+import time
+from concurrent.futures import CancelledError, TimeoutError
+
+import pytest
+
+from ml_service import PredictionBatcher, ShadowScorer
+
+WAIT = 5.0
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + WAIT
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class StubPredictor:
+    """predict_batch stand-in recording batch sizes; blocks while `gate` is clear"""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event()
+
+    def __call__(self, rows):
+        self.batches.append(len(rows))
+        self.entered.set()
+        self.gate.wait(WAIT)
+        if self.fail:
+            raise RuntimeError("model failed")
+        return [{"risk_score": row["x"] * 10.0} for row in rows]
+
+
+def test_concurrent_requests_share_a_batch():
+    predictor = StubPredictor()
+    batcher = PredictionBatcher(predictor, max_batch_size=8, max_wait_ms=2000)
+    barrier = threading.Barrier(8)
+    results = {}
+
+    def request(x):
+        barrier.wait()
+        results[x] = batcher.predict({"x": x}, timeout=WAIT)
+
+    threads = [threading.Thread(target=request, args=(x,)) for x in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(WAIT)
+    # A full batch goes out at once instead of after max_wait_ms
+    assert predictor.batches == [8]
+    assert results == {x: {"risk_score": x * 10.0} for x in range(8)}
+    assert batcher.stats()["largest_batch"] == 8
+
+
+def test_partial_batch_sent_after_max_wait():
+    predictor = StubPredictor()
+    batcher = PredictionBatcher(predictor, max_batch_size=32, max_wait_ms=20)
+    futures = [batcher.submit({"x": x}) for x in range(3)]
+    assert [future.result(WAIT) for future in futures] == [{"risk_score": x * 10.0} for x in range(3)]
+    assert predictor.batches == [3]
+
+
+def test_errors_reach_every_caller():
+    predictor = StubPredictor(fail=True)
+    batcher = PredictionBatcher(predictor, max_batch_size=3, max_wait_ms=2000)
+    futures = [batcher.submit({"x": x}) for x in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failed"):
+            future.result(WAIT)
+    assert batcher.stats()["errors"] == 1
+
+
+def test_timed_out_request_is_cancelled_and_skipped():
+    predictor = StubPredictor()
+    predictor.gate.clear()
+    batcher = PredictionBatcher(predictor, max_batch_size=1, max_wait_ms=0)
+    first = batcher.submit({"x": 1})
+    assert predictor.entered.wait(WAIT)
+
+    # The worker is busy, so this one waits in the queue past its timeout
+    late = batcher.submit({"x": 2})
+    with pytest.raises(TimeoutError):
+        late.result(0.05)
+    assert late.cancel()
+    predictor.gate.set()
+
+    assert first.result(WAIT) == {"risk_score": 10.0}
+    after = batcher.submit({"x": 3})
+    assert after.result(WAIT) == {"risk_score": 30.0}
+    with pytest.raises(CancelledError):
+        late.result()
+    # The cancelled request never reached the model
+    assert predictor.batches == [1, 1]
+
+
+class ShadowPredictor(StubPredictor):
+    """StubPredictor that also returns the category of its score"""
+
+    def __call__(self, rows):
+        return [dict(result, risk_category="High risk" if result["risk_score"] >= 65
+                     else "Medium risk" if result["risk_score"] >= 40 else "Low risk")
+                for result in super().__call__(rows)]
+
+
+class StubStore:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, disagreements, windows):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        self.calls.append((disagreements, windows))
+
+
+def test_shadow_queue_drops_when_full():
+    predictor = ShadowPredictor()
+    predictor.gate.clear()
+    scorer = ShadowScorer(predictor, StubStore(), max_queue=2, flush_seconds=60)
+    assert scorer.submit(1, {"x": 1}, "Low risk", 10.0)
+    # The scorer thread holds the first case while the model is busy
+    assert predictor.entered.wait(WAIT)
+    accepted = [scorer.submit(i, {"x": i}, "Low risk", 10.0) for i in range(2, 6)]
+    assert accepted == [True, True, False, False]
+    stats = scorer.stats()
+    assert (stats["submitted"], stats["dropped"], stats["queued"]) == (3, 2, 2)
+    predictor.gate.set()
+    wait_for(lambda: scorer.stats()["compared"] == 3)
+
+
+def test_shadow_flush_stores_batched_results():
+    predictor = ShadowPredictor()
+    predictor.gate.clear()
+    store = StubStore()
+    scorer = ShadowScorer(predictor, store, model_version=lambda: "v1", flush_seconds=60, flush_size=3,
+                          score_tolerance=10.0)
+    scorer.submit(1, {"x": 1}, "Low risk", 10.0)
+    assert predictor.entered.wait(WAIT)
+    # Queued while the first batch is scored, then predicted together;
+    # x=5 and x=9 predict medium and high risk for low risk cases
+    for history_id, x in ((2, 1), (3, 5), (4, 9)):
+        scorer.submit(history_id, {"x": x}, "Low risk", 10.0)
+    # Cases already predicted inline are compared without the model
+    scorer.submit(5, None, "Low risk", 10.0, prediction={"risk_category": "High risk", "risk_score": 80.0})
+    predictor.gate.set()
+    wait_for(lambda: store.calls)
+
+    assert predictor.batches == [1, 3]
+    disagreements, windows = store.calls[0]
+    assert sorted(item["history_id"] for item in disagreements) == [3, 4, 5]
+    assert all(item["model_version"] == "v1" for item in disagreements)
+    window, = windows
+    assert (window["model_version"], window["compared"], window["category_agreements"],
+            window["score_within_tolerance"]) == ("v1", 5, 2, 2)
+    assert window["confusion"] == {"Low risk": {"Low risk": 2, "Medium risk": 1, "High risk": 2}}
+    assert scorer.stats()["stored"] == 3
+
+
+def test_shadow_failures_are_counted_not_raised():
+    scorer = ShadowScorer(ShadowPredictor(fail=True), StubStore(fail=True), flush_seconds=60)
+    scorer.submit(1, {"x": 1}, "Low risk", 10.0)
+    wait_for(lambda: scorer.stats()["errors"] == 1)
+    scorer.submit(2, None, "Low risk", 10.0, prediction={"risk_category": "High risk", "risk_score": 80.0})
+    wait_for(lambda: scorer.stats()["compared"] == 1)
+    scorer.flush()
+    assert scorer.stats()["store_errors"] == 1
+
+
+def test_shadow_failure_never_reaches_the_response(client, monkeypatch):
+    from app import shadow_scorer
+    from conftest import ASSESSMENT, HEADERS
+
+    def failing_predict(rows):
+        raise RuntimeError("model failed")
+
+    errors = shadow_scorer.stats()["errors"]
+    monkeypatch.setattr(shadow_scorer, "ready", lambda: True)
+    monkeypatch.setattr(shadow_scorer, "predict_batch", failing_predict)
+    response = client.post("/api/symptom-checker", json=ASSESSMENT, headers=HEADERS)
+    assert response.status_code == 200
+    assert response.get_json()["success"]
+    assert "ml_prediction" not in response.get_json()["data"]
+    wait_for(lambda: shadow_scorer.stats()["errors"] > errors)
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from model_artifacts import export_forest, load_forest
+from risk_engine import calculate_risk_score_batch
+from risk_harness import VOCABULARIES, generate_answers
+import train_model
+
+
+def training_rows(n, seed):
+    """Rows in the training data layout, as load_data returns them"""
+    rng = np.random.default_rng(seed)
+    raw, _ = VOCABULARIES["synthetic"](generate_answers(n, rng), rng)
+    rows = pd.DataFrame(raw)[train_model.numerical_features + train_model.categorical_features]
+    rows["bleeding_type"] = rows["bleeding_type"].fillna("none")
+    return rows
+
+
+def test_export_predicts_like_pipeline(tmp_path):
+    X = training_rows(400, seed=5)
+    scores = calculate_risk_score_batch(X)
+    clf_pipeline, reg_pipeline = train_model.build_pipelines({"n_estimators": 5})
+    clf_pipeline.fit(X, scores["risk_category"])
+    reg_pipeline.fit(X, scores["risk_score"])
+    export_forest(clf_pipeline, str(tmp_path / "rf_classifier"))
+    export_forest(reg_pipeline, str(tmp_path / "rf_regressor"))
+    classifier = load_forest(str(tmp_path / "rf_classifier"))
+    regressor = load_forest(str(tmp_path / "rf_regressor"))
+
+    test = training_rows(300, seed=6)
+    # Missing numbers are imputed and unseen categories set no column
+    test.loc[:20, "age"] = np.nan
+    test.loc[10:30, "smoking"] = "pipe"
+    for rows in (test, test.to_dict("records")):
+        np.testing.assert_allclose(classifier.predict_proba(rows), clf_pipeline.predict_proba(test), atol=1e-12)
+        np.testing.assert_array_equal(classifier.predict(rows), clf_pipeline.predict(test))
+        np.testing.assert_allclose(regressor.predict(rows), reg_pipeline.predict(test), atol=1e-9)
+    assert classifier.classes_.tolist() == clf_pipeline.classes_.tolist()
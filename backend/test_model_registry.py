@@ -0,0 +1,60 @@
+import json
+import os
+
+import pytest
+
+from model_registry import (CURRENT_FILE, RegistryError, current_version, list_versions, promote, promotion_history,
+                            publish_bundle, read_manifest, rollback)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    model_file = tmp_path / "rf_classifier_pipeline.pkl"
+    model_file.write_bytes(b"model")
+    registry_dir = str(tmp_path / "registry")
+    versions = [publish_bundle(registry_dir, [str(model_file)], {"metrics": {"accuracy": 0.9 + i / 100}},
+                               version=f"v{i}") for i in range(1, 4)]
+    return registry_dir, versions
+
+
+def test_publish_bundle(registry):
+    registry_dir, versions = registry
+    assert [manifest["version"] for manifest in list_versions(registry_dir)] == versions
+    assert read_manifest(registry_dir, "v2")["metrics"] == {"accuracy": 0.92}
+    assert os.path.isfile(os.path.join(registry_dir, "v2", "rf_classifier_pipeline.pkl"))
+    assert current_version(registry_dir) is None
+    with pytest.raises(RegistryError):
+        publish_bundle(registry_dir, [], {}, version="v2")
+
+
+def test_promote_and_rollback(registry):
+    registry_dir, _ = registry
+    promote(registry_dir, "v1", by="admin")
+    promote(registry_dir, "v2", by="admin")
+    promote(registry_dir, "v3", by="admin")
+    with open(os.path.join(registry_dir, CURRENT_FILE)) as f:
+        assert f.read() == "v3\n"
+
+    assert rollback(registry_dir, by="admin") == "v2"
+    assert rollback(registry_dir, by="admin") == "v1"
+    assert current_version(registry_dir) == "v1"
+    with pytest.raises(RegistryError):
+        rollback(registry_dir)
+
+    with open(os.path.join(registry_dir, "history.json")) as f:
+        history = json.load(f)
+    assert history == promotion_history(registry_dir)
+    assert [(entry["version"], entry["previous"], entry["action"]) for entry in history] == [
+        ("v1", None, "promote"), ("v2", "v1", "promote"), ("v3", "v2", "promote"),
+        ("v2", "v3", "rollback"), ("v1", "v2", "rollback")]
+    assert all(entry["by"] == "admin" for entry in history)
+
+
+def test_promote_unknown_version(registry):
+    registry_dir, _ = registry
+    promote(registry_dir, "v1")
+    for version in ("v9", "../v1", ".lock"):
+        with pytest.raises(RegistryError):
+            promote(registry_dir, version)
+    assert current_version(registry_dir) == "v1"
+    assert len(promotion_history(registry_dir)) == 1
@@ -0,0 +1,52 @@
+import itertools
+import os
+from types import SimpleNamespace
+
+import joblib
+import numpy as np
+import pytest
+
+from model_registry import read_manifest
+from model_search import SEARCH_SPACE, candidate_key, random_candidates, refit_best
+from risk_engine import calculate_risk_score_batch
+from test_model_artifacts import training_rows
+import train_model
+
+
+def small_features():
+    """Stand-in for feature_cache.Features on a few hundred generated rows"""
+    train, test = training_rows(300, seed=1), training_rows(100, seed=2)
+    preprocessor = train_model.build_preprocessor().fit(train)
+    splits = {}
+    for split, rows in (("train", train), ("test", test)):
+        scores = calculate_risk_score_batch(rows)
+        splits.update({f"X_{split}": preprocessor.transform(rows),
+                       f"y_category_{split}": np.asarray(scores["risk_category"]),
+                       f"y_score_{split}": np.asarray(scores["risk_score"])})
+    return SimpleNamespace(preprocessor=preprocessor, columns=list(train.columns),
+                           categories=sorted(set(splits["y_category_train"])), **splits)
+
+
+def test_refit_category_search_tunes_only_the_classifier(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / train_model.DATA_FILE).write_text("age\n")
+    # Parameters the regressor does not accept
+    params = {"n_estimators": 5, "class_weight": "balanced", "criterion": "entropy"}
+    version = refit_best({"params": params}, "category", small_features())
+
+    classifier = joblib.load(os.path.join("tuned", train_model.MODEL_FILES["classifier"])).steps[-1][1]
+    regressor = joblib.load(os.path.join("tuned", train_model.MODEL_FILES["regressor"])).steps[-1][1]
+    assert (classifier.n_estimators, classifier.class_weight, classifier.criterion) == (5, "balanced", "entropy")
+    assert (regressor.n_estimators, regressor.criterion) == (100, "squared_error")
+    manifest = read_manifest(train_model.REGISTRY_DIR, version)
+    assert manifest["models"] == ["classifier", "regressor"]
+    assert manifest["search"]["params"] == params
+
+
+def test_random_candidates_are_distinct_and_bounded():
+    size = len(list(itertools.product(*SEARCH_SPACE.values())))
+    candidates = random_candidates(size, seed=3)
+    assert len({candidate_key(params) for params in candidates}) == size
+    assert random_candidates(10, seed=3) == random_candidates(10, seed=3)
+    with pytest.raises(SystemExit):
+        random_candidates(size + 1, seed=3)
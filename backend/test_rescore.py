@@ -0,0 +1,75 @@
+import pytest
+
+from conftest import ASSESSMENT, HEADERS
+
+
+def submit(client, payload):
+    response = client.post("/api/symptom-checker", json=payload, headers=HEADERS)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["data"]
+
+
+def rescore(client, assessment_id, changes):
+    return client.post(f"/api/symptom-checker/{assessment_id}/rescore", json={"changes": changes}, headers=HEADERS)
+
+
+def test_rescore_matches_new_submission(client):
+    parent = submit(client, ASSESSMENT)
+    changes = {"abnormal_pap_smear": "yes", "smoking": "Current", "cigarettes_per_day": "10–19"}
+    response = rescore(client, parent["id"], changes)
+    assert response.status_code == 200, response.get_json()
+    rescored = response.get_json()["data"]
+
+    fresh = submit(client, dict(ASSESSMENT, **changes))
+    assert rescored["parent_id"] == parent["id"]
+    for field in ("risk_score", "risk_category", "scenario", "predefined_recommendations",
+                  "personalized_recommendations"):
+        assert rescored[field] == fresh[field]
+
+
+@pytest.mark.parametrize("changes, field", [
+    ({"marital_status": None}, "marital_status"),
+    ({"smoking": ["a"]}, "smoking"),
+    ({"smoking": "x" * 50}, "smoking"),
+    ({"dob": "15/06/1985"}, "dob"),
+])
+def test_rescore_rejects_invalid_changes(client, changes, field):
+    from app import SymptomHistory
+    parent = submit(client, ASSESSMENT)
+    response = rescore(client, parent["id"], changes)
+    assert response.status_code == 400
+    body = response.get_json()
+    assert not body["success"]
+    assert list(body["errors"]) == [field]
+    assert SymptomHistory.query.count() == 1
+
+
+def test_rescore_without_stored_levels(client, app_db):
+    from app import SymptomHistory
+    parent = submit(client, ASSESSMENT)
+    # Assessed before levels were stored
+    app_db.session.get(SymptomHistory, parent["id"]).risk_levels = None
+    app_db.session.commit()
+    changes = {"hiv_positive": "yes", "is_post_coital_or_post_menopausal": "yes"}
+    response = rescore(client, parent["id"], changes)
+    assert response.status_code == 200, response.get_json()
+
+    fresh = submit(client, dict(ASSESSMENT, **changes))
+    for field in ("risk_score", "risk_category", "scenario", "personalized_recommendations"):
+        assert response.get_json()["data"][field] == fresh[field]
+
+
+def test_rescore_ignores_levels_from_older_rules(client, app_db):
+    from app import SymptomHistory
+    parent = submit(client, ASSESSMENT)
+    # Scored under older rules, whose table index means other levels
+    row = app_db.session.get(SymptomHistory, parent["id"])
+    row.rules_version, row.risk_levels = 1, 0
+    app_db.session.commit()
+    changes = {"smoking": "Current", "cigarettes_per_day": ">20"}
+    response = rescore(client, parent["id"], changes)
+    assert response.status_code == 200, response.get_json()
+
+    fresh = submit(client, dict(ASSESSMENT, **changes))
+    for field in ("risk_score", "risk_category", "scenario", "personalized_recommendations"):
+        assert response.get_json()["data"][field] == fresh[field]
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from risk_engine import (BASE_RISK, BASE_RISK_POST_COITAL, TABLE_SHAPE, build_risk_table, calculate_risk_score_batch,
+                         levels_from_index, load_risk_table, lookup_risk_score, patch_levels, patient_levels,
+                         preprocess_answers, risk_category, risk_modifiers, scenario_id, score_answers)
+from risk_harness import VOCABULARIES, generate_answers, score_reference
+
+ROWS = 5000
+
+
+@pytest.mark.parametrize("vocabulary", sorted(VOCABULARIES))
+def test_batch_matches_per_row(vocabulary):
+    rng = np.random.default_rng(1)
+    raw, _ = VOCABULARIES[vocabulary](generate_answers(ROWS, rng), rng)
+    frame = pd.DataFrame(raw)
+    batch = calculate_risk_score_batch(frame)
+
+    records = frame.to_dict("records")
+    scores = np.array([score_answers(record)[0] for record in records])
+    np.testing.assert_array_equal(batch["risk_score"], scores)
+    assert batch["risk_category"].tolist() == [risk_category(score) for score in scores]
+    assert batch["scenario_id"].tolist() == [scenario_id(patient_levels(preprocess_answers(record)))
+                                             for record in records]
+
+
+def test_table_matches_rules():
+    table = load_risk_table()
+    np.testing.assert_array_equal(table, build_risk_table())
+
+    # Sampled cells against the modifier walk, which applies the rules one at a time
+    rng = np.random.default_rng(2)
+    for index in rng.integers(0, int(np.prod(TABLE_SHAPE)), ROWS).tolist():
+        levels = levels_from_index(index)
+        scenario, modifiers = risk_modifiers(levels)
+        base = (BASE_RISK_POST_COITAL if levels["is_post_coital_or_post_menopausal"] else BASE_RISK)[scenario]
+        assert lookup_risk_score(levels) == pytest.approx(base + sum(delta for _, delta in modifiers))
+
+
+@pytest.mark.parametrize("vocabulary", sorted(VOCABULARIES))
+def test_table_lookup_matches_reference(vocabulary):
+    rng = np.random.default_rng(3)
+    raw, effective = VOCABULARIES[vocabulary](generate_answers(ROWS, rng), rng)
+    scores = np.array([score_answers(record)[0] for record in pd.DataFrame(raw).to_dict("records")])
+    np.testing.assert_array_equal(scores, score_reference(effective))
+
+
+def test_patch_levels_matches_full_recompute():
+    rng = np.random.default_rng(4)
+    before, _ = VOCABULARIES["form"](generate_answers(ROWS, rng), rng)
+    after, _ = VOCABULARIES["form"](generate_answers(ROWS, rng), rng)
+    before, after = pd.DataFrame(before).to_dict("records"), pd.DataFrame(after).to_dict("records")
+    fields = list(before[0])
+    for old, new in zip(before, after):
+        changed = set(rng.choice(fields, rng.integers(1, 4), replace=False).tolist())
+        answers = dict(old, **{field: new[field] for field in changed})
+        levels = patient_levels(preprocess_answers(old))
+        assert patch_levels(levels, answers, changed)[0] == patient_levels(preprocess_answers(answers))
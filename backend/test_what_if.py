@@ -0,0 +1,22 @@
+from conftest import ASSESSMENT, HEADERS
+
+
+def test_what_if_ignores_levels_from_older_rules(client, app_db):
+    from app import SymptomHistory, User
+    ids = []
+    for _ in range(2):
+        response = client.post("/api/symptom-checker", json=dict(ASSESSMENT, smoking="Current", cigarettes_per_day=">20"),
+                               headers=HEADERS)
+        ids.append(response.get_json()["data"]["id"])
+    app_db.session.get(User, 1).role = "provider"
+    # Scored under older rules, whose table index means other levels
+    row = app_db.session.get(SymptomHistory, ids[1])
+    row.rules_version, row.risk_levels = 1, 0
+    app_db.session.commit()
+
+    response = client.post("/api/provider/what-if", json={"assessment_ids": ids}, headers=HEADERS)
+    assert response.status_code == 200, response.get_json()
+    current, stale = response.get_json()["data"]["assessments"]
+    assert stale["risk_score"] == current["risk_score"]
+    assert stale["contributions"] == current["contributions"]
+    assert stale["contributions"]["smoking"] > 0
@@ -1,128 +1,191 @@
+"""
+Train the risk category classifier and risk score regressor.
+
+    python train_model.py                  train both forests, save and publish them
+    python train_model.py --single-model   train one risk score forest instead; the
+                                           category comes from the score
+    python train_model.py --sweep          compare forest sizes (see model_sweep.py)
+    python train_model.py --search         cross-validated parameter search (see model_search.py)
+    python train_model.py --stream         train on a file too large for memory (see train_streaming.py)
+"""
+
+import argparse
+import os
+import sys
+import time
+
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder, OneHotEncoder
+from sklearn.preprocessing import OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
 import joblib
+import sklearn
+from ml_service import FOREST_DIRS, MODEL_FILES
+from model_artifacts import export_forest
+from model_registry import current_version, file_sha256, promote, publish_bundle
+from risk_engine import risk_categories
 from sklearn.metrics import accuracy_score, mean_squared_error, classification_report, mean_absolute_error
 
-# Load data
-data = pd.read_csv("cervical_cancer_synthetic_data_20250519_171741.csv")
-
-# Rename risk_percent to risk_score for consistency
-data = data.rename(columns={'risk_percent': 'risk_score'})
-
-# Print data information for verification
-print("Dataset shape:", data.shape)
-print("\nColumns in dataset:", data.columns.tolist())
-print("\nSample data:")
-print(data.head())
+DATA_FILE = "cervical_cancer_synthetic_data_20250519_171741.csv"
+REGISTRY_DIR = os.path.join("models", "registry")
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
 
 # Identify feature types
 numerical_features = ['age', 'parity']
 categorical_features = [
     'abnormal_vaginal_bleeding', 'abnormal_vaginal_discharge', 'lower_abdominal_pain',
-    'is_post_coital_or_post_menopausal', 'change_in_periods', 'dyspareunia', 
-    'weight_loss', 'unusual_fatigue', 'sexual_partners', 'smoking', 
-    'marital_status', 'oral_contraceptive_use', 'age_first_intercourse', 
-    'abnormal_pap_smear', 'high_parity', 'hiv_positive'
+    'is_post_coital_or_post_menopausal', 'change_in_periods', 'dyspareunia',
+    'weight_loss', 'unusual_fatigue', 'sexual_partners', 'smoking',
+    'marital_status', 'oral_contraceptive_use', 'age_first_intercourse',
+    'abnormal_pap_smear', 'high_parity', 'hiv_positive',
+    # Missing bleeding types are filled with 'none' in load_data
+    'bleeding_type',
 ]
 
-# Handle bleeding type separately since it can be None
-data['bleeding_type'] = data['bleeding_type'].fillna('none')
-
-# Add bleeding_type to categorical features
-categorical_features.append('bleeding_type')
-
-# Features and targets
-X = data.drop(['patient_id', 'risk_score', 'risk_category'], axis=1)
-y_category = data['risk_category']
-y_score = data['risk_score']
-
-# Verify feature set
-print("\nFeatures used:", X.columns.tolist())
-print("Target categories:", y_category.unique())
-print("Risk score range:", y_score.min(), "to", y_score.max())
-
-# Check for missing values
-print("\nMissing values in features:")
-print(X.isna().sum())
-
-# Print value counts for categorical features
-print("\nValue counts for selected categorical features:")
-for col in ['abnormal_vaginal_bleeding', 'abnormal_vaginal_discharge', 'lower_abdominal_pain']:
-    print(f"\n{col}:")
-    print(X[col].value_counts())
-
-# Print risk category distribution
-print("\nRisk category distribution:")
-print(y_category.value_counts())
-
-# Create preprocessing pipeline
-# For numerical features - impute missing values with mean
-numerical_transformer = Pipeline(steps=[
-    ('imputer', SimpleImputer(strategy='mean'))
-])
-
-# For categorical features - impute missing values and then one-hot encode
-categorical_transformer = Pipeline(steps=[
-    ('imputer', SimpleImputer(strategy='constant', fill_value='missing')),
-    ('onehot', OneHotEncoder(handle_unknown='ignore'))
-])
-
-# Combine transformers in a column transformer
-preprocessor = ColumnTransformer(
-    transformers=[
-        ('num', numerical_transformer, numerical_features),
-        ('cat', categorical_transformer, categorical_features)
+
+def load_data(path=DATA_FILE, verbose=True):
+    """Features, risk categories and risk scores from the synthetic data CSV"""
+    data = pd.read_csv(path)
+
+    # Rename risk_percent to risk_score for consistency
+    data = data.rename(columns={'risk_percent': 'risk_score'})
+
+    if verbose:
+        # Print data information for verification
+        print("Dataset shape:", data.shape)
+        print("\nColumns in dataset:", data.columns.tolist())
+        print("\nSample data:")
+        print(data.head())
+
+    # Handle bleeding type separately since it can be None
+    data['bleeding_type'] = data['bleeding_type'].fillna('none')
+
+    # Features and targets
+    X = data.drop(['patient_id', 'risk_score', 'risk_category'], axis=1)
+    y_category = data['risk_category']
+    y_score = data['risk_score']
+
+    if verbose:
+        # Verify feature set
+        print("\nFeatures used:", X.columns.tolist())
+        print("Target categories:", y_category.unique())
+        print("Risk score range:", y_score.min(), "to", y_score.max())
+
+        # Check for missing values
+        print("\nMissing values in features:")
+        print(X.isna().sum())
+
+        # Print value counts for categorical features
+        print("\nValue counts for selected categorical features:")
+        for col in ['abnormal_vaginal_bleeding', 'abnormal_vaginal_discharge', 'lower_abdominal_pain']:
+            print(f"\n{col}:")
+            print(X[col].value_counts())
+
+        # Print risk category distribution
+        print("\nRisk category distribution:")
+        print(y_category.value_counts())
+
+    return X, y_category, y_score
+
+
+def build_preprocessor():
+    # For numerical features - impute missing values with mean
+    numerical_transformer = Pipeline(steps=[
+        ('imputer', SimpleImputer(strategy='mean'))
+    ])
+
+    # For categorical features - impute missing values and then one-hot encode
+    categorical_transformer = Pipeline(steps=[
+        ('imputer', SimpleImputer(strategy='constant', fill_value='missing')),
+        ('onehot', OneHotEncoder(handle_unknown='ignore'))
     ])
 
-# Split data
-X_train, X_test, y_category_train, y_category_test, y_score_train, y_score_test = train_test_split(
-    X, y_category, y_score, test_size=0.2, random_state=42)
+    # Combine transformers in a column transformer
+    return ColumnTransformer(
+        transformers=[
+            ('num', numerical_transformer, numerical_features),
+            ('cat', categorical_transformer, categorical_features)
+        ])
 
-# Create and train classifier pipeline for risk category
-clf_pipeline = Pipeline(steps=[
-    ('preprocessor', preprocessor),
-    ('classifier', RandomForestClassifier(n_estimators=100, random_state=42))
-])
 
-clf_pipeline.fit(X_train, y_category_train)
+def split_data(X, y_category, y_score):
+    """(X_train, X_test, y_category_train, y_category_test, y_score_train, y_score_test)"""
+    return train_test_split(X, y_category, y_score, test_size=TEST_SIZE, random_state=RANDOM_STATE)
 
-# Create and train regressor pipeline for risk score
-reg_pipeline = Pipeline(steps=[
-    ('preprocessor', preprocessor),
-    ('regressor', RandomForestRegressor(n_estimators=100, random_state=42))
-])
 
-reg_pipeline.fit(X_train, y_score_train)
+def build_pipelines(forest_params=None, classifier_params=None, regressor_params=None):
+    """
+    Unfitted classifier and regressor pipelines; forest_params go to both
+    forests, classifier_params and regressor_params only to that one.
+    """
+    params = dict({'n_estimators': 100, 'random_state': RANDOM_STATE}, **(forest_params or {}))
+    clf_pipeline = Pipeline(steps=[
+        ('preprocessor', build_preprocessor()),
+        ('classifier', RandomForestClassifier(**dict(params, **(classifier_params or {}))))
+    ])
+    reg_pipeline = Pipeline(steps=[
+        ('preprocessor', build_preprocessor()),
+        ('regressor', RandomForestRegressor(**dict(params, **(regressor_params or {}))))
+    ])
+    return clf_pipeline, reg_pipeline
 
-# Evaluate models
-y_category_pred = clf_pipeline.predict(X_test)
-y_score_pred = reg_pipeline.predict(X_test)
 
-print("\nClassifier Results:")
-print("Accuracy:", accuracy_score(y_category_test, y_category_pred))
-print("\nClassification Report:")
-print(classification_report(y_category_test, y_category_pred))
+def evaluate(clf_pipeline, reg_pipeline, X_test, y_category_test, y_score_test):
+    """Held-out metrics of pipelines on raw rows or forests on encoded ones; also returns the category predictions"""
+    y_score_pred = reg_pipeline.predict(X_test)
+    # Without a classifier the category is the score's, as in the rules
+    y_category_pred = clf_pipeline.predict(X_test) if clf_pipeline is not None else risk_categories(y_score_pred)
+    metrics = {
+        "accuracy": accuracy_score(y_category_test, y_category_pred),
+        "mse": mean_squared_error(y_score_test, y_score_pred),
+        "mae": mean_absolute_error(y_score_test, y_score_pred),
+    }
+    metrics["rmse"] = float(np.sqrt(metrics["mse"]))
+    return {name: float(value) for name, value in metrics.items()}, y_category_pred
 
-print("\nRegressor Results:")
-print("Mean Squared Error:", mean_squared_error(y_score_test, y_score_pred))
-print("Mean Absolute Error:", mean_absolute_error(y_score_test, y_score_pred))
-print("Root Mean Squared Error:", np.sqrt(mean_squared_error(y_score_test, y_score_pred)))
 
-# Feature importance for classifier
-if hasattr(clf_pipeline.named_steps['classifier'], 'feature_importances_'):
+def fit_models(features, forest_params=None, single_model=False, classifier_params=None, regressor_params=None):
+    """
+    Fit the classifier and regressor, or with single_model only the
+    regressor, on the training split of features (feature_cache.Features),
+    with the parameters of build_pipelines. Returns (pipelines by
+    MODEL_FILES name, held-out metrics, category predictions, fit seconds).
+    """
+    clf_pipeline, reg_pipeline = build_pipelines(forest_params, classifier_params, regressor_params)
+    # The preprocessor comes fitted from the feature cache; only the forests
+    # are fitted, on the already encoded rows
+    clf_pipeline.steps[0] = reg_pipeline.steps[0] = ('preprocessor', features.preprocessor)
+    classifier, regressor = clf_pipeline.steps[-1][1], reg_pipeline.steps[-1][1]
+    start = time.perf_counter()
+    regressor.fit(features.X_train, features.y_score_train)
+    if single_model:
+        classifier = None
+        pipelines = {'combined': reg_pipeline}
+    else:
+        classifier.fit(features.X_train, features.y_category_train)
+        pipelines = {'classifier': clf_pipeline, 'regressor': reg_pipeline}
+    fit_seconds = time.perf_counter() - start
+    metrics, y_category_pred = evaluate(classifier, regressor, features.X_test, features.y_category_test,
+                                        features.y_score_test)
+    return pipelines, metrics, y_category_pred, fit_seconds
+
+
+def print_feature_importances(pipeline, title="Classification"):
+    forest = pipeline.steps[-1][1]
+    if not hasattr(forest, 'feature_importances_'):
+        return
     # Get feature names after preprocessing
-    cat_features = clf_pipeline.named_steps['preprocessor'].transformers_[1][1].named_steps['onehot'].get_feature_names_out(categorical_features)
+    cat_features = pipeline.named_steps['preprocessor'].transformers_[1][1].named_steps['onehot'].get_feature_names_out(categorical_features)
     feature_names = list(numerical_features) + list(cat_features)
-    
+
     # Get feature importances
-    importances = clf_pipeline.named_steps['classifier'].feature_importances_
-    
+    importances = forest.feature_importances_
+
     # Handle potential length mismatch
     if len(importances) == len(feature_names):
         # Create a DataFrame for feature importances
@@ -130,28 +193,127 @@ if hasattr(clf_pipeline.named_steps['classifier'], 'feature_importances_'):
             'Feature': feature_names,
             'Importance': importances
         }).sort_values(by='Importance', ascending=False)
-        
-        print("\nTop 10 Features for Classification:")
+
+        print(f"\nTop 10 Features for {title}:")
         print(feature_importance_df.head(10))
     else:
-        print("\nCouldn't match feature importances to feature names. Shapes:", 
+        print("\nCouldn't match feature importances to feature names. Shapes:",
               len(importances), len(feature_names))
 
-# Save models
-joblib.dump(clf_pipeline, "rf_classifier_pipeline.pkl")
-joblib.dump(reg_pipeline, "rf_regressor_pipeline.pkl")
 
-print("\nModels saved as rf_classifier_pipeline.pkl and rf_regressor_pipeline.pkl")
+def save_and_publish(pipelines, metrics, features, categories, directory=".", extra_manifest=None,
+                     promote_first=True, data_file=DATA_FILE):
+    """
+    Save the pipelines (MODEL_FILES name -> fitted pipeline) as pickles and
+    flat exports in directory and publish them as a registry bundle with the
+    feature columns and target categories they were trained on; returns its
+    version. The first bundle in an empty registry is promoted when
+    promote_first is set.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, pipeline in pipelines.items():
+        path = os.path.join(directory, MODEL_FILES[name])
+        forest_dir = os.path.join(directory, FOREST_DIRS[name])
+        joblib.dump(pipeline, path)
+        # Flat array copy the app memory-maps, shared by all of its workers
+        export_forest(pipeline, forest_dir)
+        paths += [path, forest_dir]
+
+    print(f"\nModels saved as {' and '.join(paths[0::2])}")
+    print(f"Memory-mappable exports saved in {' and '.join(path + '/' for path in paths[1::2])}")
+
+    # Publish an immutable registry bundle. Workers switch to it once it is
+    # promoted (POST /api/admin/models/promote).
+    forest = next(iter(pipelines.values())).steps[-1][1]
+    version = publish_bundle(REGISTRY_DIR, paths, dict({
+        "training_data": data_file,
+        "training_data_sha256": file_sha256(data_file),
+        "features": list(features),
+        "target_categories": sorted(categories),
+        "models": list(pipelines),
+        "metrics": metrics,
+        "test_size": TEST_SIZE,
+        "forest_params": {name: value for name, value in forest.get_params().items()
+                          if isinstance(value, (int, float, str, bool, type(None)))},
+        "sklearn_version": sklearn.__version__,
+    }, **(extra_manifest or {})))
+    print(f"Published model version {version} to {REGISTRY_DIR}")
+    if promote_first and current_version(REGISTRY_DIR) is None:
+        promote(REGISTRY_DIR, version, by="train_model.py")
+        print(f"Promoted {version}: it is the first version in the registry")
+    return version
+
+
+def train(single_model=False, refresh_features=False):
+    import feature_cache
+    # Parsed and encoded once per data file and preprocessing settings
+    features = feature_cache.load_features(refresh=refresh_features, verbose=True)
+    y_category_test, y_score_test = features.y_category_test, features.y_score_test
+
+    # Create and train classifier and regressor pipelines for risk category and
+    # score, or a single score pipeline
+    pipelines, metrics, y_category_pred, _ = fit_models(features, single_model=single_model)
+    reg_pipeline = pipelines['combined' if single_model else 'regressor']
+
+    print("\nClassifier Results:" if not single_model else "\nRisk Category Results (from the predicted score):")
+    print("Accuracy:", metrics["accuracy"])
+    print("\nClassification Report:")
+    print(classification_report(y_category_test, y_category_pred))
+
+    print("\nRegressor Results:")
+    print("Mean Squared Error:", metrics["mse"])
+    print("Mean Absolute Error:", metrics["mae"])
+    print("Root Mean Squared Error:", metrics["rmse"])
+
+    if single_model:
+        print_feature_importances(reg_pipeline, "the Risk Score")
+    else:
+        print_feature_importances(pipelines['classifier'])
+
+    save_and_publish(pipelines, metrics, features.columns, features.categories)
+
+    # Test prediction on a sample data point
+    sample = features.raw_test.iloc[0:1]
+    print("\nSample patient data:")
+    print(sample)
+
+    predicted_score = reg_pipeline.predict(sample)[0]
+    predicted_category = risk_categories(predicted_score) if single_model else pipelines['classifier'].predict(sample)[0]
+
+    print(f"\nPredicted risk category: {predicted_category}")
+    print(f"Predicted risk score: {predicted_score:.2f}")
+    print(f"Actual risk category: {y_category_test[0]}")
+    print(f"Actual risk score: {y_score_test[0]:.2f}")
+
 
-# Test prediction on a sample data point
-sample = X_test.iloc[0:1]
-print("\nSample patient data:")
-print(sample)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--single-model", action="store_true",
+                        help="train one risk score forest and derive the category from the score")
+    parser.add_argument("--refresh-features", action="store_true",
+                        help="encode the data again instead of using the feature cache (feature_cache.py)")
+    parser.add_argument("--sweep", action="store_true",
+                        help="compare forest sizes instead; see python model_sweep.py --help for its options")
+    parser.add_argument("--search", action="store_true",
+                        help="search forest parameters instead; see python model_search.py --help for its options")
+    parser.add_argument("--stream", action="store_true",
+                        help="train chunk by chunk instead; see python train_streaming.py --help for its options")
+    args, rest = parser.parse_known_args(argv)
+    if args.stream:
+        import train_streaming
+        return train_streaming.main(rest + (["--single-model"] if args.single_model else []))
+    if args.search:
+        import model_search
+        return model_search.main(rest)
+    if args.sweep:
+        import model_sweep
+        return model_sweep.main(rest + (["--single-model"] if args.single_model else []))
+    if rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    train(args.single_model, args.refresh_features)
+    return 0
 
-predicted_category = clf_pipeline.predict(sample)[0]
-predicted_score = reg_pipeline.predict(sample)[0]
 
-print(f"\nPredicted risk category: {predicted_category}")
-print(f"Predicted risk score: {predicted_score:.2f}")
-print(f"Actual risk category: {y_category_test.iloc[0]}")
-print(f"Actual risk score: {y_score_test.iloc[0]:.2f}")
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
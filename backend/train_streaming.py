@@ -0,0 +1,307 @@
+"""
+Train the risk forests on a CSV or Parquet file too large for memory.
+
+The file is read in --chunk-rows chunks, three times:
+
+1. A scan collects each feature's categories and numeric mean over the
+   training rows, and the row count. The usual preprocessor
+   (train_model.build_preprocessor) is fitted on a small frame with those
+   categories and means, which gives the same encoder as fitting it on all
+   the training rows.
+2. Training grows the forests with warm_start. Every chunk's training rows
+   are subsampled into a buffer of about one chunk; each time the buffer is
+   full the next few trees are fitted on it, so the forests end up with
+   --trees trees drawn from the whole file.
+3. Evaluation predicts each chunk's held-out rows and accumulates the metrics.
+
+Held-out rows are drawn per chunk with a seeded generator (TEST_SIZE of them),
+so they are the same in every pass. Peak memory is a chunk, the buffer and the
+forests, whatever the file size. Tree size grows with the buffer, so use
+--max-depth or --min-samples-leaf to bound the forests themselves.
+
+    python train_model.py --stream --data corpus.csv --chunk-rows 200000
+    python train_streaming.py --data corpus.parquet --single-model --min-samples-leaf 5
+
+Parquet input needs pyarrow.
+"""
+
+import argparse
+import math
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from risk_engine import risk_categories
+import train_model
+
+DROPPED_COLUMNS = ("patient_id", "risk_score", "risk_category")
+REQUIRED_COLUMNS = tuple(train_model.numerical_features + train_model.categorical_features) + \
+    ("risk_score", "risk_category")
+
+
+def read_chunks(path, chunk_rows):
+    """DataFrames of chunk_rows rows from a CSV or Parquet file"""
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet input needs pyarrow: pip install pyarrow")
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+        return
+    # Read as text so a column's type never depends on which rows landed in
+    # a chunk; prepare_chunk converts them as a whole-file read would
+    yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str)
+
+
+class Pass:
+    """Rows, bytes and time of one pass over the file, for throughput"""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.total_bytes = os.path.getsize(path)
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.seconds = None
+
+    def add(self, rows):
+        self.rows += rows
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+        return self
+
+    def report(self):
+        return {"rows": self.rows, "seconds": round(self.seconds, 2),
+                "rows_per_sec": round(self.rows / self.seconds) if self.seconds else None,
+                "mb_per_sec": round(self.total_bytes / 1e6 / self.seconds, 1) if self.seconds else None}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def test_mask(chunk_index, rows):
+    # Seeded by the chunk, so every pass holds out the same rows
+    return np.random.default_rng([train_model.RANDOM_STATE, chunk_index]).random(rows) < train_model.TEST_SIZE
+
+
+def scan(path, chunk_rows):
+    """Pass 1: categories and numeric sums of the training rows, and the row count"""
+    progress = Pass("scan", path)
+    categories = {column: set() for column in train_model.categorical_features}
+    sums = {column: [0.0, 0] for column in train_model.numerical_features}
+    targets = set()
+    columns = None
+    for index, chunk in enumerate(read_chunks(path, chunk_rows)):
+        progress.add(len(chunk))
+        chunk = chunk.rename(columns={"risk_percent": "risk_score"})
+        if columns is None:
+            missing = [column for column in REQUIRED_COLUMNS if column not in chunk]
+            if missing:
+                raise SystemExit(f"Columns missing from {path}: {', '.join(missing)}")
+            columns = [column for column in chunk.columns if column not in DROPPED_COLUMNS]
+        # The preprocessor is fitted on the training rows, as in train_model.py
+        chunk = chunk[~test_mask(index, len(chunk))].copy()
+        chunk["bleeding_type"] = chunk["bleeding_type"].fillna("none")
+        for column in train_model.categorical_features:
+            categories[column].update(chunk[column].dropna().unique().tolist())
+            if chunk[column].isna().any():
+                categories[column].add(None)
+        for column in train_model.numerical_features:
+            values = pd.to_numeric(chunk[column])
+            sums[column][0] += float(values.sum())
+            sums[column][1] += int(values.count())
+        targets.update(chunk["risk_category"].dropna().unique().tolist())
+    if not progress.rows:
+        raise SystemExit(f"No rows in {path}")
+    # Columns read as text whose only values are True and False, which a
+    # whole-file read parses as booleans
+    boolean = [column for column, values in categories.items() if values and values <= {"True", "False"}]
+    for column in boolean:
+        categories[column] = {value == "True" for value in categories[column]}
+    return {
+        "columns": columns,
+        "rows": progress.rows,
+        "categories": {column: sorted(values, key=lambda value: (value is None, str(value)))
+                       for column, values in categories.items()},
+        "means": {column: total / count if count else 0.0 for column, (total, count) in sums.items()},
+        "boolean": boolean,
+        "targets": sorted(targets),
+        "pass": progress.finish(),
+    }
+
+
+def summary_frame(stats):
+    """A few rows with every category and the numeric means of the whole file"""
+    rows = max(len(values) for values in stats["categories"].values())
+    frame = {column: [stats["means"][column]] * rows for column in train_model.numerical_features}
+    for column, values in stats["categories"].items():
+        values = [np.nan if value is None else value for value in values] or ["missing"]
+        frame[column] = [values[i % len(values)] for i in range(rows)]
+    return pd.DataFrame(frame)
+
+
+def prepare_chunk(chunk, stats):
+    """(features, categories, scores) of one chunk, typed like load_data's"""
+    chunk = chunk.rename(columns={"risk_percent": "risk_score"})
+    chunk["bleeding_type"] = chunk["bleeding_type"].fillna("none")
+    for column in train_model.numerical_features:
+        chunk[column] = pd.to_numeric(chunk[column])
+    for column in stats["boolean"]:
+        chunk[column] = chunk[column].map({"True": True, "False": False})
+    return chunk[stats["columns"]], chunk["risk_category"].to_numpy(), pd.to_numeric(chunk["risk_score"]).to_numpy()
+
+
+def build_streaming_pipelines(stats, forest_params, single_model):
+    """Pipelines with the preprocessor fitted on the summary and warm-start forests with no trees yet"""
+    clf_pipeline, reg_pipeline = train_model.build_pipelines(dict(forest_params, n_estimators=0, warm_start=True))
+    summary = summary_frame(stats)
+    pipelines = {"combined": reg_pipeline} if single_model else {"classifier": clf_pipeline, "regressor": reg_pipeline}
+    for pipeline in pipelines.values():
+        pipeline.steps[0][1].fit(summary)
+    return pipelines
+
+
+def fit_round(pipelines, X, y_category, y_score, trees):
+    """Add trees to each forest, fitted on one buffer of encoded rows"""
+    for name, pipeline in pipelines.items():
+        forest = pipeline.steps[-1][1]
+        forest.n_estimators += trees
+        forest.fit(X, y_category if name == "classifier" else y_score)
+
+
+def train_pass(path, chunk_rows, stats, pipelines, trees):
+    """Pass 2: fit the forests round by round"""
+    progress = Pass("train", path)
+    chunks = math.ceil(stats["rows"] / chunk_rows)
+    # With more chunks than trees each round gathers a sample of several chunks
+    chunks_per_round = max(1, math.ceil(chunks / trees))
+    preprocessor = next(iter(pipelines.values())).steps[0][1]
+    buffer, fitted_trees = [], 0
+    for index, chunk in enumerate(read_chunks(path, chunk_rows)):
+        X, y_category, y_score = prepare_chunk(chunk, stats)
+        keep = ~test_mask(index, len(X))
+        if chunks_per_round > 1:
+            keep &= np.random.default_rng([train_model.RANDOM_STATE, index, 1]).random(len(X)) < 1 / chunks_per_round
+        buffer.append((preprocessor.transform(X[keep]), y_category[keep], y_score[keep]))
+        progress.add(len(chunk))
+        last = index == chunks - 1
+        if (index + 1) % chunks_per_round and not last:
+            continue
+        categories = set().union(*(set(part[1]) for part in buffer))
+        # Every classifier round needs every category, or warm_start would
+        # change classes_ under the trees already fitted; carry the buffer on
+        if "classifier" in pipelines and categories != set(stats["targets"]) and not last:
+            continue
+        if "classifier" in pipelines and categories != set(stats["targets"]):
+            raise SystemExit(f"The last training rows lack categories {set(stats['targets']) - categories}; "
+                             f"use larger --chunk-rows")
+        # Trees in proportion to the rows read so far, --trees after the last
+        round_trees = max(1, trees * progress.rows // stats["rows"] - fitted_trees)
+        X_round = np.vstack([part[0].toarray() if hasattr(part[0], "toarray") else part[0] for part in buffer])
+        fit_round(pipelines, X_round, np.concatenate([part[1] for part in buffer]),
+                  np.concatenate([part[2] for part in buffer]), round_trees)
+        fitted_trees += round_trees
+        buffer = []
+        print(f"{progress.rows:,} rows: {len(X_round):,} fitted, {fitted_trees} trees", file=sys.stderr)
+    return progress.finish()
+
+
+def evaluate_pass(path, chunk_rows, stats, pipelines):
+    """Pass 3: metrics on the held-out rows, one chunk at a time"""
+    progress = Pass("evaluate", path)
+    reg_pipeline = pipelines.get("regressor") or pipelines["combined"]
+    rows, abs_error, squared_error = 0, 0.0, 0.0
+    # (true, predicted) category -> rows, so memory does not grow with the file
+    confusion = {}
+    for index, chunk in enumerate(read_chunks(path, chunk_rows)):
+        X, y_category, y_score = prepare_chunk(chunk, stats)
+        mask = test_mask(index, len(X))
+        progress.add(len(chunk))
+        if not mask.any():
+            continue
+        X, y_category, y_score = X[mask], y_category[mask], y_score[mask]
+        score_pred = reg_pipeline.predict(X)
+        category_pred = pipelines["classifier"].predict(X) if "classifier" in pipelines else risk_categories(score_pred)
+        rows += len(X)
+        abs_error += float(np.abs(score_pred - y_score).sum())
+        squared_error += float(((score_pred - y_score) ** 2).sum())
+        pairs, counts = np.unique(np.stack([y_category.astype(str), category_pred.astype(str)]), axis=1,
+                                  return_counts=True)
+        for (true, predicted), count in zip(pairs.T, counts):
+            confusion[true, predicted] = confusion.get((true, predicted), 0) + int(count)
+    if not rows:
+        raise SystemExit("No held-out rows; the file is too small to evaluate")
+    correct = sum(count for (true, predicted), count in confusion.items() if true == predicted)
+    metrics = {"accuracy": correct / rows, "mse": squared_error / rows, "mae": abs_error / rows,
+               "rmse": math.sqrt(squared_error / rows), "test_rows": rows}
+    return metrics, category_report(confusion), progress.finish()
+
+
+def category_report(confusion):
+    """Precision, recall and F1 per category, from the confusion counts"""
+    labels = sorted({label for pair in confusion for label in pair})
+    lines = [f"{'':>14}{'precision':>11}{'recall':>9}{'f1-score':>10}{'support':>10}"]
+    for label in labels:
+        hits = confusion.get((label, label), 0)
+        predicted = sum(count for (_, guess), count in confusion.items() if guess == label)
+        support = sum(count for (true, _), count in confusion.items() if true == label)
+        precision = hits / predicted if predicted else 0.0
+        recall = hits / support if support else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        lines.append(f"{label:>14}{precision:>11.2f}{recall:>9.2f}{f1:>10.2f}{support:>10,}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="train_model.py --stream", description=__doc__.split("\n\n")[0],
+                                     epilog=__doc__.split("\n\n", 1)[1], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=train_model.DATA_FILE, help="CSV or .parquet file in the training layout")
+    parser.add_argument("--chunk-rows", type=int, default=100_000, help="rows read at a time")
+    parser.add_argument("--trees", type=int, default=100, help="trees per forest")
+    parser.add_argument("--max-depth", type=int, default=None)
+    parser.add_argument("--min-samples-leaf", type=int, default=1)
+    parser.add_argument("--single-model", action="store_true",
+                        help="train one risk score forest and derive the category from the score")
+    parser.add_argument("--output", default=".", help="directory the models are saved in")
+    args = parser.parse_args(argv)
+
+    stats = scan(args.data, args.chunk_rows)
+    print(f"Scanned {stats['rows']:,} rows: {stats['pass'].report()}", file=sys.stderr)
+    forest_params = {"max_depth": args.max_depth, "min_samples_leaf": args.min_samples_leaf}
+    pipelines = build_streaming_pipelines(stats, forest_params, args.single_model)
+    training = train_pass(args.data, args.chunk_rows, stats, pipelines, args.trees)
+    metrics, report, evaluation = evaluate_pass(args.data, args.chunk_rows, stats, pipelines)
+    for pipeline in pipelines.values():
+        # Further fits should start over, not add trees
+        pipeline.steps[-1][1].warm_start = False
+
+    print(f"\nHeld-out rows: {metrics['test_rows']:,}")
+    print("Accuracy:", metrics["accuracy"])
+    print("\nClassification Report:")
+    print(report)
+    print("Mean Squared Error:", metrics["mse"])
+    print("Mean Absolute Error:", metrics["mae"])
+    print("Root Mean Squared Error:", metrics["rmse"])
+
+    passes = {run.name: run.report() for run in (stats["pass"], training, evaluation)}
+    print(f"\n{'pass':<10}{'rows':>12}{'seconds':>10}{'rows/s':>12}{'MB/s':>8}")
+    for name, run in passes.items():
+        print(f"{name:<10}{run['rows']:>12,}{run['seconds']:>10.1f}{run['rows_per_sec']:>12,}{run['mb_per_sec']:>8.1f}")
+    print(f"Peak memory: {peak_rss_mb():,.0f} MB for a {os.path.getsize(args.data) / 1e6:,.0f} MB file")
+
+    train_model.save_and_publish(pipelines, metrics, stats["columns"], stats["targets"], directory=args.output,
+                                 extra_manifest={"streaming": {"chunk_rows": args.chunk_rows, "passes": passes,
+                                                               "peak_rss_mb": round(peak_rss_mb())}},
+                                 data_file=args.data)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())